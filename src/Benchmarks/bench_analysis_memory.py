@@ -0,0 +1,147 @@
+# bench_analysis_memory.py
+"""
+Peak memory and time of analysing a large table: streamed batches of
+latitude/longitude/text vs. the previous fetch-every-column-of-every-row
+path.
+
+A synthetic table in the pre-score schema is generated once (seeded), so
+the analysis takes the raw-row path, read from SQL (columnar snapshots and
+scoring memos are disabled; see bench_table_snapshot.py and
+bench_scoring_memo.py). Each mode runs in a fresh interpreter
+and reports the growth of its peak RSS over the RSS after loading models
+(read from /proc, so Linux only).
+
+Usage:
+    python src/Benchmarks/bench_analysis_memory.py [--rows N] [--batch-size N] [--skip-legacy]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+SERVICES_DIR = BASE_DIR / 'src' / 'Services'
+DATA_DIR = BASE_DIR / 'Data'
+
+FILLER = ['the', 'a', 'to', 'at', 'with', 'my', 'this', 'today', 'game', 'snow', 'family', 'lol']
+
+CHILD = """
+import json, logging, sys, time
+from types import SimpleNamespace
+sys.path[:0] = [{analysis_dir!r}, {common_dir!r}]
+logging.disable(logging.CRITICAL)
+from collections import defaultdict
+from sqlalchemy import select
+from data_processor import DataProcessor
+from database import DatabaseManager
+from metrics import Stages
+from model_snapshot import load_models
+
+models = load_models(SimpleNamespace(snapshot_path={snapshot!r}, sentiments_path={sentiments!r},
+                                     states_path={states!r}))
+db_manager = DatabaseManager({db_path!r}, {batch_size})
+db_manager.init_db()
+processor = DataProcessor(db_manager, models.analyzer, models.locator)
+
+def rss_kib(field):
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field))
+
+# Reset the peak RSS so it doesn't include model loading
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+before = rss_kib('VmRSS:')
+start = time.perf_counter()
+if {mode!r} == 'streaming':
+    result = processor.process_table('synthetic')
+else:
+    # Previous path: every column of every row fetched into one list
+    state_totals = defaultdict(lambda: [0.0, 0])
+    counters = dict(total=0, missing_coords=0, no_sentiment=0, unknown_state=0)
+    with db_manager.engine.connect() as conn:
+        tweets = conn.execute(select(db_manager._reflect('synthetic'))).fetchall()
+    counters['total'] = len(tweets)
+    processor._add_tweets(tweets, state_totals, counters, Stages())
+    result = processor._generate_output({{s: t / c for s, (t, c) in state_totals.items()}})
+elapsed = time.perf_counter() - start
+after = rss_kib('VmHWM:')
+print(json.dumps({{'seconds': elapsed, 'peak_growth_kib': after - before, 'states': len(result)}}))
+"""
+
+
+def lexicon_words():
+    with open(DATA_DIR / 'sentiments.csv', encoding='utf-8-sig') as f:
+        return [row[0] for row in csv.reader(f) if row and ' ' not in row[0]]
+
+
+def generate_table(db_path, rows, seed=42):
+    """Create a tweets table in the schema uploads used before score columns"""
+    rng = random.Random(seed)
+    words = lexicon_words()
+    start = datetime(2014, 2, 16)
+
+    def synthetic_rows():
+        for i in range(rows):
+            text = ' '.join(rng.choice(words) if rng.random() < 0.3 else rng.choice(FILLER)
+                            for _ in range(rng.randint(4, 14)))
+            yield (rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0),
+                   (start + timedelta(seconds=i)).isoformat(' '), text)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE synthetic (id INTEGER PRIMARY KEY, latitude FLOAT NOT NULL, '
+                 'longitude FLOAT NOT NULL, created_at DATETIME NOT NULL, text VARCHAR(500) NOT NULL)')
+    conn.executemany('INSERT INTO synthetic (latitude, longitude, created_at, text) VALUES (?, ?, ?, ?)',
+                     synthetic_rows())
+    conn.commit()
+    conn.close()
+
+
+def run(mode, db_path, snapshot_path, batch_size):
+    child = CHILD.format(
+        analysis_dir=str(SERVICES_DIR / 'SentimentAnalysisService'),
+        common_dir=str(SERVICES_DIR / 'Common'),
+        snapshot=str(snapshot_path),
+        sentiments=str(DATA_DIR / 'sentiments.csv'),
+        states=str(DATA_DIR / 'states.json'),
+        db_path=str(db_path),
+        batch_size=batch_size,
+        mode=mode,
+    )
+    output = subprocess.run([sys.executable, '-c', child], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, TABLE_SNAPSHOTS='0', SCORING_MEMOS='0'))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per streamed batch')
+    parser.add_argument('--skip-legacy', action='store_true',
+                        help='skip the fetch-all path (needs several GiB at 10M rows)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / 'DataTweets.db'
+        start = time.perf_counter()
+        generate_table(db_path, args.rows)
+        print(f"Generated {args.rows:,} rows ({db_path.stat().st_size / 2**20:.0f} MiB) "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        modes = ['streaming'] if args.skip_legacy else ['streaming', 'legacy']
+        for mode in modes:
+            result = run(mode, db_path, Path(tmp) / 'ModelSnapshot.bin', args.batch_size)
+            print(f"{mode:10} {result['seconds']:8.2f} s  {args.rows / result['seconds']:10,.0f} rows/s  "
+                  f"peak RSS growth {result['peak_growth_kib'] / 1024:8.1f} MiB  states {result['states']}")
+
+
+if __name__ == '__main__':
+    main()
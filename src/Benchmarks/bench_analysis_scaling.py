@@ -0,0 +1,67 @@
+# bench_analysis_scaling.py
+"""
+Raw-row analysis time with 1..N shard worker processes.
+
+Uses the same seeded synthetic table as bench_analysis_memory.py (pre-score
+schema, so every row is scored and located). Every run must produce the
+same color map as the single-process run.
+
+Usage:
+    python src/Benchmarks/bench_analysis_scaling.py [--rows N] [--max-workers N]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_analysis_memory import DATA_DIR, SERVICES_DIR, generate_table
+
+sys.path[:0] = [str(SERVICES_DIR / 'SentimentAnalysisService'), str(SERVICES_DIR / 'Common')]
+# Repeated runs would be answered from the scoring memos (see bench_scoring_memo.py)
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    from data_processor import DataProcessor
+    from database import DatabaseManager
+    from model_snapshot import load_models
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / 'DataTweets.db'
+        generate_table(db_path, args.rows)
+        models = load_models(SimpleNamespace(snapshot_path=Path(tmp) / 'ModelSnapshot.bin',
+                                             sentiments_path=DATA_DIR / 'sentiments.csv',
+                                             states_path=DATA_DIR / 'states.json'))
+        db_manager = DatabaseManager(db_path)
+        db_manager.init_db()
+        # Built up front, so that no run pays for it
+        db_manager.table_snapshots.get('synthetic', build=True)
+        print(f"{args.rows:,} rows, {-(-args.rows // DataProcessor.SHARD_ROWS)} shards, "
+              f"{os.cpu_count()} CPUs")
+
+        baseline = None
+        for workers in range(1, args.max_workers + 1):
+            processor = DataProcessor(db_manager, models.analyzer, models.locator, workers=workers)
+            start = time.perf_counter()
+            result = processor.process_table('synthetic')
+            elapsed = time.perf_counter() - start
+            if baseline is None:
+                baseline = (result, elapsed)
+            assert result == baseline[0], f"{workers} workers changed the result"
+            print(f"workers {workers:3}  {elapsed:8.2f} s  {args.rows / elapsed:10,.0f} rows/s  "
+                  f"speedup {baseline[1] / elapsed:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
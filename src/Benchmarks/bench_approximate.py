@@ -0,0 +1,102 @@
+# bench_approximate.py
+"""
+Approximate analysis (/analyze/<table>?approximate=1) against the exact one.
+
+A synthetic table in the pre-score schema is generated (seeded, as in
+bench_analysis_memory.py), so every row has to be scored: the case
+sampling is for, as tables with stored scores are answered from running
+totals anyway. The exact analysis scans every row; approximate ones read
+random blocks of ids until an error target or a time budget is met, with
+--runs seeds each. The exact means are those of a sample of every block.
+
+Prints per setting the median latency, the rows sampled, what stopped the
+sampling, the largest error of a state's mean, the share of confidence
+intervals holding the exact mean, the uncertain states and the states
+colored differently than by the exact analysis.
+
+Usage:
+    python src/Benchmarks/bench_approximate.py [--rows N] [--runs N]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_analysis_memory import DATA_DIR, SERVICES_DIR, generate_table
+
+# Timed as the first analysis of a table: no columnar snapshot, no scoring memos
+os.environ.setdefault('TABLE_SNAPSHOTS', '0')
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+# (max_error, time budget in seconds)
+SETTINGS = [(0.2, 30), (0.1, 30), (0.05, 30), (1e-9, 0.25), (1e-9, 0.5), (1e-9, 1.0)]
+
+
+def timed(run):
+    start = time.perf_counter()
+    result = run()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--runs', type=int, default=5, help='seeds per setting')
+    args = parser.parse_args()
+
+    sys.path[:0] = [str(SERVICES_DIR / 'SentimentAnalysisService'), str(SERVICES_DIR / 'Common')]
+    logging.disable(logging.CRITICAL)
+    from data_processor import DataProcessor
+    from database import DatabaseManager
+    from model_snapshot import load_models
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / 'bench.db'
+        generate_table(db_path, args.rows)
+        models = load_models(SimpleNamespace(snapshot_path=Path(tmp) / 'ModelSnapshot.bin',
+                                             sentiments_path=DATA_DIR / 'sentiments.csv',
+                                             states_path=DATA_DIR / 'states.json'))
+        db_manager = DatabaseManager(db_path)
+        db_manager.init_db()
+        processor = DataProcessor(db_manager, models.analyzer, models.locator)
+
+        exact_seconds, exact = timed(lambda: processor.process_table('synthetic'))
+        full = processor.process_sample('synthetic', max_error=1e-9, time_budget=3600)
+        assert full['stopped'] == 'exhausted'
+        means = {state: estimate['mean'] for state, estimate in full['states'].items()}
+
+        print(f"{args.rows:,} rows, {len(means)} states, {args.runs} runs per setting")
+        print(f"exact: {exact_seconds * 1000:.0f} ms")
+        print(f"{'max_error':>9} {'budget':>7} {'latency':>10} {'speedup':>8} {'rows':>8} {'stopped':>16} "
+              f"{'max |err|':>9} {'coverage':>8} {'uncertain':>9} {'recolored':>9}")
+        for max_error, budget in SETTINGS:
+            latencies, rows, stopped, errors, covered, uncertain, recolored = [], [], Counter(), [], [], [], []
+            for seed in range(args.runs):
+                seconds, result = timed(lambda: processor.process_sample('synthetic', max_error=max_error,
+                                                                         time_budget=budget, seed=seed))
+                latencies.append(seconds)
+                rows.append(result['rows_sampled'])
+                stopped[result['stopped']] += 1
+                states = result['states']
+                errors.append(max(abs(estimate['mean'] - means[state]) for state, estimate in states.items()))
+                # Exhausted samples have zero-width intervals: allow for summation order
+                covered += [estimate['low'] - 1e-9 <= means[state] <= estimate['high'] + 1e-9
+                            for state, estimate in states.items() if estimate['low'] is not None]
+                uncertain.append(sum(estimate['uncertain'] for estimate in states.values()))
+                recolored.append(sum(result['colors'].get(state) != color for state, color in exact.items()))
+            latency = statistics.median(latencies)
+            print(f"{max_error:9.2g} {budget:6.2f}s {latency * 1000:7.0f} ms {exact_seconds / latency:7.1f}x "
+                  f"{statistics.mean(rows):8,.0f} {','.join(f'{r}:{n}' for r, n in stopped.items()):>16} "
+                  f"{max(errors):9.4f} {statistics.mean(covered) if covered else 0:8.1%} "
+                  f"{statistics.mean(uncertain):9.1f} {statistics.mean(recolored):9.1f}")
+
+
+if __name__ == '__main__':
+    main()
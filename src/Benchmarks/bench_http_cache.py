@@ -0,0 +1,139 @@
+# bench_http_cache.py
+"""
+Conditional and compressed responses of /analyze and /tables under load.
+
+Uploads the real Data/*_tweets2014.txt files into a temporary database,
+then serves each service from a threaded local HTTP server in a fresh
+interpreter and fires requests at a route from concurrent clients, for:
+
+- full:  a plain GET, as clients sent before ETags (/analyze answered
+         from the result cache, warmed up first)
+- gzip:  a GET accepting gzip
+- 304:   a GET with If-None-Match of the current ETag
+
+Prints requests per second, median and 95th percentile latency and bytes
+of body per response.
+
+Usage:
+    python src/Benchmarks/bench_http_cache.py [--requests N] [--clients N]
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tweet_generator import DATA_DIR, REAL_FILES
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / 'Services'
+MODES = {
+    'full': {},
+    'gzip': {'Accept-Encoding': 'gzip'},
+    '304': None,
+}
+
+
+def load(port, path, headers, requests, clients):
+    """Latencies (s) and body sizes of requests spread over client threads"""
+    def client(count):
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            conn.close()
+            assert response.status in (200, 304), (path, response.status)
+            samples.append((time.perf_counter() - start, len(body)))
+        return samples
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        samples = [sample for result in pool.map(client, [requests // clients] * clients) for sample in result]
+    return samples, time.perf_counter() - start
+
+
+def bench_child(service, spec):
+    """Serve one service and load its route in every mode"""
+    os.environ['TWEETS_DB_PATH'] = str(Path(spec['tmp']) / 'DataTweets.db')
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    os.environ.setdefault('METRICS_ENABLED', '0')
+    sys.path[:0] = [str(SERVICES_DIR / service), str(SERVICES_DIR / 'Common')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from werkzeug.serving import make_server
+    import app
+
+    client = app.app.test_client()
+    if service == 'TweetCollectionService':
+        for path in REAL_FILES:
+            with open(path, 'rb') as f:
+                response = client.post('/upload', data={'file': (io.BytesIO(f.read()), path.name)})
+            assert response.status_code == 200, response.json
+        route = '/tables'
+    else:
+        route = f'/analyze/{REAL_FILES[-1].stem}'
+    etag = client.get(route).headers['ETag']
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = []
+    for mode, headers in MODES.items():
+        headers = headers if headers is not None else {'If-None-Match': etag}
+        samples, seconds = load(server.port, route, headers, spec['requests'], spec['clients'])
+        latencies = sorted(latency for latency, _ in samples)
+        results.append({
+            'route': route, 'mode': mode,
+            'rps': len(samples) / seconds,
+            'p50_ms': statistics.median(latencies) * 1e3,
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1e3,
+            'bytes': statistics.mean(size for _, size in samples),
+        })
+    server.shutdown()
+    return results
+
+
+def run_child(service, spec):
+    output = subprocess.run([sys.executable, __file__, '--child', service, '--spec', json.dumps(spec)],
+                            capture_output=True, text=True)
+    if output.returncode:
+        raise RuntimeError(f"{service} benchmark failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per mode')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--spec', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(bench_child(args.child, json.loads(args.spec))))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spec = {'tmp': tmp, 'requests': args.requests, 'clients': args.clients}
+        # The collection service uploads the tables the analysis service then reads
+        results = run_child('TweetCollectionService', spec) + run_child('SentimentAnalysisService', spec)
+
+    print(f"{args.clients} clients, {args.requests} requests per mode")
+    print(f"{'route':32} {'mode':5} {'req/s':>8} {'p50':>9} {'p95':>9} {'bytes':>7}")
+    for r in results:
+        print(f"{r['route']:32} {r['mode']:5} {r['rps']:8.0f} {r['p50_ms']:6.2f} ms {r['p95_ms']:6.2f} ms "
+              f"{r['bytes']:7.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# bench_ingest.py
+"""
+Upload ingest throughput and peak memory: streaming bulk path (serial and
+with a parser process pool) vs. the previous read-everything + ORM add path.
+
+Usage:
+    python src/Benchmarks/bench_ingest.py [--lines N] [--batch-size N] [--workers N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+SERVICES_DIR = BASE_DIR / 'src' / 'Services'
+# Repeated runs would be answered from the scoring memos (see bench_scoring_memo.py)
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+
+def write_input(path, lines):
+    """Repeat the real topic files until the requested line count.
+
+    Repetitions get a numbered suffix so uploads don't skip them as
+    duplicates.
+    """
+    sources = sorted((BASE_DIR / 'Data').glob('*_tweets2014.txt'))
+    written = 0
+    repetition = 0
+    with open(path, 'w', encoding='utf-8') as out:
+        while written < lines:
+            suffix = f' #{repetition}' if repetition else ''
+            repetition += 1
+            for source in sources:
+                with open(source, encoding='utf-8') as f:
+                    for line in f:
+                        out.write(line.rstrip('\n') + suffix + '\n')
+                        written += 1
+                        if written == lines:
+                            return
+
+
+def legacy_process_file(service, file):
+    """Previous implementation: whole file in memory, one ORM object per row"""
+    from exceptions import InvalidDataFormatError
+    from parsing import parse_line
+    valid_records, errors = 0, []
+    lines = file.read().decode('utf-8').splitlines()
+    service.session.query(service.Tweet).delete()
+    for line_num, line in enumerate(lines, 1):
+        try:
+            service.session.add(service.Tweet(**parse_line(line)))
+            valid_records += 1
+        except InvalidDataFormatError as e:
+            errors.append(f"Line {line_num}: {str(e)}")
+    service.session.commit()
+    return {'valid_records': valid_records, 'errors': errors}
+
+
+def run(label, func, input_path, lines):
+    # Timing and memory are measured in separate runs: tracemalloc itself
+    # slows allocation-heavy code down several times
+    start = time.perf_counter()
+    with open(input_path, 'rb') as f:
+        result = func(f)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    with open(input_path, 'rb') as f:
+        func(f)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:12} {elapsed:7.2f} s  {lines / elapsed:10,.0f} lines/s  "
+          f"peak {peak / 2**20:7.1f} MiB  valid {result['valid_records']}  errors {len(result['errors'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=100_000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['TWEETS_DB_PATH'] = str(Path(tmp) / 'bench.db')
+        sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService'), str(SERVICES_DIR / 'Common')]
+        from database import Session, init_db
+        from services import FileProcessingService
+        init_db()
+
+        input_path = Path(tmp) / 'bench_tweets.txt'
+        write_input(input_path, args.lines)
+        print(f"Input: {args.lines:,} lines, {input_path.stat().st_size / 2**20:.1f} MiB")
+
+        def legacy(f):
+            try:
+                return legacy_process_file(FileProcessingService('bench_tweets.txt'), f)
+            finally:
+                Session.remove()
+
+        def streaming(workers):
+            def process(f):
+                service = FileProcessingService('bench_tweets.txt', batch_size=args.batch_size, workers=workers)
+                return service.process_file(f)
+            return process
+
+        run('legacy', legacy, input_path, args.lines)
+        run('streaming', streaming(1), input_path, args.lines)
+        if args.workers > 1:
+            run(f'parallel/{args.workers}', streaming(args.workers), input_path, args.lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# bench_metrics.py
+"""
+Overhead of the Prometheus instrumentation and stage logs (Common/metrics.py).
+
+Runs the same workloads with instrumentation on (METRICS_ENABLED=1,
+STAGE_LOGS=1) and off (both 0), each in a fresh interpreter, alternating
+for a number of rounds to even out noise, and prints the best median of
+each and the relative overhead:
+
+- span:     one `with stages(...)` block, the unit of stage timing
+- request:  GET /tables through the collection service's Flask app
+- upload:   FileProcessingService.process_file on a synthetic file
+- analysis: DataProcessor.process_table scoring the uploaded rows
+
+Usage:
+    python src/Benchmarks/bench_metrics.py [--lines N] [--repeat N] [--rounds N] [--requests N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from tweet_generator import DATA_DIR, write_file
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+SERVICES_DIR = BASE_DIR / 'src' / 'Services'
+# Repeated runs would be answered from the scoring memos (see bench_scoring_memo.py)
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+
+def measure(repeat, run):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def bench_child(spec):
+    """Medians in seconds per workload, with instrumentation as set in the environment"""
+    os.environ['TWEETS_DB_PATH'] = str(Path(spec['tmp']) / 'DataTweets.db')
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService'), str(SERVICES_DIR / 'Common')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from metrics import Stages
+    from services import FileProcessingService, model_registry
+    import app
+
+    results = {}
+    stages, spans = Stages(), 100_000
+
+    def run_spans():
+        for _ in range(spans):
+            with stages('parse'):
+                pass
+    results['span'] = measure(spec['repeat'], run_spans) / spans
+
+    client = app.app.test_client()
+
+    def run_requests():
+        for _ in range(spec['requests']):
+            client.get('/tables')
+    results['request'] = measure(spec['repeat'], run_requests) / spec['requests']
+
+    def run_upload():
+        with open(spec['file'], 'rb') as f:
+            FileProcessingService('synthetic.txt', workers=1).process_file(f)
+    results['upload'] = measure(spec['repeat'], run_upload)
+
+    # The analysis service has modules of the same names
+    for name in ('app', 'routes', 'services', 'database', 'config'):
+        sys.modules.pop(name, None)
+    sys.path[0] = str(SERVICES_DIR / 'SentimentAnalysisService')
+    from data_processor import DataProcessor
+    from database import DatabaseManager
+
+    models = model_registry.get()
+    # Without a model version stored scores are ignored and every row is scored
+    processor = DataProcessor(DatabaseManager(os.environ['TWEETS_DB_PATH']), models.analyzer, models.locator)
+    results['analysis'] = measure(spec['repeat'], lambda: processor.process_table('synthetic'))
+    return results
+
+
+def run_child(spec, enabled):
+    env = dict(os.environ, METRICS_ENABLED='1' if enabled else '0', STAGE_LOGS='1' if enabled else '0')
+    env.pop('METRICS_DIR', None)
+    output = subprocess.run([sys.executable, __file__, '--child', json.dumps(spec)],
+                            capture_output=True, text=True, env=env)
+    if output.returncode:
+        raise RuntimeError(f"Benchmark failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=100_000, help='lines of the synthetic upload')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=3, help='runs of each mode, alternating')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per repeat')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(bench_child(json.loads(args.child))))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spec = {'tmp': tmp, 'file': str(write_file(Path(tmp) / 'synthetic.txt', args.lines, args.seed)),
+                'repeat': args.repeat, 'requests': args.requests}
+        runs = {False: [], True: []}
+        for _ in range(args.rounds):
+            for mode in runs:
+                runs[mode].append(run_child(spec, enabled=mode))
+    disabled, enabled = ({name: min(run[name] for run in runs[mode]) for name in runs[mode][0]}
+                         for mode in (False, True))
+
+    units = {'span': (1e9, 'ns'), 'request': (1e6, 'us'), 'upload': (1e3, 'ms'), 'analysis': (1e3, 'ms')}
+    print(f"{'workload':10} {'disabled':>12} {'enabled':>12} {'overhead':>9}")
+    for name, (scale, unit) in units.items():
+        print(f"{name:10} {disabled[name] * scale:9.1f} {unit:2} {enabled[name] * scale:9.1f} {unit:2} "
+              f"{(enabled[name] / disabled[name] - 1) * 100:8.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# bench_partitions.py
+"""
+Plain versus day-partitioned tables (Common/partitions.py).
+
+Uploads the same synthetic tweets, spread evenly over --days days, to a
+plain table and to a table partitioned by day, then times on both:
+
+- upload:   the whole file, replacing the table
+- window:   analysis of one day with bounds inside hours, so rows are
+            aggregated rather than rollups summed
+- raw scan: analysis scoring every row (no model version), with
+            --workers shard processes
+- replace:  reloading the newest day (replace_partitions; the plain table
+            is replaced with all its rows)
+- drop:     removing the oldest day (DROP TABLE of a partition; DELETE of
+            the day's rows, their point index entries and the running
+            totals of the plain table)
+
+Results of both tables must be the same.
+
+Usage:
+    python src/Benchmarks/bench_partitions.py [--lines N] [--days N] [--workers N]
+"""
+
+import argparse
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from tweet_generator import DATA_DIR, generate_lines
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+SERVICES_DIR = BASE_DIR / 'src' / 'Services'
+# Repeated runs would be answered from the scoring memos (see bench_scoring_memo.py)
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+FIRST_DAY = datetime(2014, 1, 1)
+
+
+def spread_lines(count, days):
+    """Synthetic lines (with line breaks), the i-th moved to day i * days // count"""
+    lines = []
+    for i, line in enumerate(generate_lines(count)):
+        lat_lon, marker, timestamp, text = line.split('\t', 3)
+        day = FIRST_DAY + timedelta(days=i * days // count)
+        lines.append(f"{lat_lon}\t{marker}\t{day:%Y-%m-%d}{timestamp[10:]}\t{text}\n".encode())
+    return lines
+
+
+def timed(run):
+    start = time.perf_counter()
+    result = run()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=300_000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['TWEETS_DB_PATH'] = str(Path(tmp) / 'DataTweets.db')
+        os.environ['DATA_DIR'] = str(DATA_DIR)
+        sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService'), str(SERVICES_DIR / 'Common')]
+        logging.disable(logging.CRITICAL)
+        from database import engine, init_db
+        from partitioned import drop_partitions, upload_service
+        from point_index import point_index_name
+        from services import model_registry
+        from state_totals import clear_state_totals
+        init_db()
+
+        lines = spread_lines(args.lines, args.days)
+        last_day = FIRST_DAY + timedelta(days=args.days - 1)
+        newest = [line for line in lines if line.split(b'\t')[2].startswith(f'{last_day:%Y-%m-%d}'.encode())]
+        times = {}
+
+        def upload(table, mode, data, partition=None):
+            return upload_service(f'{table}.txt', mode, partition, workers=1).process_file(io.BytesIO(b''.join(data)))
+
+        for table, partition in (('plain', None), ('daily', 'day')):
+            times['upload', table] = timed(lambda: upload(table, 'replace', lines, partition))[0]
+        times['replace', 'plain'] = timed(lambda: upload('plain', 'replace', lines))[0]
+        times['replace', 'daily'] = timed(lambda: upload('daily', 'replace_partitions', newest))[0]
+
+        # The analysis service has modules of the same names
+        for name in ('services', 'database', 'config'):
+            sys.modules.pop(name, None)
+        sys.path[0] = str(SERVICES_DIR / 'SentimentAnalysisService')
+        from data_processor import DataProcessor
+        from database import DatabaseManager
+
+        models = model_registry.get()
+        db_manager = DatabaseManager(os.environ['TWEETS_DB_PATH'])
+        scored = DataProcessor(db_manager, models.analyzer, models.locator, models.version)
+        raw = DataProcessor(db_manager, models.analyzer, models.locator, workers=args.workers)
+        middle = FIRST_DAY + timedelta(days=args.days // 2)
+        window = (middle + timedelta(minutes=30), middle + timedelta(days=1, minutes=30))
+        results = {}
+        for table in ('plain', 'daily'):
+            times['window', table], results['window', table] = timed(lambda: scored.process_window(table, *window))
+            times['raw scan', table], results['raw scan', table] = timed(lambda: raw.process_table(table))
+        for workload in ('window', 'raw scan'):
+            assert results[workload, 'plain'] == results[workload, 'daily'], f"{workload} results differ"
+
+        oldest = FIRST_DAY + timedelta(days=1)
+
+        def delete_day():
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f'DELETE FROM "{point_index_name("plain")}" WHERE id IN '
+                                     f'(SELECT id FROM plain WHERE created_at < ?)', (str(oldest),))
+                conn.exec_driver_sql('DELETE FROM plain WHERE created_at < ?', (str(oldest),))
+                clear_state_totals(conn, 'plain')
+        times['drop', 'plain'] = timed(delete_day)[0]
+        times['drop', 'daily'] = timed(lambda: drop_partitions('daily', before=oldest))[0]
+
+    print(f"{args.lines:,} lines over {args.days} days, {args.workers} workers")
+    print(f"{'workload':10} {'plain':>10} {'daily':>10} {'speedup':>8}")
+    for workload in ('upload', 'window', 'raw scan', 'replace', 'drop'):
+        plain, daily = times[workload, 'plain'], times[workload, 'daily']
+        print(f"{workload:10} {plain * 1000:7.0f} ms {daily * 1000:7.0f} ms {plain / daily:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
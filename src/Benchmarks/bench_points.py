@@ -0,0 +1,119 @@
+# bench_points.py
+"""
+Viewport queries of single tweets through the R*Tree point index vs. a scan
+of the whole table.
+
+Uses the seeded synthetic table of bench_analysis_memory.py, scored up
+front so that queries read stored scores. Reports the one-off time of
+indexing the table, then per viewport the time to the first NDJSON chunk,
+the total time, the points and bytes streamed and the peak Python memory
+(tracemalloc) of DataProcessor.stream_points, against fetching every row
+and filtering it in Python as a client downloading the table would. Both
+must find the same points.
+
+Usage:
+    python src/Benchmarks/bench_points.py [--rows N] [--repeat N]
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_analysis_memory import DATA_DIR, SERVICES_DIR, generate_table
+
+sys.path[:0] = [str(SERVICES_DIR / 'SentimentAnalysisService'), str(SERVICES_DIR / 'Common')]
+
+# (name, (west, south, east, north), limit, sample)
+VIEWPORTS = [
+    ('city', (-118.7, 33.7, -117.9, 34.3), None, None),
+    ('state', (-124.5, 32.5, -114.1, 42.0), None, None),
+    ('country 1%', (-125.0, 24.0, -66.0, 50.0), None, 0.01),
+    ('country limit', (-125.0, 24.0, -66.0, 50.0), 1000, None),
+]
+
+
+def measure(repeat, run):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    from data_processor import DataProcessor
+    from database import DatabaseManager
+    from model_snapshot import load_models
+    from score_backfill import ScoreBackfiller
+    from sqlalchemy import select
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / 'DataTweets.db'
+        generate_table(db_path, args.rows)
+        models = load_models(SimpleNamespace(snapshot_path=Path(tmp) / 'ModelSnapshot.bin',
+                                             sentiments_path=DATA_DIR / 'sentiments.csv',
+                                             states_path=DATA_DIR / 'states.json'))
+        db_manager = DatabaseManager(db_path)
+        db_manager.init_db()
+        processor = DataProcessor(db_manager, models.analyzer, models.locator, models.version)
+
+        # Scored in the foreground, as the analysis service would in the background
+        ScoreBackfiller(db_manager, SimpleNamespace(get=lambda: models), batch_size=20000)._run('synthetic')
+
+        start = time.perf_counter()
+        db_manager.ensure_point_index('synthetic')
+        print(f"{args.rows:,} rows; point index built in {time.perf_counter() - start:.2f} s")
+
+        table = db_manager._reflect('synthetic')
+
+        def scan(bbox):
+            west, south, east, north = bbox
+            with db_manager.engine.connect() as conn:
+                rows = conn.execute(select(table.c.id, table.c.latitude, table.c.longitude, table.c.sentiment,
+                                           table.c.state)).fetchall()
+            return sorted(row.id for row in rows if south <= row.latitude <= north and west <= row.longitude <= east)
+
+        def stream(bbox, limit, sample):
+            first, size, points = None, 0, 0
+            start = time.perf_counter()
+            for chunk in processor.stream_points('synthetic', bbox, limit, sample):
+                first = first or time.perf_counter() - start
+                size += len(chunk)
+                points += chunk.count('\n')
+            return first or 0.0, size, points
+
+        def peak(run):
+            tracemalloc.start()
+            result = run()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak_bytes, result
+
+        print(f"{'viewport':14} {'points':>8} {'MiB':>6} {'first':>9} {'index':>9} {'scan':>9} "
+              f"{'index peak':>11} {'scan peak':>10}")
+        for name, bbox, limit, sample in VIEWPORTS:
+            index_seconds, (first, size, points) = measure(args.repeat, lambda: stream(bbox, limit, sample))
+            scan_seconds, expected = measure(args.repeat, lambda: scan(bbox))
+            index_peak, _ = peak(lambda: stream(bbox, limit, sample))
+            scan_peak, _ = peak(lambda: scan(bbox))
+            if not limit and not sample:
+                assert points == len(expected), f"{name}: {points} points, {len(expected)} expected"
+            print(f"{name:14} {points:8,} {size / 2**20:6.1f} {first * 1000:6.1f} ms {index_seconds * 1000:6.0f} ms "
+                  f"{scan_seconds * 1000:6.0f} ms {index_peak / 2**20:7.1f} MiB {scan_peak / 2**20:6.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
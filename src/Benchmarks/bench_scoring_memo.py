@@ -0,0 +1,103 @@
+# bench_scoring_memo.py
+"""
+Scoring and locating tweets with and without the scoring memos.
+
+For each real Data/*_tweets2014.txt file, and all of them together, times
+SentimentAnalyzer.analyze_many and StateLocator.locate_many over the file's
+tweets in batches of DataProcessor's stream size:
+
+- off:  memos disabled
+- cold: empty memos, as on the first analysis of a table (only repeats
+        within the file hit)
+- warm: memos filled by the cold run, as on the next analysis of the table
+
+and prints the hit rates. Every mode must give the same scores and states.
+
+Usage:
+    python src/Benchmarks/bench_scoring_memo.py [--repeat N]
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from tweet_generator import DATA_DIR, LINE_PATTERN, REAL_FILES
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / 'Services'
+sys.path.insert(0, str(SERVICES_DIR / 'Common'))
+
+BATCH_SIZE = 10000
+
+
+def read_tweets(paths):
+    lats, lons, texts = [], [], []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                match = LINE_PATTERN.match(line.rstrip('\n'))
+                if match:
+                    lats.append(float(match.group(1)))
+                    lons.append(float(match.group(2)))
+                    texts.append(match.group(3))
+    return lats, lons, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    from model_snapshot import load_models
+    from scoring_memo import POINT_MEMO_SIZE, TEXT_MEMO_SIZE, ScoringMemo
+
+    with tempfile.TemporaryDirectory() as tmp:
+        models = load_models(SimpleNamespace(snapshot_path=Path(tmp) / 'ModelSnapshot.bin',
+                                             sentiments_path=DATA_DIR / 'sentiments.csv',
+                                             states_path=DATA_DIR / 'states.json'))
+    analyzer, locator = models.analyzer, models.locator
+    sizes = {'off': (0, 0), 'cold': (TEXT_MEMO_SIZE or 100_000, POINT_MEMO_SIZE or 50_000)}
+
+    def score(lats, lons, texts, lookups):
+        scores, states = [], []
+        for start in range(0, len(texts), BATCH_SIZE):
+            end = start + BATCH_SIZE
+            scores += analyzer.analyze_many(texts[start:end], lookups)
+            states += locator.locate_many(lats[start:end], lons[start:end], lookups)
+        return scores, states
+
+    print(f"{'dataset':22} {'tweets':>7} {'off':>9} {'cold':>9} {'warm':>9} {'text hits':>10} {'point hits':>11}")
+    for name, paths in [(path.stem, [path]) for path in REAL_FILES] + [('all', REAL_FILES)]:
+        lats, lons, texts = read_tweets(paths)
+        times, results, rates = {}, {}, {}
+        for mode in ('off', 'cold', 'warm'):
+            samples = []
+            for _ in range(args.repeat):
+                if mode != 'warm':
+                    # Warm runs keep the memos of the last cold run
+                    text_size, point_size = sizes[mode]
+                    analyzer.memo = ScoringMemo('text', text_size)
+                    locator.memo = ScoringMemo('point', point_size)
+                lookups = {}
+                start = time.perf_counter()
+                results[mode] = score(lats, lons, texts, lookups)
+                samples.append(time.perf_counter() - start)
+            times[mode] = statistics.median(samples)
+            rates[mode] = lookups
+        assert results['off'] == results['cold'] == results['warm'], f"memos changed the results of {name}"
+
+        def hit_rate(memo):
+            hits, misses = rates['cold'].get(f'{memo}_memo_hits', 0), rates['cold'].get(f'{memo}_memo_misses', 0)
+            return f"{hits / (hits + misses):.1%}" if hits + misses else '-'
+
+        print(f"{name:22} {len(texts):7,} " + ' '.join(f"{times[mode] * 1000:6.1f} ms" for mode in times)
+              + f" {hit_rate('text'):>10} {hit_rate('point'):>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# bench_sentiment.py
+"""
+Benchmark of the sentiment engine against the single-word tokenizer.
+
+Usage:
+    python src/Benchmarks/bench_sentiment.py [tweets_file] [--repeat N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(BASE_DIR / 'src' / 'Services' / 'Common'))
+# Repeated runs would be answered from the scoring memos (see bench_scoring_memo.py)
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+from sentiment_analyzer import SentimentAnalyzer  # noqa: E402
+
+
+def read_texts(path):
+    """Extract tweet texts from a [lat, lon]\\t_\\tdate\\ttext file"""
+    texts = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t', 3)
+            if len(parts) == 4:
+                texts.append(parts[3])
+    return texts
+
+
+def word_lookup(scores, text):
+    """Previous behaviour: single words only"""
+    words = re.findall(r'\b\w+\b', text.lower())
+    found = [scores[word] for word in words if word in scores]
+    return sum(found) / len(found) if found else None
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('tweets', nargs='?', default=BASE_DIR / 'Data' / 'weekend_tweets2014.txt')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    analyzer = SentimentAnalyzer(BASE_DIR / 'Data' / 'sentiments.csv')
+    build_time = time.perf_counter() - start
+    texts = read_texts(args.tweets)
+
+    scores = analyzer.sentiment_scores
+    baseline_time, baseline = best_of(args.repeat, lambda: [word_lookup(scores, t) for t in texts])
+    single_time, _ = best_of(args.repeat, lambda: [analyzer.analyze(t) for t in texts])
+    batch_time, batched = best_of(args.repeat, lambda: analyzer.analyze_many(texts))
+
+    changed = sum(1 for old, new in zip(baseline, batched) if old != new)
+    print(f"Texts:                 {len(texts)}")
+    print(f"Lexicon build:         {build_time * 1000:.1f} ms")
+    print(f"Word lookup (old):     {baseline_time * 1000:.1f} ms "
+          f"({len(texts) / baseline_time:,.0f} texts/s), scored {sum(s is not None for s in baseline)}")
+    print(f"Automaton analyze():   {single_time * 1000:.1f} ms ({len(texts) / single_time:,.0f} texts/s)")
+    print(f"Automaton batch:       {batch_time * 1000:.1f} ms "
+          f"({len(texts) / batch_time:,.0f} texts/s), scored {sum(s is not None for s in batched)}")
+    print(f"Scores changed by phrase matches: {changed}")
+
+
+if __name__ == '__main__':
+    main()
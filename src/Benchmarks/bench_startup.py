@@ -0,0 +1,72 @@
+# bench_startup.py
+"""
+Cold start of the analysis models: source files vs. compiled snapshot.
+
+Each measurement runs in a fresh interpreter so imports and page cache
+effects are the same as in a newly started container.
+
+Usage:
+    python src/Benchmarks/bench_startup.py [--runs N]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+SERVICE_DIR = BASE_DIR / 'src' / 'Services' / 'Common'
+
+CHILD = """
+import json, logging, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {service_dir!r})
+logging.disable(logging.CRITICAL)
+from model_snapshot import ModelSnapshot
+from sentiment_analyzer import SentimentAnalyzer
+from state_locator import StateLocator
+imported = time.perf_counter()
+if {mode!r} == 'sources':
+    analyzer, locator = SentimentAnalyzer({sentiments!r}), StateLocator({states!r})
+else:
+    snapshot = ModelSnapshot.load({snapshot!r}, {sentiments!r}, {states!r})
+    analyzer, locator = snapshot.analyzer(), snapshot.locator()
+assert locator.locate(34.0522, -118.2437) == 'CA'
+print(json.dumps({{'imports': imported - start, 'models': time.perf_counter() - imported}}))
+"""
+
+
+def measure(mode, snapshot, runs):
+    code = CHILD.format(service_dir=str(SERVICE_DIR), mode=mode, snapshot=str(snapshot),
+                        sentiments=str(BASE_DIR / 'Data' / 'sentiments.csv'),
+                        states=str(BASE_DIR / 'Data' / 'states.json'))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = Path(tmp) / 'ModelSnapshot.bin'
+        first = measure('snapshot', snapshot, 1)
+        results = {
+            'sources': measure('sources', snapshot, args.runs),
+            'snapshot (first run, builds it)': first,
+            'snapshot': measure('snapshot', snapshot, args.runs),
+        }
+
+    for name, timing in results.items():
+        print(f"{name:32} imports {timing['imports'] * 1000:7.1f} ms   models {timing['models'] * 1000:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
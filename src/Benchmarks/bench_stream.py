@@ -0,0 +1,113 @@
+# bench_stream.py
+"""
+Streaming ingest (POST /stream/<table>) and live map events under replay.
+
+Starts the collection service as load_test.py does, then for each rate
+replays the real Data/*_tweets2014.txt files followed by --synthetic-lines
+generated tweets as one chunked request body, paced to that many tweets
+per second (0: as fast as the service reads), while a subscriber watches
+the table's /stream/<table>/events.
+
+Prints per rate the tweets per second accepted, the batches committed,
+the events the subscriber got and their median interval, and the lag of
+the last event behind the end of the stream.
+
+Usage:
+    python src/Benchmarks/bench_stream.py [--rates N,N,...] [--synthetic-lines N] [--piece-lines N]
+"""
+
+import argparse
+import http.client
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from load_test import Service, free_port
+from tweet_generator import DATA_DIR, REAL_FILES, write_file
+
+
+def replay(port, table, lines, rate, piece_lines):
+    """Stream lines in pieces paced to rate; (ingest result, seconds, time the last piece was sent)"""
+    sent = {}
+
+    def body():
+        start = time.perf_counter()
+        for first in range(0, len(lines), piece_lines):
+            if rate:
+                delay = start + first / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield b''.join(lines[first:first + piece_lines])
+        sent['last'] = time.perf_counter()
+
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    start = time.perf_counter()
+    conn.request('POST', f'/stream/{table}', body=body(), encode_chunked=True,
+                 headers={'Transfer-Encoding': 'chunked'})
+    response = conn.getresponse()
+    result = json.loads(response.read())
+    assert response.status == 200, result
+    return result, time.perf_counter() - start, sent['last']
+
+
+def subscribe(port, table, events, ready):
+    """Record (time, event name) of a table's live map events"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', f'/stream/{table}/events')
+    response = conn.getresponse()
+    ready.set()
+    name = None
+    while line := response.fp.readline().decode():
+        if line.startswith('event:'):
+            name = line.split(':', 1)[1].strip()
+        elif line.startswith('data:'):
+            events.append((time.perf_counter(), name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', default='0,1000,5000', help='tweets per second to replay at; 0 for unpaced')
+    parser.add_argument('--synthetic-lines', type=int, default=50_000)
+    parser.add_argument('--piece-lines', type=int, default=50, help='lines per chunk of the request body')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lines = []
+        for path in REAL_FILES + [write_file(Path(tmp) / 'synthetic.txt', args.synthetic_lines)]:
+            lines += Path(path).read_bytes().splitlines(keepends=True)
+
+        db_dir = Path(tmp) / 'DataBase'
+        db_dir.mkdir()
+        port = free_port()
+        service = Service('TweetCollectionService', [sys.executable, '-m', 'flask', 'run', '--port', str(port)],
+                          port, tmp, {'TWEETS_DB_PATH': str(db_dir / 'DataTweets.db'), 'DATA_DIR': str(DATA_DIR),
+                                      'FLASK_APP': 'app.py', 'METRICS_ENABLED': '0'})
+        try:
+            service.wait_ready('/tables')
+            print(f"{len(lines):,} lines per replay")
+            print(f"{'rate':>6} {'tweets/s':>9} {'batches':>8} {'events':>7} {'interval':>10} {'last lag':>10}")
+            for i, rate in enumerate(int(rate) for rate in args.rates.split(',')):
+                table = f'replay_{i}'
+                # The table must exist to be watched
+                replay(service.port, table, lines[:10], 0, args.piece_lines)
+                events, ready = [], threading.Event()
+                threading.Thread(target=subscribe, args=(service.port, table, events, ready), daemon=True).start()
+                ready.wait(30)
+                result, seconds, last_sent = replay(service.port, table, lines, rate, args.piece_lines)
+                time.sleep(1)
+                deltas = [at for at, name in events if name == 'delta']
+                intervals = [b - a for a, b in zip(deltas, deltas[1:])]
+                interval = f"{statistics.median(intervals) * 1000:7.0f} ms" if intervals else '-'
+                lag = f"{(deltas[-1] - last_sent) * 1000:7.0f} ms" if deltas else '-'
+                print(f"{rate or 'max':>6} {result['valid_records'] / seconds:9,.0f} {result['batches']:8} "
+                      f"{len(deltas):7} {interval:>10} {lag:>10}")
+        finally:
+            service.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+# bench_suite.py
+"""
+Benchmark suite for the ingest and analysis hot paths, with JSON output.
+
+Measures, on the real Data/*_tweets2014.txt files and on seeded synthetic
+files (see tweet_generator.py) of the requested sizes:
+
+- models:   SentimentAnalyzer.analyze per text, StateLocator.locate per point
+- ingest:   parsing.parse_line and process_file throughput
+- analysis: AnalysisController.process latency per table, result cache
+            missed and hit
+
+Ingest and analysis run in separate interpreters (the two services have
+modules of the same name) on one temporary database. Results are written as
+JSON; --compare prints the change against an earlier results file.
+
+Usage:
+    python src/Benchmarks/bench_suite.py [--lines N [N ...]] [--repeat N] [--output PATH]
+                                         [--compare OLD.json] [--groups GROUP [GROUP ...]]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from tweet_generator import DATA_DIR, LINE_PATTERN, REAL_FILES, write_file
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+SERVICES_DIR = BASE_DIR / 'src' / 'Services'
+GROUPS = ('models', 'ingest', 'analysis')
+# Repeated runs would be answered from the scoring memos (see bench_scoring_memo.py)
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+
+def summarize(benchmark, dataset, unit, samples, count, **extra):
+    """One result record: median, min and p95 of per-repeat samples"""
+    samples = sorted(samples)
+    return {
+        'benchmark': benchmark,
+        'dataset': dataset,
+        'unit': unit,
+        'median': statistics.median(samples),
+        'min': samples[0],
+        'p95': samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))],
+        'repeats': len(samples),
+        'count': count,
+        **extra,
+    }
+
+
+def read_lines(paths, limit=None):
+    lines = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                lines.append(line.rstrip('\n'))
+                if limit and len(lines) >= limit:
+                    return lines
+    return lines
+
+
+def parse_rows(lines):
+    """(latitude, longitude, text) of the well-formed lines"""
+    rows = []
+    for line in lines:
+        match = LINE_PATTERN.match(line.strip())
+        if match:
+            rows.append((float(match.group(1)), float(match.group(2)), match.group(3).strip()))
+    return rows
+
+
+def bench_models(spec):
+    sys.path[:0] = [str(SERVICES_DIR / 'Common')]
+    from model_snapshot import load_models
+
+    models = load_models(SimpleNamespace(snapshot_path=Path(spec['tmp']) / 'ModelSnapshot.bin',
+                                         sentiments_path=DATA_DIR / 'sentiments.csv',
+                                         states_path=DATA_DIR / 'states.json'))
+    results = []
+    for dataset, paths in spec['datasets'].items():
+        rows = parse_rows(read_lines(paths, spec['sample']))
+        texts = [row[2] for row in rows]
+        lats, lons = [row[0] for row in rows], [row[1] for row in rows]
+
+        samples = []
+        for _ in range(spec['repeat']):
+            start = time.perf_counter()
+            for text in texts:
+                models.analyzer.analyze(text)
+            samples.append((time.perf_counter() - start) / len(texts) * 1e6)
+        results.append(summarize('analyze', dataset, 'us/text', samples, len(texts)))
+
+        samples = []
+        for _ in range(spec['repeat']):
+            start = time.perf_counter()
+            for lat, lon in zip(lats, lons):
+                models.locator.locate(lat, lon)
+            samples.append((time.perf_counter() - start) / len(lats) * 1e6)
+        results.append(summarize('locate', dataset, 'us/point', samples, len(lats)))
+
+        samples = []
+        for _ in range(spec['repeat']):
+            start = time.perf_counter()
+            models.locator.locate_many(lats, lons)
+            samples.append((time.perf_counter() - start) / len(lats) * 1e6)
+        results.append(summarize('locate_many', dataset, 'us/point', samples, len(lats)))
+    return results
+
+
+def bench_ingest(spec):
+    os.environ['TWEETS_DB_PATH'] = str(Path(spec['tmp']) / 'DataTweets.db')
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService'), str(SERVICES_DIR / 'Common')]
+    from database import init_db
+    from exceptions import InvalidDataFormatError
+    from parsing import parse_line
+    from services import FileProcessingService
+    init_db()
+
+    results = []
+    for dataset, paths in spec['datasets'].items():
+        lines = read_lines(paths, spec['sample'])
+        samples = []
+        for _ in range(spec['repeat']):
+            start = time.perf_counter()
+            for line in lines:
+                try:
+                    parse_line(line)
+                except InvalidDataFormatError:
+                    pass
+            samples.append(len(lines) / (time.perf_counter() - start))
+        results.append(summarize('parse_line', dataset, 'lines/s', samples, len(lines)))
+
+        line_count = sum(1 for path in paths for _ in open(path, encoding='utf-8'))
+        samples = []
+        for _ in range(spec['repeat']):
+            start = time.perf_counter()
+            for path in paths:
+                with open(path, 'rb') as f:
+                    FileProcessingService(Path(path).name).process_file(f)
+            samples.append(line_count / (time.perf_counter() - start))
+        results.append(summarize('process_file', dataset, 'lines/s', samples, line_count,
+                                 files=len(paths)))
+    return results
+
+
+def bench_analysis(spec):
+    sys.path[:0] = [str(SERVICES_DIR / 'SentimentAnalysisService'), str(SERVICES_DIR / 'Common')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from controllers import AnalysisController
+
+    db_path = Path(spec['tmp']) / 'DataTweets.db'
+    controller = AnalysisController(SimpleNamespace(
+        db_path=db_path,
+        sentiments_path=DATA_DIR / 'sentiments.csv',
+        states_path=DATA_DIR / 'states.json',
+        cache_path=db_path.parent / 'ResultCache.db',
+        cache_size=64,
+        snapshot_path=db_path.parent / 'ModelSnapshot.bin',
+        analysis_workers=os.cpu_count() or 1,
+    ))
+    controller.init_db()
+    results = []
+    for dataset, paths in spec['datasets'].items():
+        tables = [Path(path).stem for path in paths]
+        for cached in (False, True):
+            samples = []
+            for _ in range(spec['repeat']):
+                for table in tables:
+                    if not cached:
+                        controller.cache.bump_version(table)
+                    start = time.perf_counter()
+                    result = controller.process(table)
+                    samples.append((time.perf_counter() - start) * 1e3)
+                    assert 'error' not in result, result
+            results.append(summarize('analysis_process', dataset, 'ms/request', samples, len(tables),
+                                     cache='hit' if cached else 'miss'))
+    return results
+
+
+def run_group(group, spec):
+    """Run a group in a fresh interpreter and return its result records"""
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', group, '--spec', json.dumps(spec)],
+        capture_output=True, text=True
+    )
+    if output.returncode:
+        raise RuntimeError(f"{group} benchmarks failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, results):
+    with open(old_path) as f:
+        old = {(r['benchmark'], r['dataset'], r.get('cache')): r for r in json.load(f)['results']}
+    print(f"\nCompared with {old_path}:")
+    for result in results:
+        previous = old.get((result['benchmark'], result['dataset'], result.get('cache')))
+        if previous:
+            print(f"  {result['benchmark']:18} {result['dataset']:16} {previous['median']:12.3f} -> "
+                  f"{result['median']:12.3f} {result['unit']:10} ({result['median'] / previous['median']:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, nargs='*', default=[10_000],
+                        help='synthetic file sizes (10^4 to 10^7)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sample', type=int, default=50_000,
+                        help='lines per dataset for per-line, per-text and per-point benchmarks')
+    parser.add_argument('--groups', nargs='*', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--child', choices=GROUPS, help=argparse.SUPPRESS)
+    parser.add_argument('--spec', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        bench = {'models': bench_models, 'ingest': bench_ingest, 'analysis': bench_analysis}[args.child]
+        print(json.dumps(bench(json.loads(args.spec))))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        datasets = {'real': [str(path) for path in REAL_FILES]}
+        for lines in args.lines:
+            path = write_file(Path(tmp) / f'synthetic_{lines}.txt', lines, args.seed)
+            datasets[f'synthetic_{lines}'] = [str(path)]
+        spec = {'tmp': tmp, 'datasets': datasets, 'repeat': args.repeat, 'sample': args.sample}
+
+        results = []
+        # Analysis reads the tables the ingest benchmark writes
+        groups = [group for group in GROUPS if group in args.groups]
+        if 'analysis' in groups and 'ingest' not in groups:
+            groups.insert(groups.index('analysis'), 'ingest')
+        for group in groups:
+            print(f"Running {group} benchmarks...")
+            group_results = run_group(group, spec)
+            if group in args.groups:
+                results.extend(group_results)
+
+    for result in results:
+        extra = f" cache {result['cache']}" if 'cache' in result else ''
+        print(f"  {result['benchmark']:18} {result['dataset']:16} median {result['median']:12.3f} "
+              f"{result['unit']:10} p95 {result['p95']:12.3f}{extra}")
+
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {name: value for name, value in vars(args).items() if name not in ('child', 'spec')},
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# bench_table_snapshot.py
+"""
+Raw-row analysis from SQL rows vs. from the table's columnar snapshot.
+
+Uses the same seeded synthetic table as bench_analysis_memory.py (pre-score
+schema, so every row is scored and located) and reports, per mode, the
+median time of reading the rows alone (latitude, longitude and text of
+every shard) and of the whole DataProcessor.process_table:
+
+- sql:      rows streamed from SQLite, as with TABLE_SNAPSHOTS=0
+- snapshot: rows sliced from the memory-mapped snapshot
+
+plus the one-off time of building the snapshot. Both modes must produce
+the same color map.
+
+Usage:
+    python src/Benchmarks/bench_table_snapshot.py [--rows N] [--repeat N] [--workers N]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_analysis_memory import DATA_DIR, SERVICES_DIR, generate_table
+
+sys.path[:0] = [str(SERVICES_DIR / 'SentimentAnalysisService'), str(SERVICES_DIR / 'Common')]
+# Repeated runs would be answered from the scoring memos (see bench_scoring_memo.py)
+os.environ.setdefault('SCORING_MEMOS', '0')
+
+
+def median_time(repeat, run):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1, help='shard worker processes')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    import table_snapshot
+    from data_processor import DataProcessor
+    from database import DatabaseManager
+    from metrics import Stages
+    from model_snapshot import load_models
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / 'DataTweets.db'
+        generate_table(db_path, args.rows)
+        models = load_models(SimpleNamespace(snapshot_path=Path(tmp) / 'ModelSnapshot.bin',
+                                             sentiments_path=DATA_DIR / 'sentiments.csv',
+                                             states_path=DATA_DIR / 'states.json'))
+        db_manager = DatabaseManager(db_path)
+        db_manager.init_db()
+        processor = DataProcessor(db_manager, models.analyzer, models.locator, workers=args.workers)
+        first_id, last_id = db_manager.get_id_range('synthetic')
+        shards = [(start, start + DataProcessor.SHARD_ROWS)
+                  for start in range(first_id, last_id + 1, DataProcessor.SHARD_ROWS)]
+
+        def read_sql():
+            rows = 0
+            for shard in shards:
+                with db_manager.snapshot() as conn:
+                    for batch in db_manager.get_tweets('synthetic', shard, conn=conn):
+                        rows += len(batch)
+            return rows
+
+        def read_snapshot():
+            rows = 0
+            for shard in shards:
+                with db_manager.snapshot() as conn:
+                    rows += len(processor._read_columns(conn, 'synthetic', shard, None, Stages())[0])
+            return rows
+
+        start = time.perf_counter()
+        snapshot = db_manager.table_snapshots.get('synthetic', build=True)
+        build_seconds = time.perf_counter() - start
+        print(f"{args.rows:,} rows, {len(shards)} shards, {args.workers} workers; snapshot "
+              f"{snapshot.path.stat().st_size / 2**20:.0f} MiB built in {build_seconds:.2f} s")
+
+        results = {}
+        print(f"{'mode':9} {'read rows':>10} {'analysis':>10} {'rows/s':>12}")
+        for mode, read in (('sql', read_sql), ('snapshot', read_snapshot)):
+            table_snapshot.ENABLED = mode == 'snapshot'
+            read_seconds, rows = median_time(args.repeat, read)
+            assert rows == args.rows, f"{mode} read {rows} rows"
+            seconds, results[mode] = median_time(args.repeat, lambda: processor.process_table('synthetic'))
+            print(f"{mode:9} {read_seconds:8.2f} s {seconds:8.2f} s {args.rows / seconds:12,.0f}")
+        assert results['sql'] == results['snapshot'], "the snapshot changed the result"
+
+
+if __name__ == '__main__':
+    main()
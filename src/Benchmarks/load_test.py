@@ -0,0 +1,303 @@
+# load_test.py
+"""
+Load test of both services with mixed upload, table listing and analysis traffic.
+
+Starts the services on a temporary database as docker-compose.yml runs
+them (the analysis service under gunicorn with gunicorn.conf.py, the
+collection service under `flask run`), uploads every payload once so
+analyses have tables to read, then sends requests for --duration seconds:
+
+- upload:   POST /upload of a payload file (replace mode), round robin
+            over the real Data/*_tweets2014.txt files and --synthetic
+            generated files of --synthetic-lines lines each
+- tables:   GET /tables
+- analyze:  GET /analyze/<table> of a random uploaded table
+
+picked at random with the weights of --mix. With --rate, requests start
+at that many per second (Poisson arrivals) whatever the response times,
+and latency counts from the planned start, so a stalled service shows as
+latency rather than as fewer requests; without it, --concurrency clients
+send requests back to back. --conditional makes clients revalidate with
+the last ETag they got, as browsers do.
+
+Reports per endpoint the requests, throughput, p50/p95/p99 latency, the
+error rate (non-2xx/304 statuses, bodies with an 'error', failed
+connections) and SQLite lock errors ('database is locked' in a response
+body), and the lock errors in each service's log. Exits with status 1 if
+there were any lock errors.
+
+Usage:
+    python src/Benchmarks/load_test.py [--duration S] [--rate N] [--concurrency N]
+        [--mix upload=1,tables=4,analyze=5] [--synthetic N] [--synthetic-lines N]
+        [--workers N] [--conditional] [--output FILE]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tweet_generator import DATA_DIR, REAL_FILES, write_file
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / 'Services'
+ENDPOINTS = ('upload', 'tables', 'analyze')
+LOCK_MESSAGES = ('database is locked', 'database table is locked')
+START_TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+
+class Service:
+    """A service started as deployed, on the given database and port"""
+
+    def __init__(self, name, command, port, tmp, env):
+        self.name, self.port = name, port
+        self.log_path = Path(tmp) / f'{name}.log'
+        self.log = open(self.log_path, 'wb')
+        self.process = subprocess.Popen(command, cwd=SERVICES_DIR / name, env=dict(os.environ, **env),
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, path):
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited, see its log:\n{self.log_path.read_text()[-3000:]}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                conn.request('GET', path)
+                conn.getresponse().read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"{self.name} did not start within {START_TIMEOUT} s")
+
+    def lock_errors(self):
+        text = self.log_path.read_text(errors='replace')
+        return sum(text.count(message) for message in LOCK_MESSAGES)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def request(port, method, path, body=None, headers=None, timeout=300):
+    """(status, headers, body) of one request on a new connection"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        conn.close()
+
+
+def multipart(path, table):
+    """multipart/form-data body and its content type for an upload of path as table"""
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="mode"\r\n\r\nreplace\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{table}.txt"\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode()
+    return head + Path(path).read_bytes() + f'\r\n--{boundary}--\r\n'.encode(), \
+        f'multipart/form-data; boundary={boundary}'
+
+
+class LoadTest:
+    def __init__(self, args, collection_port, analysis_port, payloads):
+        self.args = args
+        self.ports = {'upload': collection_port, 'tables': collection_port, 'analyze': analysis_port}
+        # (body, content type, table) of every payload, read once
+        self.uploads = [multipart(path, f'load_{path.stem}') + (f'load_{path.stem}',) for path in payloads]
+        self.tables = [table for _, _, table in self.uploads]
+        self.next_upload = 0
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.locks = defaultdict(int)
+        self.etags = threading.local()
+        self.lock = threading.Lock()
+
+    def seed(self):
+        for body, content_type, table in self.uploads:
+            status, _, data = request(self.ports['upload'], 'POST', '/upload', body, {'Content-Type': content_type})
+            if status != 200:
+                raise RuntimeError(f"seeding '{table}' failed: {status} {data[:500]!r}")
+
+    def send(self, endpoint, rng):
+        headers = {}
+        if endpoint == 'upload':
+            with self.lock:
+                body, content_type, _ = self.uploads[self.next_upload % len(self.uploads)]
+                self.next_upload += 1
+            method, path, headers = 'POST', '/upload', {'Content-Type': content_type}
+        else:
+            method, body = 'GET', None
+            path = '/tables' if endpoint == 'tables' else f'/analyze/{rng.choice(self.tables)}'
+        etags = self.etags.__dict__.setdefault('by_path', {})
+        if self.args.conditional and path in etags:
+            headers['If-None-Match'] = etags[path]
+        status, response_headers, data = request(self.ports[endpoint], method, path, body, headers)
+        if self.args.conditional and response_headers.get('ETag'):
+            etags[path] = response_headers['ETag']
+        return status, data
+
+    def run_one(self, endpoint, planned, rng):
+        lock_error = failed = False
+        try:
+            status, data = self.send(endpoint, rng)
+            text = data.decode(errors='replace')
+            lock_error = any(message in text for message in LOCK_MESSAGES)
+            failed = status not in (200, 304) or (status == 200 and text.lstrip().startswith('{')
+                                                  and 'error' in json.loads(text))
+        except (OSError, http.client.HTTPException, ValueError):
+            failed = True
+        latency = time.perf_counter() - planned
+        with self.lock:
+            self.samples[endpoint].append(latency)
+            self.errors[endpoint] += failed
+            self.locks[endpoint] += lock_error
+
+    def run(self):
+        names, weights = zip(*self.args.mix.items())
+        rng = random.Random(self.args.seed)
+        start = time.perf_counter()
+        end = start + self.args.duration
+        with ThreadPoolExecutor(self.args.concurrency) as pool:
+            if self.args.rate:
+                planned = start
+                while planned < end:
+                    delay = planned - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(self.run_one, rng.choices(names, weights)[0], planned,
+                                random.Random(rng.random()))
+                    planned += rng.expovariate(self.args.rate)
+            else:
+                def client(seed):
+                    client_rng = random.Random(seed)
+                    while time.perf_counter() < end:
+                        self.run_one(client_rng.choices(names, weights)[0], time.perf_counter(), client_rng)
+
+                for seed in range(self.args.concurrency):
+                    pool.submit(client, rng.random() + seed)
+        return time.perf_counter() - start
+
+    def report(self, seconds):
+        results = {}
+        for endpoint in ENDPOINTS:
+            latencies = sorted(self.samples[endpoint])
+            if not latencies:
+                continue
+            results[endpoint] = {
+                'requests': len(latencies),
+                'rps': len(latencies) / seconds,
+                'p50_ms': percentile(latencies, 0.50) * 1e3,
+                'p95_ms': percentile(latencies, 0.95) * 1e3,
+                'p99_ms': percentile(latencies, 0.99) * 1e3,
+                'error_rate': self.errors[endpoint] / len(latencies),
+                'lock_errors': self.locks[endpoint],
+            }
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of traffic')
+    parser.add_argument('--rate', type=float, default=0.0, help='requests per second; 0 for closed-loop clients')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at most')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('upload=1,tables=4,analyze=5'),
+                        help='endpoint weights, e.g. upload=1,tables=4,analyze=5')
+    parser.add_argument('--synthetic', type=int, default=2, help='synthetic payload files')
+    parser.add_argument('--synthetic-lines', type=int, default=100_000, help='lines per synthetic file')
+    parser.add_argument('--workers', type=int, default=None, help='gunicorn workers (default as deployed)')
+    parser.add_argument('--conditional', action='store_true', help='revalidate with If-None-Match')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        payloads = list(REAL_FILES)
+        for i in range(args.synthetic):
+            payloads.append(write_file(Path(tmp) / f'synthetic_{i}.txt', args.synthetic_lines, seed=i))
+
+        db_dir = Path(tmp) / 'DataBase'
+        db_dir.mkdir()
+        env = {'TWEETS_DB_PATH': str(db_dir / 'DataTweets.db'), 'DATA_DIR': str(DATA_DIR),
+               'METRICS_DIR': str(Path(tmp) / 'metrics')}
+        if args.workers:
+            env['WEB_CONCURRENCY'] = str(args.workers)
+        collection_port, analysis_port = free_port(), free_port()
+        services = []
+        try:
+            # The analysis service needs the database the collection service creates
+            collection = Service('TweetCollectionService',
+                                 [sys.executable, '-m', 'flask', 'run', '--port', str(collection_port)],
+                                 collection_port, tmp, dict(env, FLASK_APP='app.py'))
+            services.append(collection)
+            collection.wait_ready('/tables')
+            analysis = Service('SentimentAnalysisService',
+                               [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                                '--bind', f'127.0.0.1:{analysis_port}', 'app:app'],
+                               analysis_port, tmp, env)
+            services.append(analysis)
+            analysis.wait_ready('/metrics')
+
+            test = LoadTest(args, collection_port, analysis_port, payloads)
+            print(f"Seeding {len(payloads)} tables...")
+            test.seed()
+            print(f"Sending traffic for {args.duration:.0f} s "
+                  f"({f'{args.rate:g} req/s' if args.rate else f'{args.concurrency} clients'})...")
+            results = test.report(test.run())
+            log_locks = {service.name: service.lock_errors() for service in services}
+        finally:
+            for service in services:
+                service.stop()
+
+    print(f"{'endpoint':8} {'requests':>8} {'req/s':>7} {'p50':>10} {'p95':>10} {'p99':>10} {'errors':>7} {'locks':>6}")
+    for endpoint, r in results.items():
+        print(f"{endpoint:8} {r['requests']:8} {r['rps']:7.1f} {r['p50_ms']:7.1f} ms {r['p95_ms']:7.1f} ms "
+              f"{r['p99_ms']:7.1f} ms {r['error_rate']:7.1%} {r['lock_errors']:6}")
+    print('Lock errors in logs: ' + ', '.join(f'{name} {count}' for name, count in log_locks.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k != 'output'},
+                       'endpoints': results, 'log_lock_errors': log_locks}, f, indent=2)
+
+    if any(r['lock_errors'] for r in results.values()) or any(log_locks.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
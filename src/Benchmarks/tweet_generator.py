@@ -0,0 +1,86 @@
+# tweet_generator.py
+"""
+Seeded synthetic tweet files in the upload format:
+
+    [lat, lon]<TAB>_<TAB>YYYY-MM-DD HH:MM:SS<TAB>text
+
+Coordinates are jittered locations of the real tweets in Data/, timestamps
+advance from a start date, and texts mix words of the real tweets with
+lexicon entries, so sentiment and state hit rates resemble the real files.
+The same seed always produces the same file.
+
+Usage:
+    python src/Benchmarks/tweet_generator.py OUTPUT [--lines N] [--seed N] [--invalid-rate P]
+"""
+
+import argparse
+import csv
+import random
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+DATA_DIR = BASE_DIR / 'Data'
+REAL_FILES = sorted(DATA_DIR.glob('*_tweets2014.txt'))
+
+LINE_PATTERN = re.compile(r'^\[(-?\d+\.\d+),\s*(-?\d+\.\d+)\]\s+_\s+\S+\s\S+\s+(.*)$')
+WORD_PATTERN = re.compile(r'\S+')
+
+
+def load_corpus() -> Tuple[List[Tuple[float, float]], List[str], List[str]]:
+    """Coordinates and words of the real tweets, and the lexicon entries"""
+    coordinates, words = [], []
+    for path in REAL_FILES:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                match = LINE_PATTERN.match(line.strip())
+                if match:
+                    coordinates.append((float(match.group(1)), float(match.group(2))))
+                    words.extend(WORD_PATTERN.findall(match.group(3)))
+    with open(DATA_DIR / 'sentiments.csv', encoding='utf-8-sig') as f:
+        lexicon = [row[0] for row in csv.reader(f) if row]
+    return coordinates, words, lexicon
+
+
+def generate_lines(count: int, seed: int = 42, start: datetime = datetime(2014, 2, 16),
+                   invalid_rate: float = 0.001) -> Iterator[str]:
+    """Yield count lines (without line breaks)"""
+    rng = random.Random(seed)
+    coordinates, words, lexicon = load_corpus()
+    timestamp = start
+    for _ in range(count):
+        timestamp += timedelta(seconds=rng.randint(0, 2))
+        if rng.random() < invalid_rate:
+            yield f"[not a coordinate]\t_\t{timestamp:%Y-%m-%d %H:%M:%S}\tbroken line"
+            continue
+        lat, lon = rng.choice(coordinates)
+        lat = min(90.0, max(-90.0, lat + rng.gauss(0, 0.05)))
+        lon = min(180.0, max(-180.0, lon + rng.gauss(0, 0.05)))
+        text = ' '.join(rng.choice(lexicon) if rng.random() < 0.1 else rng.choice(words)
+                        for _ in range(rng.randint(4, 18)))[:500]
+        yield f"[{lat:.8f}, {lon:.8f}]\t_\t{timestamp:%Y-%m-%d %H:%M:%S}\t{text}"
+
+
+def write_file(path, count: int, seed: int = 42, invalid_rate: float = 0.001) -> Path:
+    path = Path(path)
+    with open(path, 'w', encoding='utf-8') as out:
+        for line in generate_lines(count, seed, invalid_rate=invalid_rate):
+            out.write(line + '\n')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output')
+    parser.add_argument('--lines', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--invalid-rate', type=float, default=0.001)
+    args = parser.parse_args()
+    path = write_file(args.output, args.lines, args.seed, args.invalid_rate)
+    print(f"Wrote {args.lines:,} lines to {path} ({path.stat().st_size / 2**20:.1f} MiB)")
+
+
+if __name__ == '__main__':
+    main()
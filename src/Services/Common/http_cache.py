@@ -0,0 +1,83 @@
+# http_cache.py
+"""
+Conditional and compressed HTTP responses shared by both services.
+
+Cacheable routes tag their responses with a strong ETag made from a
+version token of what they answer (a table's content version, the model
+version, the request's parameters) rather than from the body, so a client
+repeating a request with a matching If-None-Match gets a 304 before any
+query runs or any byte of the result is sent.
+
+`compress_app` gzip- or deflate-encodes JSON responses for clients that
+accept it. A content-coded body is a different representation, so its
+ETag carries the coding as a suffix; responses with an ETag are always
+encoded when the client accepts a coding, so a 304 can name the same tag
+as the 200 it revalidates. Other responses are only encoded from
+COMPRESS_MIN_SIZE bytes, below which the savings don't pay for the
+headers.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import zlib
+from typing import Optional
+
+from flask import Response, request
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = 6
+# In order of preference
+ENCODINGS = ('gzip', 'deflate')
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain')
+
+
+def negotiate_encoding() -> Optional[str]:
+    """Content coding for the current request's response, None for the body as is"""
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag (unquoted) of a version token, for the current request's coding.
+
+    parts must be JSON-serializable; equal parts give equal tags.
+    """
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:24]
+    encoding = negotiate_encoding()
+    return f'{digest}-{encoding}' if encoding else digest
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """A 304 response if the request's If-None-Match holds etag, else None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _encode(data: bytes, encoding: str) -> bytes:
+    if encoding == 'gzip':
+        # mtime 0: the same body always gives the same bytes
+        return gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+    return zlib.compress(data, COMPRESS_LEVEL)
+
+
+def compress_app(app):
+    """Encode JSON responses of a Flask app as its clients accept"""
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding()
+        etag, _ = response.get_etag()
+        if not encoding or (etag is None and response.content_length < COMPRESS_MIN_SIZE):
+            return response
+        response.set_data(_encode(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,433 @@
+# jobs.py
+"""
+Background jobs for long uploads and analyses.
+
+Jobs are rows of a SQLite database shared by both services (Jobs.db next
+to the tweets database, so job bookkeeping never waits for the tweets
+database's writer). A JobQueue runs the kinds of jobs it has runners for
+on a bounded pool of threads:
+
+- submit() stores a job as queued and returns its id at once; an input
+  file is spooled next to the database;
+- run() runs a job in the calling thread and stores nothing, for
+  synchronous routes: only jobs submitted to run in the background get
+  a row (kept for RETENTION) and wait for a worker;
+- a worker thread of any process claims the oldest queued job with one
+  UPDATE, runs it and stores its result or error;
+- runners report progress through Job.update(), which also raises
+  JobCancelled once a cancel has been requested;
+- running jobs are kept alive by heartbeats. A job whose process died
+  (a restart) stops beating and is claimed again, up to MAX_ATTEMPTS
+  times; uploads and analyses are transactional, so a rerun is safe.
+
+A job whose params carry a 'profile' id runs under cProfile.
+
+`jobs_blueprint` adds the status, result and cancel routes to a service.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import (Column, Float, Integer, MetaData, String, Table, Text, bindparam, delete, insert, select,
+                        update)
+
+from profiling import profiled
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Seconds between heartbeats of running jobs, and without one before a job
+# counts as abandoned by its process
+HEARTBEAT_INTERVAL = 10.0
+STALE_AFTER = 60.0
+# Seconds idle workers wait before looking for jobs submitted by other processes
+POLL_INTERVAL = 1.0
+# Least seconds between progress writes of one job
+PROGRESS_INTERVAL = 0.5
+MAX_ATTEMPTS = 3
+# Finished jobs are deleted after this many seconds
+RETENTION = float(os.environ.get('JOB_RETENTION', 7 * 24 * 3600))
+
+metadata = MetaData()
+
+jobs = Table(
+    'jobs', metadata,
+    Column('id', String(32), primary_key=True),
+    Column('kind', String, nullable=False),
+    Column('status', String, nullable=False, index=True),
+    Column('params', Text, nullable=False),
+    Column('progress', Text, nullable=True),
+    Column('result', Text, nullable=True),
+    Column('error', Text, nullable=True),
+    Column('error_status', Integer, nullable=True),
+    Column('cancel_requested', Integer, nullable=False, default=0),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('created_at', Float, nullable=False),
+    Column('started_at', Float, nullable=True),
+    Column('finished_at', Float, nullable=True),
+    Column('heartbeat_at', Float, nullable=True),
+)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once its cancellation has been requested."""
+    pass
+
+
+class Job:
+    """A claimed job, as seen by its runner.
+
+    Attributes:
+        id (str): Job id
+        kind (str): Runner name
+        params (Dict): Parameters given at submission
+        input_path (str): Spooled input file, if one was submitted
+    """
+
+    def __init__(self, queue, job_id: str, kind: str, params: Dict):
+        self.queue = queue
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.input_path = queue.input_path(job_id)
+        self._written_at = 0.0
+
+    def update(self, progress: Dict, force: bool = False):
+        """Store progress (e.g. rows processed so far), at most every PROGRESS_INTERVAL.
+
+        Raises:
+            JobCancelled: If the job's cancellation was requested
+        """
+        now = time.time()
+        if not force and now - self._written_at < PROGRESS_INTERVAL:
+            return
+        self._written_at = now
+        with self.queue.storage.writer.begin() as conn:
+            cancel = conn.execute(
+                update(jobs).where(jobs.c.id == self.id)
+                .values(progress=json.dumps(progress), heartbeat_at=now)
+                .returning(jobs.c.cancel_requested)
+            ).scalar()
+        if cancel:
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def open_input(self):
+        """The input file, opened for binary reading"""
+        return open(self.input_path, 'rb')
+
+    def input_size(self) -> Optional[int]:
+        return os.path.getsize(self.input_path)
+
+
+class InlineJob(Job):
+    """A job run in the thread of its request (JobQueue.run).
+
+    It isn't stored: progress is dropped and it can't be cancelled.
+
+    Attributes:
+        upload (FileStorage): Input file, read as it was received
+    """
+
+    def __init__(self, kind: str, params: Dict, upload=None):
+        self.queue = None
+        self.id = 'inline'
+        self.kind = kind
+        self.params = params
+        self.input_path = None
+        self.upload = upload
+
+    def update(self, progress: Dict, force: bool = False):
+        pass
+
+    def open_input(self):
+        return contextlib.nullcontext(self.upload)
+
+    def input_size(self) -> Optional[int]:
+        return None
+
+
+def _timestamp(value: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(value, timezone.utc).isoformat() if value else None
+
+
+class JobQueue:
+    """Persistent job queue worked off by a bounded pool of threads per process.
+
+    Args:
+        db_path: Path of the jobs database
+        runners: Job kind -> callable(Job) returning a JSON-serializable result
+        workers (int): Worker threads of this process
+        describe_error: Exception -> (message, HTTP status) stored for failed jobs
+    """
+
+    def __init__(self, db_path, runners: Dict[str, Callable], workers: int = 2,
+                 describe_error: Callable[[Exception], Tuple[str, int]] = lambda e: (str(e), 500)):
+        self.storage = Storage(db_path)
+        self.spool_dir = os.path.join(os.path.dirname(str(db_path)), 'JobInputs')
+        self.runners = runners
+        self.workers = workers
+        self.describe_error = describe_error
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._started_pid = None
+
+        # One statement, so no two workers of any process claim the same job
+        claimable = (jobs.c.kind.in_(list(runners)) & (jobs.c.cancel_requested == 0) & (
+            (jobs.c.status == QUEUED)
+            | ((jobs.c.status == RUNNING) & (jobs.c.heartbeat_at < bindparam('stale_before')))
+        ))
+        oldest = select(jobs.c.id).where(claimable).order_by(jobs.c.created_at).limit(1).scalar_subquery()
+        self._claim_statement = (
+            update(jobs).where(jobs.c.id == oldest)
+            .values(status=RUNNING, attempts=jobs.c.attempts + 1,
+                    started_at=bindparam('now'), heartbeat_at=bindparam('now'))
+            .returning(jobs.c.id, jobs.c.kind, jobs.c.params, jobs.c.attempts)
+        )
+
+    def init_db(self):
+        """Create the jobs table if missing; start() does, before any worker claims a job"""
+        self.storage.create_all(metadata)
+
+    def start(self):
+        """Start the worker threads; once per process, so safe after fork"""
+        if self._started_pid == os.getpid():
+            return
+        self.init_db()
+        self._started_pid = os.getpid()
+        self._running = set()
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def input_path(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, job_id)
+
+    def submit(self, kind: str, params: Dict, upload=None) -> str:
+        """Queue a job and return its id.
+
+        Args:
+            kind (str): One of the runners' kinds
+            params (Dict): JSON-serializable parameters
+            upload (FileStorage): Optional input file, spooled until the job ends
+        """
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        self.start()
+        job_id = uuid.uuid4().hex
+        if upload is not None:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            upload.save(self.input_path(job_id))
+        with self.storage.writer.begin() as conn:
+            conn.execute(insert(jobs).values(id=job_id, kind=kind, status=QUEUED, params=json.dumps(params),
+                                             cancel_requested=0, attempts=0, created_at=time.time()))
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Public view of a job: status, progress and timestamps, or None"""
+        with self.storage.reader.connect() as conn:
+            row = conn.execute(select(jobs).where(jobs.c.id == job_id)).first()
+        if row is None:
+            return None
+        return {
+            'id': row.id,
+            'kind': row.kind,
+            'status': row.status,
+            'progress': json.loads(row.progress) if row.progress else None,
+            'error': row.error,
+            'cancel_requested': bool(row.cancel_requested),
+            'created_at': _timestamp(row.created_at),
+            'started_at': _timestamp(row.started_at),
+            'finished_at': _timestamp(row.finished_at),
+        }
+
+    def result(self, job_id: str) -> Optional[Tuple[Dict, int]]:
+        """Result (or error) of a job with the HTTP status a synchronous call would have had.
+
+        Returns None for unknown jobs; unfinished jobs give 202 and their status.
+        """
+        with self.storage.reader.connect() as conn:
+            row = conn.execute(select(jobs).where(jobs.c.id == job_id)).first()
+        if row is None:
+            return None
+        if row.status in FINISHED:
+            return self._outcome(row.status, json.loads(row.result) if row.result else None,
+                                 row.error, row.error_status)
+        return self.get(job_id), 202
+
+    def run(self, kind: str, params: Dict, upload=None) -> Tuple[Dict, int]:
+        """Run a job in the calling thread and return what result() would; for synchronous routes.
+
+        Nothing is written to the jobs database and no worker is waited
+        for; the runner reads upload as received.
+        """
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        status, values = self._execute(InlineJob(kind, params, upload))
+        return self._outcome(status, **values)
+
+    @staticmethod
+    def _outcome(status: str, result: Optional[Dict] = None, error: Optional[str] = None,
+                 error_status: Optional[int] = None) -> Tuple[Dict, int]:
+        """Response body and HTTP status of a finished job"""
+        if status == SUCCEEDED:
+            return result, 200
+        if status == FAILED:
+            return {'error': error}, error_status or 500
+        return {'error': 'Job cancelled'}, 409
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Cancel a queued job now, or ask a running one to stop at its next progress update"""
+        now = time.time()
+        with self.storage.writer.begin() as conn:
+            cancelled = conn.execute(
+                update(jobs).where((jobs.c.id == job_id) & (jobs.c.status == QUEUED))
+                .values(status=CANCELLED, finished_at=now)
+            ).rowcount
+            if not cancelled:
+                conn.execute(update(jobs).where((jobs.c.id == job_id) & (jobs.c.status == RUNNING))
+                             .values(cancel_requested=1))
+        if cancelled:
+            self._remove_input(job_id)
+        return self.get(job_id)
+
+    def _work(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {str(e)}")
+                claimed = None
+            if claimed is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_INTERVAL)
+                continue
+            self._run(claimed)
+
+    def _claim(self) -> Optional[Job]:
+        """Take the oldest queued (or abandoned) job of this queue's kinds"""
+        now = time.time()
+        with self.storage.writer.begin() as conn:
+            row = conn.execute(self._claim_statement, {'now': now, 'stale_before': now - STALE_AFTER}).first()
+        if row is None:
+            return None
+        with self._lock:
+            self._running.add(row.id)
+        if row.attempts > MAX_ATTEMPTS:
+            self._finish(row.id, FAILED, error=f"Interrupted {MAX_ATTEMPTS} times", error_status=500)
+            return None
+        return Job(self, row.id, row.kind, json.loads(row.params))
+
+    def _expire(self):
+        """Settle abandoned jobs that were being cancelled and delete old finished ones"""
+        now = time.time()
+        with self.storage.writer.begin() as conn:
+            conn.execute(
+                update(jobs).where((jobs.c.status == RUNNING) & (jobs.c.cancel_requested == 1)
+                                   & (jobs.c.heartbeat_at < now - STALE_AFTER))
+                .values(status=CANCELLED, finished_at=now)
+            )
+            conn.execute(delete(jobs).where(jobs.c.status.in_(FINISHED) & (jobs.c.finished_at < now - RETENTION)))
+
+    def _run(self, job: Job):
+        logger.info(f"Running {job.kind} job {job.id}")
+        status, values = self._execute(job)
+        if 'result' in values:
+            values['result'] = json.dumps(values['result'])
+        self._finish(job.id, status, **values)
+
+    def _execute(self, job: Job) -> Tuple[str, Dict]:
+        """Run a job's runner: the job's final status and the values stored with it"""
+        try:
+            # Jobs of requests that asked for a profile (see profiling.py)
+            with profiled(job.params.get('profile')):
+                result = self.runners[job.kind](job)
+        except JobCancelled:
+            return CANCELLED, {}
+        except Exception as e:
+            message, status = self.describe_error(e)
+            logger.error(f"{job.kind} job {job.id} failed: {str(e)}", exc_info=status >= 500)
+            return FAILED, {'error': message, 'error_status': status}
+        return SUCCEEDED, {'result': result}
+
+    def _finish(self, job_id: str, status: str, **values):
+        with self.storage.writer.begin() as conn:
+            conn.execute(update(jobs).where(jobs.c.id == job_id)
+                         .values(status=status, finished_at=time.time(), **values))
+        with self._lock:
+            self._running.discard(job_id)
+        self._remove_input(job_id)
+
+    def _remove_input(self, job_id: str):
+        try:
+            os.remove(self.input_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _heartbeat(self):
+        """Keep this process's running jobs alive, and expire others now and then"""
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                running = list(self._running)
+            try:
+                if running:
+                    with self.storage.writer.begin() as conn:
+                        conn.execute(update(jobs).where(jobs.c.id.in_(running) & (jobs.c.status == RUNNING))
+                                     .values(heartbeat_at=time.time()))
+                self._expire()
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {str(e)}")
+
+
+def jobs_blueprint(queue: JobQueue):
+    """Routes to poll, fetch the result of and cancel jobs of a queue"""
+    from flask import Blueprint, jsonify
+
+    blueprint = Blueprint('jobs', __name__)
+
+    @blueprint.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 200
+
+    @blueprint.route('/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        outcome = queue.result(job_id)
+        if outcome is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(outcome[0]), outcome[1]
+
+    @blueprint.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def job_cancel(job_id):
+        job = queue.cancel(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 200
+
+    return blueprint
+
+
+def accepted(job_id: str):
+    """202 response to a job submission, pointing at the job"""
+    from flask import jsonify
+
+    response = jsonify({'job_id': job_id, 'status': QUEUED, 'status_url': f'/jobs/{job_id}',
+                        'result_url': f'/jobs/{job_id}/result'})
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response
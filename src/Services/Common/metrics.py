@@ -0,0 +1,374 @@
+# metrics.py
+"""
+Prometheus metrics shared by both services.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format. `instrument_app` adds request latency histograms
+and a /metrics route to a Flask app; `Stages` accumulates the time an
+upload or analysis spends in each stage and records it once at the end,
+also as one JSON line on the 'tweetmood.stages' logger:
+
+    {"event": "stages", "operation": "analysis", "table": "t", "rows": 7408,
+     "elapsed_ms": 41.2, "stages_ms": {"fetch": 9.1, "tokenize": 22.4, ...}}
+
+METRICS_ENABLED=0 switches instrumentation off: no request hooks are
+installed and every recording call returns at its first check. Stage
+timing stays on for the logs unless STAGE_LOGS=0 too.
+
+Processes of one service (gunicorn workers) are merged when METRICS_DIR
+is set: each process writes its values to a file there every few seconds
+and before rendering, and /metrics adds up the files of all processes.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, Tuple
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no', 'off')
+METRICS_DIR = os.environ.get('METRICS_DIR')
+STAGE_LOGS = os.environ.get('STAGE_LOGS', '1').lower() not in ('0', 'false', 'no', 'off')
+# Spans are timed for the stage metrics, the stage logs or both
+TIMED = ENABLED or STAGE_LOGS
+FLUSH_INTERVAL = 5.0
+
+# Seconds; from fast cached responses to minute-long uploads
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named family of values keyed by label values."""
+
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {json.dumps(key): self._copy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def render(self, values: Dict[Tuple[str, ...], object]) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        for key in sorted(values):
+            yield from self._render_value(key, values[key])
+
+    def _render_value(self, key, value):
+        yield f'{self.name}{_label_text(self.label_names, key)} {_number(value)}'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(values):
+        return sum(values)
+
+
+class Gauge(Metric):
+    """Gauge; across processes the most recently set value wins."""
+
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = (value, time.time())
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+    @staticmethod
+    def merge(values):
+        return max(values, key=lambda value: value[1])
+
+    def _render_value(self, key, value):
+        yield f'{self.name}{_label_text(self.label_names, key)} {_number(value[0])}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def merge(values):
+        values = list(values)
+        return [[sum(counts) for counts in zip(*(value[0] for value in values))],
+                sum(value[1] for value in values), sum(value[2] for value in values)]
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _label_text(self.label_names + ('le',), key + (_number(bound),))
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _label_text(self.label_names, key)
+        yield f'{self.name}_sum{labels} {_number(total)}'
+        yield f'{self.name}_count{labels} {count}'
+
+
+class Registry:
+    """Metrics of one process, rendered alone or merged with sibling processes."""
+
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self._metrics = {}
+        self._flusher_pid = None
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self._get(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self._get(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, labels, buckets)
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.metrics_dir, f'metrics-{pid or os.getpid()}.json')
+
+    def flush(self):
+        """Write this process's values to METRICS_DIR"""
+        if not self.metrics_dir:
+            return
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        path = self._snapshot_path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump({name: metric.snapshot() for name, metric in self._metrics.items()}, f)
+        os.replace(path + '.tmp', path)
+
+    def start_flusher(self):
+        """Flush periodically from a daemon thread; once per process (safe after fork)"""
+        if not self.metrics_dir or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+
+        def flush_forever():
+            while True:
+                time.sleep(FLUSH_INTERVAL)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+        threading.Thread(target=flush_forever, daemon=True).start()
+
+    def _collect(self):
+        """Values per metric, merged over all processes' snapshots when shared"""
+        if not self.metrics_dir:
+            return {name: {tuple(json.loads(key)): value for key, value in metric.snapshot().items()}
+                    for name, metric in self._metrics.items()}
+
+        self.flush()
+        merged = defaultdict(lambda: defaultdict(list))
+        for entry in os.scandir(self.metrics_dir):
+            if not (entry.name.startswith('metrics-') and entry.name.endswith('.json')):
+                continue
+            try:
+                with open(entry.path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, values in snapshot.items():
+                for key, value in values.items():
+                    merged[name][tuple(json.loads(key))].append(value)
+        return {name: {key: self._metrics[name].merge(values) for key, values in merged[name].items()}
+                for name in self._metrics}
+
+    def render(self) -> str:
+        lines = []
+        for name, values in self._collect().items():
+            lines.extend(self._metrics[name].render(values))
+        return '\n'.join(lines) + '\n'
+
+    def reset_shared(self):
+        """Remove snapshots of earlier processes (at server start)"""
+        if not self.metrics_dir or not os.path.isdir(self.metrics_dir):
+            return
+        for entry in os.scandir(self.metrics_dir):
+            if entry.name.startswith('metrics-'):
+                os.remove(entry.path)
+
+
+registry = Registry()
+stage_logger = logging.getLogger('tweetmood.stages')
+
+REQUEST_SECONDS = registry.histogram(
+    'tweetmood_http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'))
+STAGE_SECONDS = registry.histogram(
+    'tweetmood_stage_duration_seconds', 'Time per processing stage of one upload or analysis', ('stage',))
+ROWS_TOTAL = registry.counter(
+    'tweetmood_rows_total', 'Rows processed by uploads and analyses', ('operation',))
+ROWS_PER_SECOND = registry.gauge(
+    'tweetmood_rows_per_second', 'Throughput of the most recent upload or analysis', ('operation',))
+ANALYSIS_TWEETS = registry.counter(
+    'tweetmood_analysis_tweets_total', 'Tweets analysed, and those skipped by reason', ('outcome',))
+MEMO_LOOKUPS = registry.counter(
+    'tweetmood_memo_lookups_total', 'Scoring memo lookups of analyses, by memo (text/point) and outcome (hits/misses)',
+    ('memo', 'outcome'))
+
+
+class _Span:
+    __slots__ = ('stages', 'stage', 'start')
+
+    def __init__(self, stages, stage):
+        self.stages = stages
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stages.seconds[self.stage] += time.perf_counter() - self.start
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Stages:
+    """Time spent per stage of one operation, recorded once when it ends.
+
+    Usage:
+        stages = Stages()
+        with stages('parse'):
+            ...
+        stages.record('upload', rows)
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.start = time.perf_counter()
+
+    def __call__(self, stage: str):
+        return _Span(self, stage) if TIMED else _NULL_SPAN
+
+    def add(self, seconds: Dict[str, float]):
+        """Merge stage times measured elsewhere (e.g. in a worker process)"""
+        for stage, value in seconds.items():
+            self.seconds[stage] += value
+
+    def record(self, operation: str, rows: int, **context):
+        """Observe stage times, count rows and set the operation's rows/second.
+
+        The stage times are also logged with context (e.g. table=...).
+        """
+        elapsed = time.perf_counter() - self.start
+        if STAGE_LOGS:
+            stage_logger.info(json.dumps({
+                'event': 'stages', 'operation': operation, **context, 'rows': rows,
+                'elapsed_ms': round(elapsed * 1e3, 3),
+                'stages_ms': {stage: round(seconds * 1e3, 3) for stage, seconds in self.seconds.items()},
+            }))
+        if not ENABLED:
+            return
+        for stage, seconds in self.seconds.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        ROWS_TOTAL.inc(rows, operation=operation)
+        if elapsed > 0:
+            ROWS_PER_SECOND.set(rows / elapsed, operation=operation)
+
+
+def instrument_app(app):
+    """Add request latency metrics and a /metrics route to a Flask app"""
+    from flask import Response, g, request
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if not ENABLED:
+            return Response('metrics disabled\n', status=404, mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def start_timer():
+        registry.start_flusher()
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                    route=route, status=response.status_code)
+        return response
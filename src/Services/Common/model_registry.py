@@ -0,0 +1,71 @@
+# model_registry.py
+import logging
+import os
+import threading
+import time
+
+from model_snapshot import Models, load_models
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """Process-wide holder of the current analyzer and locator.
+
+    Models are loaded once (before the server forks, when it preloads the
+    app) and shared by all requests. Source files are checked at most every
+    check_interval seconds; on change a background thread loads new models
+    and swaps them in with a single reference assignment, so in-flight
+    requests finish on the models they started with.
+    """
+
+    def __init__(self, config, check_interval: float = 5.0):
+        self.config = config
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._stamp = self._source_stamp()
+        self._checked_at = time.monotonic()
+        self._models = load_models(config)
+
+    def get(self) -> Models:
+        """Current models; may trigger a background reload"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                stamp = self._source_stamp()
+            except OSError as e:
+                logger.warning(f"⚠️ Can't stat model sources: {str(e)}")
+            else:
+                if stamp != self._stamp:
+                    self._start_reload(stamp)
+        return self._models
+
+    def _source_stamp(self):
+        return tuple(
+            (stat.st_size, stat.st_mtime_ns)
+            for stat in map(os.stat, (self.config.sentiments_path, self.config.states_path))
+        )
+
+    def _start_reload(self, stamp):
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(stamp,), daemon=True).start()
+
+    def _reload(self, stamp):
+        try:
+            logger.info("♻️ Model sources changed, reloading")
+            models = load_models(self.config)
+            self._models = models
+            logger.info(f"✅ Models reloaded (version {models.version})")
+        except Exception as e:
+            logger.error(f"🔥 Model reload failed, keeping version {self._models.version}: {str(e)}")
+        finally:
+            # Recorded even on failure so a broken file isn't reloaded on every
+            # check; the next edit changes the stamp again.
+            self._stamp = stamp
+            self._reloading = False
@@ -0,0 +1,214 @@
+# model_snapshot.py
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, NamedTuple
+
+import numpy as np
+import shapely
+
+from phrase_matcher import PhraseMatcher
+from sentiment_analyzer import SentimentAnalyzer
+from state_locator import StateLocator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TMVSNAP\0'
+FORMAT_VERSION = 1
+PREFIX = struct.Struct('<8sII')  # magic, format version, header length
+ALIGNMENT = 8
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fingerprint(path) -> Dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _sha256(path)}
+
+
+def _model_version(sources: Dict) -> str:
+    """Short id of the source contents the models were built from"""
+    digest = hashlib.sha256()
+    for name in sorted(sources):
+        digest.update(sources[name]['sha256'].encode('ascii'))
+    return digest.hexdigest()[:16]
+
+
+class Models(NamedTuple):
+    analyzer: SentimentAnalyzer
+    locator: StateLocator
+    version: str
+
+
+class ModelSnapshot:
+    """Compiled lexicon automaton and state geometries in one mmap-able file.
+
+    Layout: magic, format version, JSON header (source fingerprints and
+    section table), then 8-byte aligned sections. Geometries are stored as
+    WKB, the location grid and the automaton as raw NumPy arrays, and the
+    lexicon as a sorted key blob with a parallel score array.
+    """
+
+    def __init__(self, path, header: Dict, buffer: mmap.mmap, data_start: int):
+        self.path = Path(path)
+        self.header = header
+        self.buffer = buffer
+        self.data_start = data_start
+
+    @classmethod
+    def build(cls, snapshot_path, sentiments_path, states_path):
+        """Compile both source files and atomically replace the snapshot"""
+        sources = {'sentiments': _fingerprint(sentiments_path), 'states': _fingerprint(states_path)}
+        analyzer = SentimentAnalyzer(sentiments_path)
+        locator = StateLocator(states_path)
+
+        sections = {}
+        lexicon = sorted(analyzer.sentiment_scores.items())
+        sections['lexicon_keys'] = '\n'.join(key for key, _ in lexicon).encode('utf-8')
+        sections['lexicon_scores'] = np.array([score for _, score in lexicon], dtype=np.float64)
+
+        vocabulary, arrays = analyzer.matcher.to_arrays()
+        sections['vocabulary'] = '\n'.join(vocabulary).encode('utf-8')
+        sections.update({f'matcher_{name}': array for name, array in arrays.items()})
+
+        wkb = shapely.to_wkb(locator.geometries)
+        sections['wkb'] = b''.join(wkb)
+        sections['wkb_offsets'] = np.concatenate(([0], np.cumsum([len(g) for g in wkb]))).astype(np.int64)
+        sections['grid'] = np.ascontiguousarray(locator.grid, dtype=np.int16)
+
+        table, blobs, offset = {}, [], 0
+        for name, value in sections.items():
+            data = value if isinstance(value, bytes) else value.tobytes()
+            dtype = None if isinstance(value, bytes) else value.dtype.str
+            table[name] = {'offset': offset, 'length': len(data), 'dtype': dtype}
+            blobs.append(data + b'\0' * (_align(len(data)) - len(data)))
+            offset += _align(len(data))
+
+        header = json.dumps({
+            'sources': sources,
+            'sections': table,
+            'state_codes': [code for code, _ in locator.states],
+            'grid_step': locator.grid_step,
+        }).encode('utf-8')
+        prefix = PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)) + header
+        prefix += b'\0' * (_align(len(prefix)) - len(prefix))
+
+        snapshot_path = Path(snapshot_path)
+        fd, tmp_path = tempfile.mkstemp(dir=snapshot_path.parent, prefix=snapshot_path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(prefix)
+                for blob in blobs:
+                    f.write(blob)
+            os.replace(tmp_path, snapshot_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logger.info(f"📦 Model snapshot written: {snapshot_path} ({len(prefix) + offset} bytes)")
+
+    @classmethod
+    def open(cls, snapshot_path) -> 'ModelSnapshot':
+        with open(snapshot_path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < PREFIX.size:
+            raise ValueError("truncated snapshot")
+        magic, version, header_length = PREFIX.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot format {version}")
+        header = json.loads(buffer[PREFIX.size:PREFIX.size + header_length])
+        return cls(snapshot_path, header, buffer, _align(PREFIX.size + header_length))
+
+    @classmethod
+    def load(cls, snapshot_path, sentiments_path, states_path) -> 'ModelSnapshot':
+        """Open the snapshot, rebuilding it first if missing or stale"""
+        try:
+            snapshot = cls.open(snapshot_path)
+            if snapshot.is_current(sentiments_path, states_path):
+                return snapshot
+            logger.info("♻️ Model sources changed, rebuilding snapshot")
+        except FileNotFoundError:
+            logger.info("📦 No model snapshot yet, building one")
+        except (ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Unreadable model snapshot ({str(e)}), rebuilding")
+        cls.build(snapshot_path, sentiments_path, states_path)
+        return cls.open(snapshot_path)
+
+    def is_current(self, sentiments_path, states_path) -> bool:
+        """Compare source files with the fingerprints taken at build time.
+
+        A changed mtime alone does not invalidate the snapshot if the content
+        hash is still the same.
+        """
+        for name, path in (('sentiments', sentiments_path), ('states', states_path)):
+            expected = self.header['sources'][name]
+            stat = os.stat(path)
+            if stat.st_size != expected['size']:
+                return False
+            if stat.st_mtime_ns != expected['mtime_ns'] and _sha256(path) != expected['sha256']:
+                return False
+        return True
+
+    @property
+    def version(self) -> str:
+        return _model_version(self.header['sources'])
+
+    def _bytes(self, name: str) -> bytes:
+        section = self.header['sections'][name]
+        start = self.data_start + section['offset']
+        return self.buffer[start:start + section['length']]
+
+    def _array(self, name: str) -> np.ndarray:
+        section = self.header['sections'][name]
+        dtype = np.dtype(section['dtype'])
+        return np.frombuffer(self.buffer, dtype=dtype, count=section['length'] // dtype.itemsize,
+                             offset=self.data_start + section['offset'])
+
+    def analyzer(self) -> SentimentAnalyzer:
+        keys = self._bytes('lexicon_keys').decode('utf-8').split('\n')
+        scores = dict(zip(keys, self._array('lexicon_scores').tolist()))
+        arrays = {name[len('matcher_'):]: self._array(name)
+                  for name in self.header['sections'] if name.startswith('matcher_')}
+        vocabulary = self._bytes('vocabulary').decode('utf-8').split('\n')
+        return SentimentAnalyzer.from_compiled(scores, PhraseMatcher.from_arrays(vocabulary, arrays))
+
+    def locator(self) -> StateLocator:
+        blob = self._bytes('wkb')
+        offsets = self._array('wkb_offsets').tolist()
+        geometries = shapely.from_wkb([blob[start:end] for start, end in zip(offsets, offsets[1:])])
+        states = list(zip(self.header['state_codes'], geometries))
+        return StateLocator.from_compiled(states, self._array('grid'), self.header['grid_step'])
+
+
+def load_models(config) -> Models:
+    """Load analyzer and locator through the snapshot, or from sources if it can't be used"""
+    try:
+        snapshot = ModelSnapshot.load(config.snapshot_path, config.sentiments_path, config.states_path)
+        return Models(snapshot.analyzer(), snapshot.locator(), snapshot.version)
+    except OSError as e:
+        logger.warning(f"⚠️ Model snapshot unavailable ({str(e)}), loading source files")
+        sources = {'sentiments': _fingerprint(config.sentiments_path), 'states': _fingerprint(config.states_path)}
+        return Models(SentimentAnalyzer(config.sentiments_path), StateLocator(config.states_path),
+                      _model_version(sources))
+
+
+if __name__ == '__main__':
+    from config import Config
+
+    config = Config()
+    ModelSnapshot.build(config.snapshot_path, config.sentiments_path, config.states_path)
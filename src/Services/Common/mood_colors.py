@@ -0,0 +1,58 @@
+# mood_colors.py
+"""
+Colors of the mood map.
+
+A state's average sentiment is scaled between the lowest and highest
+state average and mapped blue (0) -> cyan -> yellow (0.5) -> red (1), so
+colors are relative: a change in one state can recolor the others. Used
+for analysis results and for the live map of streamed tweets alike.
+"""
+
+from typing import Dict
+
+# Bands of the color scale a state counts as uncertain between (sampling.py)
+COLOR_BANDS = 8
+
+
+def mood_color(score: float, min_score: float, range_score: float) -> str:
+    """Convert sentiment score to color: blue(0) -> yellow(0.5) -> red(1)"""
+    if range_score == 0:
+        return '#ffff00'
+
+    normalized = (score - min_score) / range_score
+
+    # Первый сегмент: синий (0,0,255) -> голубой (0,255,255)
+    if normalized <= 0.25:
+        ratio = 4 * normalized
+        return f'#00{int(255*ratio):02x}ff'
+
+    # Второй сегмент: голубой (0,255,255) -> жёлтый (255,255,0)
+    elif normalized <= 0.75:
+        ratio = 2 * (normalized - 0.25)
+        return f'#{int(255*ratio):02x}ff00'
+
+    # Третий сегмент: жёлтый (255,255,0) -> красный (255,0,0)
+    else:
+        ratio = 2 * (normalized - 0.75)
+        return f'#ff{int(255*(1-ratio)):02x}00'
+
+
+def color_band(score: float, min_score: float, range_score: float, bands: int = COLOR_BANDS) -> int:
+    """Which of bands equal parts of the color scale a score falls in"""
+    normalized = min(max((score - min_score) / range_score, 0.0), 1.0)
+    return min(int(normalized * bands), bands - 1)
+
+
+def color_scale(averages: Dict[str, float]):
+    """min_score and range_score of mood_color for a set of state averages"""
+    min_score = min(averages.values())
+    max_score = max(averages.values())
+    return min_score, max_score - min_score if max_score != min_score else 1
+
+
+def state_colors(averages: Dict[str, float]) -> Dict[str, str]:
+    """Color of every state, from its average sentiment"""
+    if not averages:
+        return {}
+    min_score, range_score = color_scale(averages)
+    return {state: mood_color(score, min_score, range_score) for state, score in averages.items()}
@@ -0,0 +1,112 @@
+# partitions.py
+"""
+Catalog of date-partitioned tweet tables.
+
+A partitioned table (a topic) holds no rows itself: its tweets are stored
+in one internal table per day or month of created_at, `_p_<topic>_<period>`
+(e.g. `_p_family_20140216`), each an ordinary tweet table with its own
+content key, point index, running totals and snapshot generation. The
+catalog maps topics to their granularity and partitions to the
+[start, end) range of created_at they hold. It is written in the same
+transaction as the partitions' rows, so a failed upload leaves no
+partitions behind.
+
+Partitions are what makes old data cheap to change: a partition is
+replaced or dropped as a whole (DROP TABLE) instead of deleting its rows
+from one large table, and analyses scan only the partitions overlapping a
+requested window, in parallel.
+
+Tables that aren't in the catalog are plain tables, as before partitions.
+"""
+
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+PARTITIONED_TABLES = '_partitioned_tables'
+PARTITIONS_TABLE = '_partitions'
+
+# Period keys of each granularity, as formatted by strftime
+PARTITION_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m'}
+
+metadata = MetaData()
+
+partitioned_tables = Table(
+    PARTITIONED_TABLES, metadata,
+    Column('topic', String, primary_key=True),
+    Column('granularity', String, nullable=False),
+)
+
+partitions = Table(
+    PARTITIONS_TABLE, metadata,
+    Column('topic', String, primary_key=True),
+    Column('period', String, primary_key=True),
+    Column('table_name', String, nullable=False, unique=True),
+    Column('start', DateTime, nullable=False),
+    Column('end', DateTime, nullable=False),
+)
+
+
+def create_partition_catalog(storage):
+    storage.create_all(metadata)
+
+
+def period_of(granularity: str, created_at: datetime) -> str:
+    return created_at.strftime(PARTITION_FORMATS[granularity])
+
+
+def period_range(granularity: str, period: str) -> Tuple[datetime, datetime]:
+    """[start, end) of created_at in a period"""
+    start = datetime.strptime(period, PARTITION_FORMATS[granularity])
+    if granularity == 'day':
+        return start, datetime.fromordinal(start.toordinal() + 1)
+    return start, start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+def partition_name(topic: str, period: str) -> str:
+    return f"_p_{topic}_{period.replace('-', '')}"
+
+
+def read_granularity(conn, topic: str) -> Optional[str]:
+    """'day' or 'month' for a partitioned table, None for any other name"""
+    return conn.execute(select(partitioned_tables.c.granularity)
+                        .where(partitioned_tables.c.topic == topic)).scalar()
+
+
+def read_topics(conn) -> List[str]:
+    return list(conn.execute(select(partitioned_tables.c.topic)).scalars())
+
+
+def read_partitions(conn, topic: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> List[Tuple]:
+    """(period, table name, start, end) of a topic's partitions overlapping [start, end), in time order"""
+    query = (select(partitions.c.period, partitions.c.table_name, partitions.c.start, partitions.c.end)
+             .where(partitions.c.topic == topic)
+             .order_by(partitions.c.start))
+    if start:
+        query = query.where(partitions.c.end > start)
+    if end:
+        query = query.where(partitions.c.start < end)
+    return conn.execute(query).fetchall()
+
+
+def add_topic(conn, topic: str, granularity: str):
+    conn.execute(insert(partitioned_tables).values(topic=topic, granularity=granularity)
+                 .on_conflict_do_update(index_elements=['topic'], set_={'granularity': granularity}))
+
+
+def add_partition(conn, topic: str, granularity: str, period: str):
+    """Register a partition; its table, partition_name(topic, period), is created by the caller"""
+    start, end = period_range(granularity, period)
+    conn.execute(insert(partitions).values(topic=topic, period=period, table_name=partition_name(topic, period),
+                                           start=start, end=end).on_conflict_do_nothing())
+
+
+def remove_partitions(conn, topic: str, periods: Optional[List[str]] = None):
+    """Unregister a topic's partitions, or only those of the given periods"""
+    condition = partitions.c.topic == topic
+    if periods is not None:
+        condition &= partitions.c.period.in_(periods)
+    conn.execute(delete(partitions).where(condition))
@@ -0,0 +1,171 @@
+# phrase_matcher.py
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase words"""
+    return WORD_PATTERN.findall(text.lower())
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over word ids.
+
+    Every lexicon entry is tokenized with the same rule as tweet texts, so
+    "does not work" and "all-important" both become word sequences. A text
+    is scanned once, left to right; overlapping matches are resolved with a
+    leftmost-longest policy.
+    """
+
+    def __init__(self, lexicon: Optional[Dict[str, float]] = None):
+        self.word_ids: Dict[str, int] = {}
+        # Node 0 is the root. For each node: transitions, failure link,
+        # (length, score) when a phrase ends here, nearest terminal suffix.
+        self.goto: List[Dict[int, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.terminal: List[Optional[Tuple[int, float]]] = [None]
+        self.output_link: List[int] = [0]
+        self.max_phrase_length = 0
+        self.patterns = 0
+        if lexicon:
+            self._build(lexicon)
+
+    def _build(self, lexicon: Dict[str, float]):
+        exact = set()
+        for phrase, score in lexicon.items():
+            words = tokenize(phrase)
+            if not words:
+                continue
+            node = self._insert(words)
+            is_exact = ' '.join(words) == phrase
+            # Entries like "'hood" and "ad-lib" tokenize the same way as
+            # "hood" and "ad lib": the plain spelling wins, otherwise the first.
+            if self.terminal[node] is None or (is_exact and node not in exact):
+                if self.terminal[node] is None:
+                    self.patterns += 1
+                self.terminal[node] = (len(words), score)
+                if is_exact:
+                    exact.add(node)
+            self.max_phrase_length = max(self.max_phrase_length, len(words))
+        self._link()
+
+    def _insert(self, words: List[str]) -> int:
+        node = 0
+        for word in words:
+            word_id = self.word_ids.setdefault(word, len(self.word_ids))
+            child = self.goto[node].get(word_id)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][word_id] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.terminal.append(None)
+                self.output_link.append(0)
+            node = child
+        return node
+
+    def _link(self):
+        """Compute failure and output links breadth-first"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word_id, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and word_id not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(word_id, 0)
+                self.fail[child] = target if target != child else 0
+                suffix = self.fail[child]
+                self.output_link[child] = suffix if self.terminal[suffix] else self.output_link[suffix]
+                queue.append(child)
+
+    def to_arrays(self) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """Flatten the automaton into a vocabulary and flat node/edge arrays"""
+        vocabulary = sorted(self.word_ids, key=self.word_ids.get)
+        edge_counts = [len(edges) for edges in self.goto]
+        arrays = {
+            'edge_offsets': np.concatenate(([0], np.cumsum(edge_counts))).astype(np.int32),
+            'edge_words': np.fromiter((w for edges in self.goto for w in edges), np.int32),
+            'edge_targets': np.fromiter((c for edges in self.goto for c in edges.values()), np.int32),
+            'fail': np.array(self.fail, dtype=np.int32),
+            'output_link': np.array(self.output_link, dtype=np.int32),
+            'terminal_length': np.array([t[0] if t else 0 for t in self.terminal], dtype=np.int16),
+            'terminal_score': np.array([t[1] if t else 0.0 for t in self.terminal], dtype=np.float64),
+        }
+        return vocabulary, arrays
+
+    @classmethod
+    def from_arrays(cls, vocabulary: List[str], arrays: Dict[str, np.ndarray]) -> 'PhraseMatcher':
+        """Rebuild a matcher saved with to_arrays() without recompiling it"""
+        matcher = cls()
+        matcher.word_ids = {word: i for i, word in enumerate(vocabulary)}
+
+        offsets = arrays['edge_offsets'].tolist()
+        words = arrays['edge_words'].tolist()
+        targets = arrays['edge_targets'].tolist()
+        # Most nodes are leaves or single-child chain links; literals are much
+        # cheaper than dict(zip(...)) for those
+        matcher.goto = [
+            {words[start]: targets[start]} if end - start == 1
+            else dict(zip(words[start:end], targets[start:end])) if end > start
+            else {}
+            for start, end in zip(offsets, offsets[1:])
+        ]
+        matcher.fail = arrays['fail'].tolist()
+        matcher.output_link = arrays['output_link'].tolist()
+
+        lengths = arrays['terminal_length'].tolist()
+        scores = arrays['terminal_score'].tolist()
+        matcher.terminal = [(length, score) if length else None for length, score in zip(lengths, scores)]
+        matcher.patterns = sum(1 for length in lengths if length)
+        matcher.max_phrase_length = max(lengths, default=0)
+        return matcher
+
+    def find(self, words: Iterable[str]) -> List[Tuple[int, int, float]]:
+        """Return non-overlapping (start, length, score) matches"""
+        word_ids = self.word_ids
+        goto = self.goto
+        fail = self.fail
+        terminal = self.terminal
+        output_link = self.output_link
+
+        matches = []
+        state = 0
+        for position, word in enumerate(words):
+            word_id = word_ids.get(word)
+            if word_id is None:
+                # Word is in no phrase: nothing can continue through it
+                state = 0
+                continue
+            while state and word_id not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word_id, 0)
+
+            node = state if terminal[state] else output_link[state]
+            while node:
+                length, score = terminal[node]
+                matches.append((position - length + 1, length, score))
+                node = output_link[node]
+
+        if len(matches) < 2:
+            return matches
+        return self._select_longest(matches)
+
+    @staticmethod
+    def _select_longest(matches: List[Tuple[int, int, float]]) -> List[Tuple[int, int, float]]:
+        matches.sort(key=lambda m: (m[0], -m[1]))
+        selected = []
+        covered_until = 0
+        for match in matches:
+            if match[0] >= covered_until:
+                selected.append(match)
+                covered_until = match[0] + match[1]
+        return selected
+
+    def scores(self, text: str) -> List[float]:
+        """Sentiment scores of all phrases matched in text"""
+        return [score for _, _, score in self.find(tokenize(text))]
@@ -0,0 +1,97 @@
+# point_index.py
+"""
+R*Tree index of tweet coordinates, for viewport queries of single tweets.
+
+Each tweet table has an SQLite R*Tree virtual table `_points_<table>`
+holding the id and (degenerate) latitude/longitude box of every row. The
+collection service creates it with the table and writes it in the same
+transaction as the rows it indexes; tables from before it are indexed in
+full when first created or queried. Its name, like the names of the shadow
+tables SQLite keeps for it, starts with '_', so it is an internal table.
+
+R*Tree coordinates are 32-bit floats rounded outwards, so queries also
+compare the table's own coordinates for an exact box.
+"""
+
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, Table, and_, or_
+from sqlalchemy.exc import OperationalError
+
+# Sampling keeps rows whose id hashes below sample * 2**32
+SAMPLE_HASH = 2654435761
+SAMPLE_RANGE = 2 ** 32
+
+
+def point_index_name(table_name: str) -> str:
+    return f'_points_{table_name}'
+
+
+def point_index(table_name: str) -> Table:
+    """The index as a Core table, for queries (it is created by create_point_index)"""
+    return Table(point_index_name(table_name), MetaData(), Column('id', Integer, primary_key=True),
+                 Column('min_lat', Float), Column('max_lat', Float), Column('min_lon', Float), Column('max_lon', Float))
+
+
+def has_point_index(conn, table_name: str) -> bool:
+    return conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = ?",
+                                (point_index_name(table_name),)).first() is not None
+
+
+def create_point_index(conn, table_name: str) -> bool:
+    """Create a table's index, indexing the rows it already has.
+
+    Safe to call concurrently from several processes if conn is in a write
+    transaction (BEGIN IMMEDIATE, or one that has written): the driver
+    runs DDL outside of a transaction that hasn't written yet, and rows
+    another process commits between creating and filling the index would
+    be indexed twice. Returns True if the index was created.
+    """
+    if has_point_index(conn, table_name):
+        return False
+    name = point_index_name(table_name)
+    try:
+        conn.exec_driver_sql(f'CREATE VIRTUAL TABLE "{name}" USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+    except OperationalError as e:
+        if 'already exists' not in str(e):
+            raise
+        return False
+    conn.exec_driver_sql(
+        f'INSERT INTO "{name}" SELECT id, latitude, latitude, longitude, longitude FROM "{table_name}" '
+        f'WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+    )
+    return True
+
+
+def index_points(conn, table_name: str, rows: Iterable[Tuple[int, float, float]]):
+    """Add (id, latitude, longitude) of written rows"""
+    entries = [(row_id, lat, lat, lon, lon) for row_id, lat, lon in rows]
+    # An append batch of tweets all stored already writes no rows
+    if entries:
+        conn.exec_driver_sql(f'INSERT INTO "{point_index_name(table_name)}" VALUES (?, ?, ?, ?, ?)', entries)
+
+
+def clear_point_index(conn, table_name: str):
+    conn.exec_driver_sql(f'DELETE FROM "{point_index_name(table_name)}"')
+
+
+def in_box(query, table, index, bbox: Tuple[float, float, float, float], sample: Optional[float] = None):
+    """Restrict a query joining a table with its index to rows in bbox.
+
+    bbox is (west, south, east, north) in degrees; west > east spans the
+    antimeridian. With sample in (0, 1), only that fraction of rows is
+    kept, chosen by a hash of the id so a row is kept whatever the box.
+    """
+    west, south, east, north = bbox
+    spans = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+    query = query.where(
+        index.c.min_lat <= north, index.c.max_lat >= south,
+        table.c.latitude >= south, table.c.latitude <= north,
+        or_(*(and_(index.c.min_lon <= span_east, index.c.max_lon >= span_west,
+                   table.c.longitude >= span_west, table.c.longitude <= span_east)
+              for span_west, span_east in spans))
+    )
+    if sample is not None and sample < 1:
+        query = query.where(index.c.id * SAMPLE_HASH % SAMPLE_RANGE < int(sample * SAMPLE_RANGE))
+    return query
+
@@ -0,0 +1,40 @@
+# process_pools.py
+"""
+Start methods of the services' worker process pools.
+
+Both services run threads next to their requests (analysis jobs, score
+backfills, streamed uploads), so a pool forked from a service process
+would copy whatever locks those threads held at the fork, e.g. a scoring
+memo's or the logging module's, and its workers could wait on them
+forever. Pools are started with a fork server instead: a single-threaded
+process started once, which forks the workers. Workers get the parent's
+sys.path, and models through their pool initializer (pickled).
+"""
+
+import multiprocessing
+import multiprocessing.util
+from typing import Sequence
+
+
+def worker_context(preload: Sequence[str] = ()):
+    """Multiprocessing context of worker pools: forkserver, or spawn where there is none.
+
+    preload names modules the fork server imports once, so workers don't
+    each import them. It only has an effect before the fork server starts,
+    i.e. for the first pool of a process.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(list(preload))
+    return context
+
+
+def shutdown_at_exit(pool):
+    """Stop a long-lived pool's workers also when its process exits without atexit handlers.
+
+    That is how multiprocessing children exit. The shutdown must run before
+    the pool's queues are closed (exit priority 10), or the workers never
+    get told to stop.
+    """
+    multiprocessing.util.Finalize(pool, pool.shutdown, kwargs={'cancel_futures': True}, exitpriority=20)
@@ -0,0 +1,88 @@
+# profiling.py
+"""
+Opt-in cProfile dumps of single uploads and analyses.
+
+An admin turns profiling on for a service with PROFILING=1. A client then
+asks for a profile of one request with an `X-Profile: 1` header or a
+`?profile=1` query flag; if PROFILE_TOKEN is set, the flag must be that
+token instead of 1. The request's job runs under cProfile and its stats
+are dumped to PROFILE_DIR/<id>.prof, with the id returned in the
+X-Profile-Id response header:
+
+    python -m pstats $PROFILE_DIR/<id>.prof
+    snakeviz $PROFILE_DIR/<id>.prof
+
+Only the job's own thread is profiled: table shards scanned by the
+analysis service's worker processes show up as waits on the pool.
+"""
+
+import cProfile
+import hmac
+import logging
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('PROFILING', '0').lower() in ('1', 'true', 'yes', 'on')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN') or None
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', Path(tempfile.gettempdir()) / 'tweetmood-profiles'))
+REQUEST_HEADER = 'X-Profile'
+QUERY_FLAG = 'profile'
+ID_HEADER = 'X-Profile-Id'
+
+
+def profile_path(profile_id: str) -> Path:
+    return PROFILE_DIR / f'{profile_id}.prof'
+
+
+def requested_profile() -> Optional[str]:
+    """Id of a profile of the current request, if it asks for one and may.
+
+    The id is also sent back in the X-Profile-Id header (see profile_app).
+    """
+    from flask import g, request
+
+    flag = request.headers.get(REQUEST_HEADER) or request.args.get(QUERY_FLAG)
+    if not ENABLED or not flag:
+        return None
+    if PROFILE_TOKEN:
+        if not hmac.compare_digest(flag, PROFILE_TOKEN):
+            return None
+    elif flag.lower() not in ('1', 'true', 'yes'):
+        return None
+    g.profile_id = uuid.uuid4().hex
+    return g.profile_id
+
+
+@contextmanager
+def profiled(profile_id: Optional[str]):
+    """Profile the block in this thread and dump its stats under profile_id; no-op for None"""
+    if not profile_id:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(profile_path(profile_id))
+        logger.info(f"Profile {profile_id} written to {profile_path(profile_id)}")
+
+
+def profile_app(app):
+    """Send the id of a requested profile back in the X-Profile-Id header"""
+    from flask import g
+
+    @app.after_request
+    def add_profile_id(response):
+        profile_id = g.get('profile_id')
+        if profile_id:
+            response.headers[ID_HEADER] = profile_id
+        return response
@@ -0,0 +1,132 @@
+# result_cache.py
+"""
+Versioned on-disk cache for analysis results.
+
+Both services open the same cache file on the shared DataBase volume. The
+collection service bumps a table's version whenever it rewrites the table;
+the analysis service stores results under (table name, version), so a bump
+makes older entries unreachable. Entries are evicted least recently used
+first once the cache grows past its size bound; a hit refreshes an entry's
+last use at most every TOUCH_INTERVAL, so serving one only needs a reader.
+"""
+
+import json
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import (Column, Float, Integer, MetaData, String, Table, Text,
+                        delete, func, insert, select, update)
+
+from storage import Storage
+
+# Seconds a hit leaves an entry's last use alone: eviction order needs no finer recency
+TOUCH_INTERVAL = 60.0
+
+metadata = MetaData()
+
+table_versions = Table(
+    'table_versions', metadata,
+    Column('table_name', String, primary_key=True),
+    Column('version', Integer, nullable=False),
+)
+
+results = Table(
+    'results', metadata,
+    Column('table_name', String, primary_key=True),
+    Column('version', Integer, primary_key=True),
+    Column('model_version', String, nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('last_used', Float, nullable=False, index=True),
+)
+
+
+class ResultCache:
+    """LRU-bounded result store keyed on table name and content version.
+
+    Results also record the version of the models that produced them, so a
+    lexicon or geometry reload doesn't serve results computed with old data.
+
+    Attributes:
+        max_entries (int): Number of cached results kept on disk
+    """
+
+    def __init__(self, cache_path, max_entries: int = 64):
+        """Open the cache database; its tables are created by init_db().
+
+        Args:
+            cache_path: Path of the SQLite cache file
+            max_entries (int): LRU size bound
+        """
+        self.max_entries = max_entries
+        self.storage = Storage(cache_path)
+        self.engine = self.storage.writer
+
+    def init_db(self):
+        """Create the cache tables if missing; once at service startup."""
+        self.storage.create_all(metadata)
+
+    def get_version(self, table_name: str) -> int:
+        """Return current content version of a table (0 if never written)."""
+        with self.storage.reader.connect() as conn:
+            version = conn.execute(
+                select(table_versions.c.version).where(table_versions.c.table_name == table_name)
+            ).scalar()
+        return version or 0
+
+    def bump_version(self, table_name: str) -> int:
+        """Mark a table as changed and drop its cached results.
+
+        Must be called after the new table content is committed.
+
+        Returns:
+            int: The new version
+        """
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                update(table_versions)
+                .where(table_versions.c.table_name == table_name)
+                .values(version=table_versions.c.version + 1)
+            ).rowcount
+            if not updated:
+                conn.execute(insert(table_versions).values(table_name=table_name, version=1))
+            conn.execute(delete(results).where(results.c.table_name == table_name))
+            return conn.execute(
+                select(table_versions.c.version).where(table_versions.c.table_name == table_name)
+            ).scalar()
+
+    def get(self, table_name: str, version: int, model_version: str = '') -> Optional[Dict]:
+        """Return the cached result for this table and model version, if any.
+
+        Only a hit on an entry last used TOUCH_INTERVAL ago or more writes,
+        to refresh its last use.
+        """
+        key = ((results.c.table_name == table_name) & (results.c.version == version)
+               & (results.c.model_version == model_version))
+        with self.storage.reader.connect() as conn:
+            row = conn.execute(select(results.c.payload, results.c.last_used).where(key)).first()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row.last_used >= TOUCH_INTERVAL:
+            with self.engine.begin() as conn:
+                conn.execute(update(results).where(key).values(last_used=now))
+        return json.loads(row.payload)
+
+    def put(self, table_name: str, version: int, result: Dict, model_version: str = ''):
+        """Store a result and evict least recently used entries over the bound."""
+        with self.engine.begin() as conn:
+            same_table = results.c.table_name == table_name
+            if conn.execute(select(results.c.version).where(same_table & (results.c.version > version))).first():
+                return
+            conn.execute(delete(results).where(same_table))
+            conn.execute(insert(results).values(
+                table_name=table_name,
+                version=version,
+                model_version=model_version,
+                payload=json.dumps(result),
+                last_used=time.time()
+            ))
+            excess = conn.execute(select(func.count()).select_from(results)).scalar() - self.max_entries
+            if excess > 0:
+                oldest = select(results.c.table_name).order_by(results.c.last_used).limit(excess)
+                conn.execute(delete(results).where(results.c.table_name.in_(oldest)))
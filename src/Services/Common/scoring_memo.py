@@ -0,0 +1,111 @@
+# scoring_memo.py
+"""
+Bounded memos of scoring results, so repeated inputs are scored once.
+
+Topic dumps repeat themselves: retweets and pasted texts, check-ins from
+the same spots. The analyzer keeps a memo of text -> score and the locator
+one of quantized coordinates -> state, each least-recently-used with a
+fixed number of entries. Texts are looked up by their (cached) string hash
+and compared in full, so a memo never returns another text's score. A
+memo belongs to the analyzer or locator that filled it, so loading new
+models (a changed lexicon or geometry) starts with empty memos.
+
+Worker processes start with empty memos and a lock of their own: pickled
+copies (spawned workers) are built empty, and a forked child resets every
+memo it inherits, as another thread of the parent may have held a memo's
+lock, mid-update, at the fork.
+
+TEXT_MEMO_SIZE and POINT_MEMO_SIZE set the entries kept per process; 0
+switches a memo off, SCORING_MEMOS=0 both.
+"""
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+ENABLED = os.environ.get('SCORING_MEMOS', '1') != '0'
+TEXT_MEMO_SIZE = int(os.environ.get('TEXT_MEMO_SIZE', 100_000)) if ENABLED else 0
+POINT_MEMO_SIZE = int(os.environ.get('POINT_MEMO_SIZE', 50_000)) if ENABLED else 0
+# Decimal places coordinates are rounded to: source files have at most 8
+COORDINATE_DECIMALS = 8
+
+_MISSING = object()
+
+# Every memo of the process, reset in forked children
+_memos = weakref.WeakSet()
+
+
+class ScoringMemo:
+    """Least-recently-used map of input keys to results of one model.
+
+    Args:
+        name (str): 'text' or 'point', prefix of the lookup counters
+        max_entries (int): Entries kept; 0 disables the memo
+    """
+
+    def __init__(self, name: str, max_entries: int):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _memos.add(self)
+
+    def __getstate__(self):
+        return {'name': self.name, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['max_entries'])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys: Sequence[Hashable], compute: Callable[[List[int]], Sequence],
+                 lookups: Optional[Dict[str, int]] = None) -> List:
+        """Results for keys, computing only the first occurrence of each unknown key.
+
+        compute gets positions into keys and returns their results in order.
+        Hits and misses are added to lookups as '<name>_memo_hits' and
+        '<name>_memo_misses'; repeats of a missing key count as hits.
+        """
+        with self._lock:
+            entries = self._entries
+            get, move_to_end = entries.get, entries.move_to_end
+            values = [get(key, _MISSING) for key in keys]
+            # First position of each missing key
+            missing = {}
+            for position, value in enumerate(values):
+                if value is _MISSING:
+                    missing.setdefault(keys[position], position)
+                else:
+                    move_to_end(keys[position])
+
+        if missing:
+            computed = dict(zip(missing, compute(list(missing.values()))))
+            values = [computed[key] if value is _MISSING else value for key, value in zip(keys, values)]
+            with self._lock:
+                entries.update(computed)
+                while len(entries) > self.max_entries:
+                    entries.popitem(last=False)
+
+        if lookups is not None:
+            for outcome, count in (('hits', len(keys) - len(missing)), ('misses', len(missing))):
+                counter = f'{self.name}_memo_{outcome}'
+                lookups[counter] = lookups.get(counter, 0) + count
+        return values
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _reset_after_fork():
+    """Fresh locks and empty entries in a forked child, whatever the parent's threads were doing"""
+    for memo in list(_memos):
+        memo._lock = threading.Lock()
+        memo._entries = OrderedDict()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
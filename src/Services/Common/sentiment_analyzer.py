@@ -0,0 +1,78 @@
+# sentiment_analyzer.py
+import csv
+import logging
+from phrase_matcher import PhraseMatcher, tokenize
+from scoring_memo import TEXT_MEMO_SIZE, ScoringMemo
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SentimentAnalyzer:
+    def __init__(self, file_path):
+        self._setup(self._load_sentiments(file_path))
+
+    @classmethod
+    def from_compiled(cls, sentiment_scores, matcher):
+        """Create analyzer from an already loaded lexicon and automaton"""
+        analyzer = cls.__new__(cls)
+        analyzer._setup(sentiment_scores, matcher)
+        return analyzer
+
+    def _setup(self, sentiment_scores, matcher=None):
+        self.sentiment_scores = sentiment_scores
+        self.matcher = matcher or PhraseMatcher(sentiment_scores)
+        # Scores of texts seen before, valid for this lexicon only
+        self.memo = ScoringMemo('text', TEXT_MEMO_SIZE)
+        logger.info(f"📚 Loaded {len(self.sentiment_scores)} sentiment words")
+        logger.info(f"🔤 Compiled {self.matcher.patterns} patterns "
+                    f"(longest phrase: {self.matcher.max_phrase_length} words)")
+
+    def _load_sentiments(self, file_path):
+        try:
+            with open(file_path, 'r', encoding='utf-8-sig') as f:
+                return {
+                    row[0].strip(): float(row[1])
+                    for row in csv.reader(f)
+                    if len(row) >= 2
+                }
+        except Exception as e:
+            logger.error(f"🔥 Error loading sentiments: {str(e)}")
+            return {}
+
+    def analyze(self, text):
+        """Average score of the words and phrases found in text"""
+        try:
+            scores = self.matcher.scores(text)
+            return sum(scores) / len(scores) if scores else None
+        except Exception as e:
+            logger.warning(f"⚠️ Error analyzing text: {str(e)}")
+            return None
+
+    def analyze_many(self, texts, lookups=None):
+        """Score a batch of texts, keeping their order.
+
+        Repeated texts are scored once through the memo; its hits and
+        misses are counted in lookups if given.
+        """
+        if not self.memo.max_entries:
+            return self._analyze_many(texts)
+        return self.memo.get_many(texts, lambda positions: self._analyze_many([texts[i] for i in positions]),
+                                  lookups)
+
+    def _analyze_many(self, texts):
+        find = self.matcher.find
+        results = []
+        for text in texts:
+            try:
+                matches = find(tokenize(text))
+            except Exception as e:
+                logger.warning(f"⚠️ Error analyzing text: {str(e)}")
+                results.append(None)
+                continue
+            results.append(sum(m[2] for m in matches) / len(matches) if matches else None)
+        return results
+
+    def stats(self):
+        sample = list(self.sentiment_scores.items())[:5]
+        logger.info("📊 Sentiment analyzer stats:")
+        logger.info(f"Sample words: {', '.join(f'{k} ({v})' for k, v in sample)}")
\ No newline at end of file
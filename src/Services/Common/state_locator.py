@@ -0,0 +1,263 @@
+# state_locator.py
+import json
+import logging
+import math
+from typing import List, Sequence, Tuple, Union, Optional
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, MultiPolygon, Point
+from shapely.strtree import STRtree
+from scoring_memo import COORDINATE_DECIMALS, POINT_MEMO_SIZE, ScoringMemo
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Grid cell markers; non-negative values are indices into StateLocator.states
+UNKNOWN = -1
+BOUNDARY = -2
+
+
+class StateLocator:
+    def __init__(self, geojson_path: str, grid_step: float = 0.25):
+        self._setup(self._load_states(geojson_path), grid_step)
+
+    @classmethod
+    def from_compiled(cls, states: List[Tuple[str, Union[Polygon, MultiPolygon]]],
+                      grid: np.ndarray, grid_step: float) -> 'StateLocator':
+        """Create locator from loaded geometries and a precomputed grid"""
+        locator = cls.__new__(cls)
+        locator._setup(states, grid_step, grid)
+        return locator
+
+    def _setup(self, states, grid_step: float, grid: Optional[np.ndarray] = None):
+        self.states = states
+        self.codes = np.array([code for code, _ in self.states] + ['Unknown'], dtype=object)
+        self.geometries = np.array([geometry for _, geometry in self.states], dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+        self._build_grid(grid_step, grid)
+        # States of points in boundary cells seen before, valid for these geometries only
+        self.memo = ScoringMemo('point', POINT_MEMO_SIZE)
+        logger.info(f"🗺️ Loaded {len(self.states)} states")
+
+    def _load_states(self, file_path: str) -> List[Tuple[str, Union[Polygon, MultiPolygon]]]:
+        """Load state geometries from GeoJSON file"""
+        try:
+            with open(file_path) as f:
+                data = json.load(f)
+
+            states = []
+            for state_code, geometries in data.items():
+                if not isinstance(geometries, list):
+                    logger.warning(f"⚠️ Invalid geometry format for {state_code}")
+                    continue
+
+                polygons = self._process_state_geometry(geometries)
+                if not polygons:
+                    logger.warning(f"⚠️ No valid geometry for {state_code}")
+                    continue
+
+                state_geometry = self._create_geometry(polygons)
+                states.append((state_code.upper(), state_geometry))
+                logger.debug(f"Added state {state_code} with {len(polygons)} polygon(s)")
+
+            return states
+
+        except Exception as e:
+            logger.error(f"🔥 Error loading states: {str(e)}")
+            raise
+
+    def _process_state_geometry(self, geometries: list) -> List[Polygon]:
+        """Process state geometry into list of Polygon objects"""
+        polygons = []
+        
+        def handle_coordinate_element(element: list) -> list:
+            """Handle coordinate pair or vertex list"""
+            if len(element) >= 2 and isinstance(element[0], (int, float)):
+                return [tuple(element[:2])]
+            return []
+
+        def create_polygon_from_coords(coords: list) -> Optional[Polygon]:
+            """Create Polygon if valid coordinate sequence"""
+            if len(coords) >= 3:
+                try:
+                    return Polygon(coords)
+                except Exception as e:
+                    logger.warning(f"Invalid polygon: {str(e)}")
+            return None
+
+        def process_nested_elements(elements: list) -> list:
+            """Recursively process nested geometry elements"""
+            collected_coords = []
+            for elem in elements:
+                result = process_element(elem)
+                if isinstance(result, list) and result and isinstance(result[0], tuple):
+                    collected_coords.extend(result)
+                elif isinstance(result, list) and result and isinstance(result[0], Polygon):
+                    polygons.extend(result)
+            return collected_coords
+
+        def process_element(element) -> list:
+            """Main element processing dispatcher"""
+            if not isinstance(element, list):
+                return []
+                
+            if coord_pair := handle_coordinate_element(element):
+                return coord_pair
+                
+            coords = process_nested_elements(element)
+            if polygon := create_polygon_from_coords(coords):
+                return [polygon]
+                
+            return []
+
+        # Main processing loop
+        for geometry in geometries:
+            if elements := process_element(geometry):
+                polygons.extend(elements)
+        
+        return [p for p in polygons if isinstance(p, Polygon)]
+
+    def _create_geometry(self, polygons: List[Polygon]) -> Union[Polygon, MultiPolygon]:
+        """Create final state geometry"""
+        if len(polygons) == 1:
+            return polygons[0]
+        return MultiPolygon(polygons)
+
+    def _build_grid(self, step: float, grid: Optional[np.ndarray] = None):
+        """Classify grid cells as inside one state, outside all, or boundary.
+
+        A cell resolves to a state only if that state properly contains it and
+        no earlier state touches it, so lookups agree with a first-match scan.
+        """
+        self.grid_step = step
+        self.x0, self.y0, x1, y1 = shapely.total_bounds(self.geometries)
+        self.x1, self.y1 = x1, y1
+        columns = math.floor((x1 - self.x0) / step) + 1
+        rows = math.floor((y1 - self.y0) / step) + 1
+        if grid is not None:
+            self.grid = grid.reshape(rows, columns)
+            return
+
+        # Cells are padded slightly so rounding in the cell lookup stays covered
+        pad = 1e-9
+        xs = self.x0 + np.arange(columns) * step
+        ys = self.y0 + np.arange(rows) * step
+        left, bottom = np.meshgrid(xs, ys)
+        boxes = shapely.box(left - pad, bottom - pad, left + step + pad, bottom + step + pad).ravel()
+
+        # Prefilter on the bounding boxes of individual polygons: a state's own
+        # envelope can be huge (Alaska spans the antimeridian)
+        parts, part_state = shapely.get_parts(self.geometries, return_index=True)
+        box_idx, part_idx = STRtree(parts).query(boxes)
+        pairs = np.unique(box_idx * len(self.states) + part_state[part_idx])
+        box_idx, state_idx = np.divmod(pairs, len(self.states))
+        touching = shapely.intersects(self.geometries[state_idx], boxes[box_idx])
+        box_idx, state_idx = box_idx[touching], state_idx[touching]
+
+        first_touching = np.full(len(boxes), len(self.states))
+        np.minimum.at(first_touching, box_idx, state_idx)
+
+        inside = shapely.contains_properly(self.geometries[state_idx], boxes[box_idx])
+        owner = np.full(len(boxes), len(self.states))
+        np.minimum.at(owner, box_idx[inside], state_idx[inside])
+
+        grid = np.full(len(boxes), BOUNDARY, dtype=np.int16)
+        grid[first_touching == len(self.states)] = UNKNOWN
+        resolved = (owner == first_touching) & (owner < len(self.states))
+        grid[resolved] = owner[resolved]
+        self.grid = grid.reshape(rows, columns)
+
+        logger.info(f"🧮 Location grid {rows}x{columns}: {int(resolved.sum())} interior, "
+                    f"{int((grid == BOUNDARY).sum())} boundary cells")
+
+    def _exact_index(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """First state containing each point, using the STRtree prefilter"""
+        points = shapely.points(lons, lats)
+        point_idx, state_idx = self.tree.query(points, predicate='within')
+        result = np.full(len(points), len(self.states))
+        np.minimum.at(result, point_idx, state_idx)
+        result[result == len(self.states)] = UNKNOWN
+        return result
+
+    def locate(self, lat: float, lon: float) -> str:
+        """Find state code for coordinates"""
+        try:
+            if not (self.x0 <= lon <= self.x1 and self.y0 <= lat <= self.y1):
+                return 'Unknown'
+            index = self.grid[int((lat - self.y0) // self.grid_step), int((lon - self.x0) // self.grid_step)]
+            if index == BOUNDARY:
+                candidates = self.tree.query(Point(lon, lat), predicate='within')
+                index = candidates.min() if len(candidates) else UNKNOWN
+            return self.codes[index]
+        except Exception as e:
+            logger.warning(f"⚠️ Location error: {str(e)}")
+            return 'Unknown'
+
+    def _memo_index(self, lats: np.ndarray, lons: np.ndarray, lookups: Optional[dict] = None) -> np.ndarray:
+        """_exact_index through the memo, keyed by coordinates rounded to COORDINATE_DECIMALS"""
+        scale = 10.0 ** COORDINATE_DECIMALS
+        keys = list(zip(np.rint(lats * scale).astype(np.int64).tolist(),
+                        np.rint(lons * scale).astype(np.int64).tolist()))
+        indices = self.memo.get_many(
+            keys, lambda positions: self._exact_index(lats[positions], lons[positions]).tolist(), lookups)
+        return np.array(indices, dtype=np.int64)
+
+    def locate_many(self, lats: Sequence[float], lons: Sequence[float], lookups: Optional[dict] = None) -> List[str]:
+        """Find state codes for arrays of coordinates.
+
+        Points in boundary cells go through the memo; its hits and misses
+        are counted in lookups if given.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        result = np.full(len(lats), UNKNOWN, dtype=np.int64)
+
+        in_bounds = (lons >= self.x0) & (lons <= self.x1) & (lats >= self.y0) & (lats <= self.y1)
+        rows = ((lats[in_bounds] - self.y0) // self.grid_step).astype(np.int64)
+        columns = ((lons[in_bounds] - self.x0) // self.grid_step).astype(np.int64)
+        result[in_bounds] = self.grid[rows, columns]
+
+        boundary = result == BOUNDARY
+        if boundary.any():
+            if self.memo.max_entries:
+                result[boundary] = self._memo_index(lats[boundary], lons[boundary], lookups)
+            else:
+                result[boundary] = self._exact_index(lats[boundary], lons[boundary])
+        return self.codes[result].tolist()
+
+    def _locate_linear(self, lat: float, lon: float) -> str:
+        """Reference lookup: test every state in order"""
+        point = Point(lon, lat)
+        for code, geometry in self.states:
+            if geometry.contains(point):
+                return code
+        return 'Unknown'
+
+    def test_locations(self):
+        """Test key locations"""
+        test_cases = [
+            (34.0522, -118.2437, "CA"),  # Los Angeles
+            (40.7128, -74.0060, "NY"),  # New York
+            (41.8781, -87.6298, "IL"),  # Chicago
+            (21.3069, -157.8583, "HI"),  # Honolulu
+            (58.3016, -134.4207, "AK"),  # Juneau
+            (47.6062, -122.3321, "WA"),  # Seattle
+            (25.7617, -80.1918, "FL"),  # Miami
+            (0, 0, "Unknown"),           # Ocean
+            (44.9671, -103.7716, "SD"), # South Dakota
+            (31.9686, -99.9018, "TX")    # Texas
+        ]
+
+        logger.info("🧪 Starting location tests...")
+        batch = self.locate_many([lat for lat, _, _ in test_cases], [lon for _, lon, _ in test_cases])
+        for (lat, lon, expected), batch_result in zip(test_cases, batch):
+            result = self.locate(lat, lon)
+            agrees = result == batch_result == self._locate_linear(lat, lon)
+            status = "✅" if result == expected and agrees else "❌"
+            logger.info(f"{status} ({lat:.4f}, {lon:.4f}) => {result.ljust(6)} (expected: {expected})")
+
+
+if __name__ == "__main__":
+    locator = StateLocator("states.json")
+    locator.test_locations()
\ No newline at end of file
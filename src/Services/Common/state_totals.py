@@ -0,0 +1,154 @@
+# state_totals.py
+"""
+Running per-state sentiment totals of tweet tables.
+
+Totals live in internal tables of the tweets database, for the whole table
+and per hour of created_at (rollups, which time-windowed analysis sums up
+instead of rescanning rows). Both are written in the same transaction as
+the rows they summarize. They are kept under the model version that scored
+the rows and only exist while they cover every row of their table:
+
+- a replacing upload rewrites them from the uploaded rows;
+- an appending upload adds the appended rows, or drops the totals if the
+  table holds rows scored by other models;
+- rescoring rows (the analysis backfill) drops them;
+- the analysis service stores them after a full aggregate of a table
+  whose rows are all scored by its models.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, delete, func, null, select
+from sqlalchemy.dialects.sqlite import insert
+
+STATE_TOTALS_TABLE = '_state_totals'
+STATE_ROLLUPS_TABLE = '_state_rollups'
+
+# Keys of time buckets, as formatted by strftime in Python and SQLite alike.
+# Rollups are hourly; a day key is a prefix of its hours' keys
+BUCKET_FORMATS = {'hour': '%Y-%m-%d %H', 'day': '%Y-%m-%d'}
+HOUR_FORMAT = BUCKET_FORMATS['hour']
+
+metadata = MetaData()
+
+state_totals = Table(
+    STATE_TOTALS_TABLE, metadata,
+    Column('table_name', String, primary_key=True),
+    Column('model_version', String, primary_key=True),
+    Column('state', String, primary_key=True),
+    Column('sentiment_sum', Float, nullable=False),
+    Column('scored', Integer, nullable=False),
+    Column('rows', Integer, nullable=False),
+)
+
+state_rollups = Table(
+    STATE_ROLLUPS_TABLE, metadata,
+    Column('table_name', String, primary_key=True),
+    Column('model_version', String, primary_key=True),
+    Column('hour', String, primary_key=True),
+    Column('state', String, primary_key=True),
+    Column('sentiment_sum', Float, nullable=False),
+    Column('scored', Integer, nullable=False),
+    Column('rows', Integer, nullable=False),
+)
+
+
+def is_internal_table(table_name: str) -> bool:
+    """Tables of SQLite and of the services themselves, not tweet tables."""
+    return table_name.startswith(('_', 'sqlite_'))
+
+
+def create_state_totals(storage):
+    storage.create_all(metadata)
+
+
+def hour_key(created_at: datetime) -> str:
+    return created_at.strftime(HOUR_FORMAT)
+
+
+def accumulate(totals: Dict, rows: Iterable[Tuple]) -> Dict:
+    """Add (key, sentiment) pairs to [sentiment sum, scored, rows] per key.
+
+    Keys are states for totals and (hour, state) pairs for rollups.
+    """
+    for key, sentiment in rows:
+        entry = totals.setdefault(key, [0.0, 0, 0])
+        if sentiment is not None:
+            entry[0] += sentiment
+            entry[1] += 1
+        entry[2] += 1
+    return totals
+
+
+def read_state_totals(conn, table_name: str, model_version: str) -> List[Tuple]:
+    """Stored (state, sentiment sum, scored rows, all rows) of a table, if any."""
+    return conn.execute(
+        select(state_totals.c.state, state_totals.c.sentiment_sum,
+               state_totals.c.scored, state_totals.c.rows)
+        .where((state_totals.c.table_name == table_name)
+               & (state_totals.c.model_version == model_version))
+    ).fetchall()
+
+
+def read_state_rollups(conn, table_name: str, model_version: str, bucket: Optional[str] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Tuple]:
+    """Summed rollups as (bucket, state, sentiment sum, scored rows, all rows).
+
+    Args:
+        bucket: 'hour', 'day', or None for a single bucket (key None)
+        start, end: Optional window [start, end); must be whole hours
+    """
+    hour = state_rollups.c.hour
+    key = {'hour': hour, 'day': func.substr(hour, 1, len('YYYY-MM-DD')), None: null()}[bucket]
+    query = (select(key, state_rollups.c.state, func.sum(state_rollups.c.sentiment_sum),
+                    func.sum(state_rollups.c.scored), func.sum(state_rollups.c.rows))
+             .where((state_rollups.c.table_name == table_name)
+                    & (state_rollups.c.model_version == model_version))
+             .group_by(*([key] if bucket else []), state_rollups.c.state))
+    if start:
+        query = query.where(hour >= hour_key(start))
+    if end:
+        query = query.where(hour < hour_key(end))
+    return conn.execute(query).fetchall()
+
+
+def clear_state_totals(conn, table_name: str, keep_version: Optional[str] = None):
+    """Drop a table's totals and rollups, except those of keep_version if given."""
+    for stored in (state_totals, state_rollups):
+        condition = stored.c.table_name == table_name
+        if keep_version is not None:
+            condition &= stored.c.model_version != keep_version
+        conn.execute(delete(stored).where(condition))
+
+
+def add_state_totals(conn, table_name: str, model_version: str, totals: Dict[str, List],
+                     rollups: Dict[Tuple[str, str], List]):
+    """Add [sentiment sum, scored, rows] per state and per (hour, state) to the stored totals."""
+    _upsert(conn, state_totals, ['state'], [
+        {'table_name': table_name, 'model_version': model_version, 'state': state,
+         'sentiment_sum': sentiment_sum, 'scored': scored, 'rows': rows}
+        for state, (sentiment_sum, scored, rows) in totals.items()
+    ])
+    _upsert(conn, state_rollups, ['hour', 'state'], [
+        {'table_name': table_name, 'model_version': model_version, 'hour': hour, 'state': state,
+         'sentiment_sum': sentiment_sum, 'scored': scored, 'rows': rows}
+        for (hour, state), (sentiment_sum, scored, rows) in rollups.items()
+    ])
+
+
+def _upsert(conn, stored: Table, key_columns: List[str], values: List[Dict]):
+    if not values:
+        return
+    statement = insert(stored)
+    conn.execute(
+        statement.on_conflict_do_update(
+            index_elements=['table_name', 'model_version'] + key_columns,
+            set_={
+                'sentiment_sum': stored.c.sentiment_sum + statement.excluded.sentiment_sum,
+                'scored': stored.c.scored + statement.excluded.scored,
+                'rows': stored.c.rows + statement.excluded.rows,
+            }
+        ),
+        values
+    )
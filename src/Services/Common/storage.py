@@ -0,0 +1,187 @@
+# storage.py
+"""
+SQLite storage shared by both services.
+
+Both services open the same database files on the shared DataBase volume.
+A Storage gives each process:
+
+- one writer connection, so writes of the process's threads are queued in
+  Python instead of failing on SQLite's database lock, and writes of other
+  processes are waited for up to BUSY_TIMEOUT;
+- a pool of read-only reader connections;
+- a registry of reflected tables, reused until the database schema changes.
+
+The database runs in WAL mode, where readers don't block the writer and
+the writer doesn't block readers. WAL needs all processes on one host,
+which the shared Docker volume is.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+from sqlalchemy import MetaData, Table, create_engine, event, text
+
+# Seconds a connection waits for another process's write lock
+BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))
+# Seconds a thread waits for this process's writer connection; uploads hold it throughout
+WRITER_TIMEOUT = float(os.environ.get('SQLITE_WRITER_TIMEOUT', 600))
+READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE', 8))
+CACHE_SIZE_MB = int(os.environ.get('SQLITE_CACHE_MB', 32))
+MMAP_SIZE_MB = int(os.environ.get('SQLITE_MMAP_MB', 256))
+
+# Applied to every connection, after switching the database file to WAL
+PRAGMAS = {
+    # In WAL mode NORMAL can lose the last commits on power loss but never
+    # corrupts the database, and saves an fsync per transaction
+    'synchronous': 'NORMAL',
+    'cache_size': -CACHE_SIZE_MB * 1024,
+    'mmap_size': MMAP_SIZE_MB * 2**20,
+    'temp_store': 'MEMORY',
+}
+
+
+def _enable_wal(cursor):
+    """Switch the database file to WAL mode (a no-op once it is).
+
+    The switch fails on other connections' locks without waiting for them,
+    so it is retried for up to BUSY_TIMEOUT.
+    """
+    deadline = time.monotonic() + BUSY_TIMEOUT
+    while True:
+        try:
+            cursor.execute('PRAGMA journal_mode = WAL')
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or time.monotonic() > deadline:
+                raise
+        time.sleep(0.05)
+
+
+class TableRegistry:
+    """Reflected tables of a database, cached while its schema is unchanged.
+
+    SQLite bumps the schema version on every CREATE, ALTER or DROP, from
+    any process, so columns added to an old table are picked up on the
+    next lookup.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._tables: Dict[str, Table] = {}
+        self._schema_version = None
+        self._lock = threading.Lock()
+
+    def get(self, table_name: str) -> Table:
+        """Table object of an existing table.
+
+        Raises:
+            NoSuchTableError: If there is no such table
+        """
+        with self.engine.connect() as conn:
+            self._check_schema(conn)
+            table = self._tables.get(table_name)
+            if table is None:
+                table = Table(table_name, MetaData(), autoload_with=conn)
+                with self._lock:
+                    self._tables[table_name] = table
+        return table
+
+    def has_table(self, table_name: str) -> bool:
+        with self.engine.connect() as conn:
+            return conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': table_name}
+            ).first() is not None
+
+    def schema_version(self) -> int:
+        """SQLite's schema cookie: changes whenever a table is created, dropped or altered"""
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql('PRAGMA schema_version').scalar()
+
+    def table_names(self) -> List[str]:
+        with self.engine.connect() as conn:
+            return list(conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+            ).scalars())
+
+    def _check_schema(self, conn):
+        version = conn.exec_driver_sql('PRAGMA schema_version').scalar()
+        with self._lock:
+            if version != self._schema_version:
+                self._tables.clear()
+                self._schema_version = version
+
+
+class Storage:
+    """Writer and reader engines of one SQLite database file.
+
+    Attributes:
+        db_path: Path of the database file
+        writer (Engine): Single-connection engine for everything that writes;
+            None for a read-only storage (writable=False)
+        reader (Engine): Pooled engine of read-only connections
+        tables (TableRegistry): Reflected tables, read through the reader
+    """
+
+    def __init__(self, db_path, read_pool_size: int = READ_POOL_SIZE, writable: bool = True):
+        self.db_path = db_path
+        self.writer = None
+        self.reader = create_engine(
+            f'sqlite:///{db_path}', pool_size=read_pool_size, max_overflow=read_pool_size,
+            connect_args={'check_same_thread': False, 'timeout': BUSY_TIMEOUT}
+        )
+        event.listen(self.reader, 'connect', self._configure_reader)
+        self.tables = TableRegistry(self.reader)
+        if not writable:
+            # E.g. in worker processes, which must never wait for the write lock
+            return
+
+        self.writer = create_engine(
+            f'sqlite:///{db_path}', pool_size=1, max_overflow=0, pool_timeout=WRITER_TIMEOUT,
+            connect_args={'check_same_thread': False, 'timeout': BUSY_TIMEOUT}
+        )
+        event.listen(self.writer, 'connect', self._configure)
+        # Switch the file to WAL before any reader opens it
+        with self.writer.connect():
+            pass
+
+    def create_all(self, metadata, tables=None):
+        """Create missing tables of a MetaData; for service startup and new tables only.
+
+        Tables are looked up through a reader first, so on a database that
+        has them nothing waits for the write lock another process may hold.
+        Missing ones are checked again and created in one write
+        transaction, so processes starting together on a new database
+        don't create a table twice.
+        """
+        names = [table.name for table in (metadata.sorted_tables if tables is None else tables)]
+        if all(self.tables.has_table(name) for name in names):
+            return
+        with self.writer.connect() as conn:
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            metadata.create_all(conn, tables=tables)
+            conn.commit()
+
+    @staticmethod
+    def _configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        _enable_wal(cursor)
+        for name, value in PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    @classmethod
+    def _configure_reader(cls, dbapi_connection, connection_record):
+        cls._configure(dbapi_connection, connection_record)
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+    def dispose(self, close: bool = True):
+        """Drop pooled connections, e.g. those inherited from a parent process (close=False)"""
+        if self.writer is not None:
+            self.writer.dispose(close=close)
+        self.reader.dispose(close=close)
@@ -0,0 +1,267 @@
+# table_snapshot.py
+"""
+Columnar snapshots of tweet tables, for analyses that score raw rows.
+
+A snapshot holds a table's ids, latitudes and longitudes as NumPy arrays
+and its texts as one UTF-8 buffer with an offsets array, in a single file
+under TableSnapshots/ next to the tweets database, named after a hash of
+the table's name and checked against the name it records. Arrays are
+read straight from a read-only memory map, so every process scanning the
+table shares the same pages instead of building row objects from SQL
+results.
+
+Uploads bump the table's generation, kept in an internal table of the
+tweets database and written in the upload's transaction. A snapshot
+records the generation and last row id it was built from and is only used
+while both still match, checked in the same read transaction as the rows
+it stands in for; otherwise it is rebuilt (or the rows read from SQL).
+Scores are not part of a snapshot: they change with every model version.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+from sqlalchemy.dialects.sqlite import insert
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('TABLE_SNAPSHOTS', '1') != '0'
+
+MAGIC = b'TMVTABL\0'
+FORMAT_VERSION = 1
+PREFIX = struct.Struct('<8sII')  # magic, format version, header length
+ALIGNMENT = 8
+# Sections in file order, with the NumPy dtype of array sections
+SECTIONS = (('ids', '<i8'), ('latitude', '<f8'), ('longitude', '<f8'), ('text_offsets', '<i8'), ('texts', None))
+# Rows fetched from the cursor at a time while building
+BUILD_BATCH_SIZE = 10000
+
+metadata = MetaData()
+
+table_generations = Table(
+    '_table_generations', metadata,
+    Column('table_name', String, primary_key=True),
+    Column('generation', Integer, nullable=False),
+)
+
+
+def create_table_generations(storage):
+    storage.create_all(metadata)
+
+
+def bump_generation(conn, table_name: str):
+    """Mark a table's rows as changed; call in the transaction changing them"""
+    conn.execute(insert(table_generations).values(table_name=table_name, generation=1)
+                 .on_conflict_do_update(index_elements=['table_name'],
+                                        set_={'generation': table_generations.c.generation + 1}))
+
+
+def read_stamp(conn, table_name: str) -> Tuple[int, Optional[int]]:
+    """Generation and last row id of a table, as seen by conn's transaction"""
+    generation = conn.execute(select(table_generations.c.generation)
+                              .where(table_generations.c.table_name == table_name)).scalar()
+    last_id = conn.exec_driver_sql(f'SELECT MAX(id) FROM "{table_name}"').scalar()
+    return generation or 0, last_id
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class TableSnapshot:
+    """Memory-mapped columns of one table, in id order.
+
+    Layout: magic, format version, JSON header (table, stamp, row count and
+    section table), then 8-byte aligned sections: ids, latitude, longitude
+    (NaN where NULL), text_offsets (rows + 1) and texts.
+    """
+
+    def __init__(self, path, header: Dict, buffer: mmap.mmap, data_start: int):
+        self.path = Path(path)
+        self.header = header
+        self.buffer = buffer
+        self.data_start = data_start
+        self.stamp = (header['generation'], header['last_id'])
+        self.ids = self._array('ids')
+        self.latitude = self._array('latitude')
+        self.longitude = self._array('longitude')
+        self.text_offsets = self._array('text_offsets')
+
+    @classmethod
+    def build(cls, path, conn, table_name: str) -> Dict:
+        """Write the snapshot of a table as read by conn's transaction, atomically replacing the file.
+
+        Columns are spooled to temporary files while the rows stream in, so
+        memory use doesn't grow with the table.
+        """
+        path = Path(path)
+        generation, last_id = read_stamp(conn, table_name)
+        result = conn.exec_driver_sql(f'SELECT id, latitude, longitude, text FROM "{table_name}" ORDER BY id')
+        with tempfile.TemporaryDirectory(dir=path.parent) as spool:
+            files = {name: open(os.path.join(spool, name), 'w+b') for name, _ in SECTIONS}
+            try:
+                rows, text_length = 0, 0
+                array('q', [0]).tofile(files['text_offsets'])
+                while batch := result.fetchmany(BUILD_BATCH_SIZE):
+                    texts = [(text or '').encode('utf-8') for _, _, _, text in batch]
+                    offsets = array('q')
+                    for text in texts:
+                        text_length += len(text)
+                        offsets.append(text_length)
+                    array('q', [row[0] for row in batch]).tofile(files['ids'])
+                    array('d', [float('nan') if row[1] is None else row[1] for row in batch]).tofile(files['latitude'])
+                    array('d', [float('nan') if row[2] is None else row[2] for row in batch]).tofile(files['longitude'])
+                    offsets.tofile(files['text_offsets'])
+                    files['texts'].write(b''.join(texts))
+                    rows += len(batch)
+
+                sections, offset = {}, 0
+                for name, dtype in SECTIONS:
+                    length = files[name].tell()
+                    sections[name] = {'offset': offset, 'length': length, 'dtype': dtype}
+                    offset += _align(length)
+                header = {'table': table_name, 'generation': generation, 'last_id': last_id, 'rows': rows,
+                          'sections': sections}
+                encoded = json.dumps(header).encode('utf-8')
+                prefix = PREFIX.pack(MAGIC, FORMAT_VERSION, len(encoded)) + encoded
+                prefix += b'\0' * (_align(len(prefix)) - len(prefix))
+
+                fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as out:
+                        out.write(prefix)
+                        for name, section in sections.items():
+                            files[name].seek(0)
+                            while block := files[name].read(1 << 20):
+                                out.write(block)
+                            out.write(b'\0' * (_align(section['length']) - section['length']))
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            finally:
+                for f in files.values():
+                    f.close()
+        logger.info(f"🗜️ Table snapshot written: {path} ({rows} rows, {len(prefix) + offset} bytes)")
+        return header
+
+    @classmethod
+    def open(cls, path) -> 'TableSnapshot':
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < PREFIX.size:
+            raise ValueError("truncated snapshot")
+        magic, version, header_length = PREFIX.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot format {version}")
+        header = json.loads(buffer[PREFIX.size:PREFIX.size + header_length])
+        return cls(path, header, buffer, _align(PREFIX.size + header_length))
+
+    def _array(self, name: str) -> np.ndarray:
+        section = self.header['sections'][name]
+        dtype = np.dtype(section['dtype'])
+        return np.frombuffer(self.buffer, dtype=dtype, count=section['length'] // dtype.itemsize,
+                             offset=self.data_start + section['offset'])
+
+    def positions(self, id_range: Tuple[int, int]) -> slice:
+        """Rows with first_id <= id < end_id"""
+        start, end = np.searchsorted(self.ids, id_range, side='left')
+        return slice(int(start), int(end))
+
+    def lookup(self, ids) -> np.ndarray:
+        """Positions of rows by id; ValueError for ids not in the snapshot"""
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        if len(ids) and (positions.max() >= len(self.ids) or (self.ids[positions] != ids).any()):
+            raise ValueError("rows missing from snapshot")
+        return positions
+
+    def texts(self, positions) -> List[str]:
+        """Decoded texts of rows at the given positions (a slice or an array)"""
+        if isinstance(positions, slice):
+            positions = np.arange(positions.start, positions.stop)
+        base = self.data_start + self.header['sections']['texts']['offset']
+        starts = (self.text_offsets[positions] + base).tolist()
+        ends = (self.text_offsets[positions + 1] + base).tolist()
+        buffer = self.buffer
+        return [buffer[start:end].decode('utf-8') for start, end in zip(starts, ends)]
+
+
+class TableSnapshots:
+    """Current snapshots of the tables of one database, opened once per process.
+
+    Args:
+        storage (Storage): Storage of the tweets database
+        directory: Directory of the snapshot files
+    """
+
+    def __init__(self, storage, directory):
+        self.storage = storage
+        self.directory = Path(directory)
+        self._open: Dict[str, TableSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def path(self, table_name: str) -> Path:
+        """Snapshot file of a table: its name made file-safe, for reading, and a hash of the exact name"""
+        digest = hashlib.sha256(table_name.encode('utf-8')).hexdigest()[:16]
+        return self.directory / f'{re.sub(r"[^A-Za-z0-9_]", "_", table_name)[:64]}-{digest}.bin'
+
+    def get(self, table_name: str, conn=None, build: bool = False) -> Optional[TableSnapshot]:
+        """Snapshot matching the table's rows as seen by conn (or now), or None.
+
+        Opens the file another process may have built; with build, writes a
+        new one if there is none that matches.
+        """
+        if not ENABLED:
+            return None
+        if conn is None:
+            with self.storage.reader.connect() as reader:
+                stamp = read_stamp(reader, table_name)
+        else:
+            stamp = read_stamp(conn, table_name)
+        snapshot = self._open.get(table_name)
+        if snapshot is not None and snapshot.stamp == stamp:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._load(table_name, stamp)
+            if snapshot is None and build:
+                try:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    with self.storage.reader.connect() as reader:
+                        reader.exec_driver_sql('BEGIN')
+                        header = TableSnapshot.build(self.path(table_name), reader, table_name)
+                    # Built from whatever the table held by then
+                    snapshot = self._load(table_name, (header['generation'], header['last_id']))
+                except OSError as e:
+                    logger.warning(f"⚠️ Table snapshot of '{table_name}' not written: {str(e)}")
+            return snapshot
+
+    def _load(self, table_name: str, stamp) -> Optional[TableSnapshot]:
+        try:
+            snapshot = TableSnapshot.open(self.path(table_name))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Unreadable table snapshot of '{table_name}' ({str(e)})")
+            return None
+        # The stamp alone can match another table's
+        if snapshot.header.get('table') != table_name or snapshot.stamp != stamp:
+            return None
+        # Replaced snapshots are left to the garbage collector: arrays of
+        # running scans may still point into their maps
+        self._open[table_name] = snapshot
+        return snapshot
@@ -0,0 +1,89 @@
+# tweet_scores.py
+"""
+Per-row sentiment and state columns shared by both services.
+
+The collection service fills them at upload time; the analysis service
+aggregates them with SQL and backfills rows scored by older models.
+"""
+
+from typing import Dict, List
+
+from sqlalchemy import Index, inspect
+from sqlalchemy.exc import OperationalError
+
+# Column name -> SQLite type, as added to tables created before these columns
+SCORE_COLUMNS = {
+    'sentiment': 'FLOAT',
+    'state': 'VARCHAR(8)',
+    'model_version': 'VARCHAR(16)',
+}
+
+
+def score_index_name(table_name: str) -> str:
+    return f'ix_{table_name}_scored'
+
+
+def score_index(table_name: str) -> Index:
+    """Covering index for the per-state aggregate and the stale-row scan."""
+    return Index(score_index_name(table_name), 'model_version', 'state', 'sentiment')
+
+
+def created_at_index_name(table_name: str) -> str:
+    return f'ix_{table_name}_created_at'
+
+
+def created_at_index(table_name: str) -> Index:
+    """Index for time-windowed analysis."""
+    return Index(created_at_index_name(table_name), 'created_at')
+
+
+def has_score_columns(table) -> bool:
+    """Whether a reflected table has all score columns."""
+    return set(SCORE_COLUMNS) <= set(table.c.keys())
+
+
+def ensure_score_columns(engine, table_name: str):
+    """Add score columns with their index, and the created_at index, to an older table.
+
+    Safe to call concurrently from several processes.
+    """
+    existing = {column['name'] for column in inspect(engine).get_columns(table_name)}
+    with engine.begin() as conn:
+        for name, column_type in SCORE_COLUMNS.items():
+            if name in existing:
+                continue
+            try:
+                conn.exec_driver_sql(f'ALTER TABLE "{table_name}" ADD COLUMN {name} {column_type}')
+            except OperationalError as e:
+                if 'duplicate column' not in str(e):
+                    raise
+        conn.exec_driver_sql(
+            f'CREATE INDEX IF NOT EXISTS "{score_index_name(table_name)}" '
+            f'ON "{table_name}" (model_version, state, sentiment)'
+        )
+        conn.exec_driver_sql(
+            f'CREATE INDEX IF NOT EXISTS "{created_at_index_name(table_name)}" '
+            f'ON "{table_name}" (created_at)'
+        )
+
+
+def score_rows(models, rows: List[Dict]) -> List[Dict]:
+    """Fill sentiment, state and model_version of parsed tweet rows in place.
+
+    Args:
+        models (Models): Analyzer, locator and their version
+        rows (List[Dict]): Rows with latitude, longitude and text
+
+    Returns:
+        List[Dict]: The same rows
+    """
+    if not rows:
+        return rows
+    sentiments = models.analyzer.analyze_many([row['text'] for row in rows])
+    states = models.locator.locate_many([row['latitude'] for row in rows],
+                                        [row['longitude'] for row in rows])
+    for row, sentiment, state in zip(rows, sentiments, states):
+        row['sentiment'] = sentiment
+        row['state'] = state
+        row['model_version'] = models.version
+    return rows
@@ -1,12 +1,26 @@
 # app.py
-from flask import Flask, jsonify
+import sys
+from pathlib import Path
+
+# Shared modules are copied next to the service in containers; locally they
+# live in src/Services/Common
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+
+from datetime import datetime
+from flask import Flask, Response, jsonify, request, stream_with_context
 from controllers import AnalysisController
 from config import Config
-from state_locator import StateLocator
 from flask_cors import CORS
+from http_cache import compress_app, make_etag, not_modified
+from jobs import JobQueue, accepted, jobs_blueprint
+from metrics import instrument_app
+from profiling import profile_app, requested_profile
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app)
+compress_app(app)
+profile_app(app)
 try:
     config = Config()
     print("\n🔧 Configuration check:")
@@ -17,22 +31,161 @@ except FileNotFoundError as e:
     print(f"❌ Configuration error: {e}")
     exit(1)
 
+# Built at import time: under a preloading server (gunicorn.conf.py) the
+# models are loaded once in the master and shared copy-on-write by workers
+controller = AnalysisController(config)
+controller.init_db()
+
+def parse_window(args):
+    """from/to (ISO dates or datetimes, to exclusive) and bucket (hour/day) query parameters"""
+    try:
+        start, end = (datetime.fromisoformat(args[name]) if args.get(name) else None for name in ('from', 'to'))
+    except ValueError:
+        raise ValueError("'from' and 'to' must be ISO dates or datetimes")
+    bucket = args.get('bucket') or None
+    if bucket not in (None, 'hour', 'day'):
+        raise ValueError("'bucket' must be 'hour' or 'day'")
+    if start and end and start >= end:
+        raise ValueError("'from' must be before 'to'")
+    return start, end, bucket
+
+def parse_viewport(args):
+    """bbox (west,south,east,north in degrees), limit and sample (fraction of rows) query parameters"""
+    try:
+        bbox = tuple(float(value) for value in args.get('bbox', '').split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise ValueError("'bbox' must be west,south,east,north in degrees")
+    west, south, east, north = bbox
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= north <= 90):
+        raise ValueError("'bbox' is out of range")
+    try:
+        limit = int(args['limit']) if args.get('limit') else None
+        sample = float(args['sample']) if args.get('sample') else None
+    except ValueError:
+        raise ValueError("'limit' must be an integer and 'sample' a number")
+    if limit is not None and limit < 1:
+        raise ValueError("'limit' must be positive")
+    if sample is not None and not 0 < sample <= 1:
+        raise ValueError("'sample' must be in (0, 1]")
+    return bbox, limit, sample
+
+# Query parameters of an approximate analysis
+APPROXIMATION_PARAMS = ('approximate', 'max_error', 'budget', 'confidence', 'seed')
+
+def parse_approximation(args):
+    """approximate=1 with max_error, budget (seconds), confidence and seed query parameters.
+
+    Returns DataProcessor.process_sample options, or None for an exact analysis.
+    """
+    if args.get('approximate') in (None, '', '0', 'false'):
+        return None
+    if args.get('bucket'):
+        raise ValueError("'approximate' can't be combined with 'bucket'")
+    try:
+        options = {
+            'max_error': float(args.get('max_error', 0.02)),
+            'time_budget': float(args.get('budget', 2.0)),
+            'confidence': float(args.get('confidence', 0.95)),
+            'seed': int(args['seed']) if args.get('seed') else None,
+        }
+    except ValueError:
+        raise ValueError("'max_error', 'budget' and 'confidence' must be numbers and 'seed' an integer")
+    if not options['max_error'] > 0:
+        raise ValueError("'max_error' must be positive")
+    if not 0 < options['time_budget'] <= 60:
+        raise ValueError("'budget' must be in (0, 60] seconds")
+    if not 0 < options['confidence'] < 1:
+        raise ValueError("'confidence' must be in (0, 1)")
+    return options
+
+def run_analysis(job):
+    start, end, bucket = parse_window(job.params)
+    approximation = parse_approximation(job.params)
+    if approximation:
+        return controller.approximate(job.params['table'], start, end, progress=job.update, **approximation)
+    return controller.process(job.params['table'], start, end, bucket, progress=job.update)
+
+# Workers are started per process: by gunicorn's post_fork, or on first submit
+job_queue = JobQueue(config.jobs_path, {'analysis': run_analysis}, config.job_workers)
+app.register_blueprint(jobs_blueprint(job_queue))
+
+def analysis_params(table_name, args, profile_id=None):
+    """Parameters of an analysis job, after checking the window and approximation parameters (ValueError)"""
+    parse_window(args)
+    parse_approximation(args)
+    params = {name: args[name] for name in ('from', 'to', 'bucket') + APPROXIMATION_PARAMS if args.get(name)}
+    if profile_id:
+        params['profile'] = profile_id
+    return dict(params, table=table_name)
+
+def analysis_etag(table_name, args):
+    """ETag of an analysis: the table's content version, the model version and the window"""
+    start, end, bucket = parse_window(args)
+    return make_etag('analyze', table_name, *controller.version_token(table_name),
+                     start and start.isoformat(), end and end.isoformat(), bucket)
+
 @app.route('/analyze/<table_name>', methods=['GET'])
 def analyze(table_name):
+    """Synchronous analysis: an analysis job run in the request, not stored.
+
+    Answers 304 without running the job when If-None-Match holds the
+    ETag of the current table and models, unless a profile is requested.
+    Approximate analyses (approximate=1) differ from sample to sample, so
+    they have no ETag.
+    """
+    try:
+        etag = analysis_etag(table_name, request.args)
+        if parse_approximation(request.args):
+            etag = None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    profile_id = requested_profile()
+    cached = None if profile_id or etag is None else not_modified(etag)
+    if cached:
+        return cached
+    result, status = job_queue.run('analysis', analysis_params(table_name, request.args, profile_id))
+    response = jsonify(result)
+    if etag and status == 200 and 'error' not in result:
+        response.set_etag(etag)
+    return response, status
+
+@app.route('/jobs/analyze/<table_name>', methods=['POST'])
+def analyze_job(table_name):
+    """Queue an analysis; poll /jobs/<id> for progress and fetch /jobs/<id>/result.
+
+    The final progress of an analysis that scored rows holds the table's
+    scoring memo hits and lookups ('memo').
+    """
+    try:
+        params = analysis_params(table_name, request.values, requested_profile())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return accepted(job_queue.submit('analysis', params))
+
+@app.route('/points/<table_name>', methods=['GET'])
+def points(table_name):
+    """Scored tweets inside a viewport, streamed as NDJSON (one JSON object per line).
+
+    A west > east box spans the antimeridian; sample keeps the same
+    fraction of rows at every zoom level.
+    """
     try:
-        controller = AnalysisController(config)
-        return jsonify(controller.process(table_name))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        bbox, limit, sample = parse_viewport(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not controller.db_manager.table_exists(table_name):
+        return jsonify({'error': f'Table "{table_name}" not found in database'}), 404
+    chunks = controller.points(table_name, bbox, limit, sample)
+    return Response(stream_with_context(chunks), mimetype='application/x-ndjson')
 
 if __name__ == '__main__':
     print("\n📍 Running system checks...")
-    locator = StateLocator(config.states_path)  # Теперь этот класс распознаётся
-    locator.test_locations()
-    
-    from sentiment_analyzer import SentimentAnalyzer
-    analyzer = SentimentAnalyzer(config.sentiments_path)
-    analyzer.stats()
+    models = controller.models.get()
+    models.locator.test_locations()
+    models.analyzer.stats()
     
     print("\n🚀 Starting Flask server...")
+    job_queue.start()
     app.run(debug=True)
\ No newline at end of file
@@ -1,4 +1,5 @@
 # config.py
+import os
 from pathlib import Path
 
 class Config:
@@ -7,9 +8,24 @@ class Config:
         self._validate_paths()
     
     def _validate_paths(self):
-        self.db_path = self.base_dir / 'src' / 'Services' / 'DataBase' / 'DataTweets.db'
-        self.sentiments_path = self.base_dir / 'Data' / 'sentiments.csv'
-        self.states_path = self.base_dir / 'Data' / 'states.json'
+        # Same overrides as the collection service's, for local runs on other files
+        self.db_path = Path(os.environ.get('TWEETS_DB_PATH',
+                                           self.base_dir / 'src' / 'Services' / 'DataBase' / 'DataTweets.db'))
+        data_dir = Path(os.environ.get('DATA_DIR', self.base_dir / 'Data'))
+        self.sentiments_path = data_dir / 'sentiments.csv'
+        self.states_path = data_dir / 'states.json'
+        self.cache_path = self.db_path.parent / 'ResultCache.db'
+        self.cache_size = 64
+        self.snapshot_path = self.db_path.parent / 'ModelSnapshot.bin'
+        self.jobs_path = self.db_path.parent / 'Jobs.db'
+        # Analysis jobs run at once per process
+        self.job_workers = int(os.environ.get('ANALYSIS_JOB_WORKERS', 2))
+        # Processes scoring raw rows of large tables, in all server workers
+        # together: each gets an equal share for its shard pool. A share of
+        # 1 scores in the request
+        analysis_workers = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))
+        server_workers = int(os.environ.get('ANALYSIS_SERVER_WORKERS', 1))
+        self.analysis_workers = max(1, analysis_workers // max(1, server_workers))
 
         missing = []
         if not self.db_path.exists(): 
@@ -1,22 +1,85 @@
 # controllers.py
 from database import DatabaseManager
-from sentiment_analyzer import SentimentAnalyzer
-from state_locator import StateLocator
 from data_processor import DataProcessor
+from jobs import JobCancelled
+from model_registry import ModelRegistry
+from result_cache import ResultCache
+from score_backfill import ScoreBackfiller
 
 class AnalysisController:
     def __init__(self, config):
         self.db_manager = DatabaseManager(config.db_path)
-        self.analyzer = SentimentAnalyzer(config.sentiments_path)
-        self.locator = StateLocator(config.states_path)
-        self.processor = DataProcessor(self.db_manager, self.analyzer, self.locator)
+        self.models = ModelRegistry(config)
+        self.cache = ResultCache(config.cache_path, config.cache_size)
+        self.backfiller = ScoreBackfiller(self.db_manager, self.models)
+        self.workers = config.analysis_workers
 
-    def process(self, table_name):
+    def init_db(self):
+        """Create missing tables of the tweets and cache databases; once at service startup"""
+        self.db_manager.init_db()
+        self.cache.init_db()
+
+    def dispose_connections(self):
+        """Drop pooled connections inherited from a parent process"""
+        self.db_manager.storage.dispose(close=False)
+        self.cache.storage.dispose(close=False)
+
+    def version_token(self, table_name):
+        """(table content version, model version): analyses change only when one does"""
+        return self.cache.get_version(table_name), self.models.get().version
+
+    def points(self, table_name, bbox, limit=None, sample=None):
+        """NDJSON chunks of scored tweets inside a box (see DataProcessor.stream_points)"""
+        models = self.models.get()
+        for partition, _, _ in self.db_manager.get_partitions(table_name):
+            self.db_manager.ensure_point_index(partition)
+        processor = DataProcessor(self.db_manager, models.analyzer, models.locator, models.version, self.backfiller)
+        return processor.stream_points(table_name, bbox, limit, sample)
+
+    def process(self, table_name, start=None, end=None, bucket=None, progress=None):
+        try:
+            if not self.db_manager.table_exists(table_name):
+                return {'error': f'Table "{table_name}" not found in database'}
+
+            models = self.models.get()
+            if start or end or bucket:
+                # Windows are answered from hourly rollups, not cached
+                processor = DataProcessor(self.db_manager, models.analyzer, models.locator,
+                                          models.version, self.backfiller, progress=progress)
+                return processor.process_window(table_name, start, end, bucket) or {'error': 'No valid data found'}
+
+            version = self.cache.get_version(table_name)
+            cached = self.cache.get(table_name, version, models.version)
+            if cached is not None:
+                return cached
+
+            processor = DataProcessor(self.db_manager, models.analyzer, models.locator,
+                                      models.version, self.backfiller, self.workers, progress)
+            result = processor.process_table(table_name)
+            if not result:
+                return {'error': 'No valid data found'}
+            if 'error' not in result:
+                self.cache.put(table_name, version, result, models.version)
+            return result
+        except JobCancelled:
+            raise
+        except Exception as e:
+            return {'error': f'Processing error: {str(e)}'}
+
+    def approximate(self, table_name, start=None, end=None, progress=None, **options):
+        """Per-state means from a random sample, with confidence intervals (see DataProcessor.process_sample).
+
+        Not cached: the result depends on the sample drawn.
+        """
         try:
             if not self.db_manager.table_exists(table_name):
                 return {'error': f'Table "{table_name}" not found in database'}
-                
-            result = self.processor.process_table(table_name)
-            return result if result else {'error': 'No valid data found'}
+
+            models = self.models.get()
+            processor = DataProcessor(self.db_manager, models.analyzer, models.locator,
+                                      models.version, self.backfiller, progress=progress)
+            return processor.process_sample(table_name, start, end, **options) or {'error': 'No valid data found'}
+        except JobCancelled:
+            raise
         except Exception as e:
-            return {'error': f'Processing error: {str(e)}'}
\ No newline at end of file
+            return {'error': f'Processing error: {str(e)}'}
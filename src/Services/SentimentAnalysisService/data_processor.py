@@ -1,117 +1,644 @@
 # data_processor.py
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import groupby
+from operator import itemgetter
+import json
 import logging
+import threading
+import time
+
+import numpy as np
+
+from database import DatabaseManager
+from metrics import ANALYSIS_TWEETS, MEMO_LOOKUPS, Stages
+from mood_colors import color_band, color_scale, mood_color, state_colors
+from process_pools import shutdown_at_exit, worker_context
+from sampling import BlockSample, StateEstimates
+from state_totals import BUCKET_FORMATS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Counters filled by the analyzer's and locator's memos, next to the tweet outcomes
+MEMO_COUNTERS = ('text_memo_hits', 'text_memo_misses', 'point_memo_hits', 'point_memo_misses')
+
+# Processor of a shard worker process, set up by the pool initializer
+_worker_processor = None
+
+# Shard pool of this process, shared by its request and job threads, with
+# the (db path, analyzer, locator, workers) it was started for
+_shard_pool = None
+_shard_pool_key = None
+_shard_pool_lock = threading.Lock()
+
+
+def _init_shard_worker(db_path, analyzer, locator):
+    """Pool initializer: models come from the parent, database connections don't.
+
+    Shards are only read, so workers open the database read-only and never
+    wait for the write lock of an upload running meanwhile.
+    """
+    global _worker_processor
+    _worker_processor = DataProcessor(DatabaseManager(db_path, writable=False), analyzer, locator)
+
+
+def shard_pool(db_path, analyzer, locator, workers):
+    """The process's long-lived shard pool, restarted when the models or database change"""
+    global _shard_pool, _shard_pool_key
+    key = (db_path, analyzer, locator, workers)
+    with _shard_pool_lock:
+        if _shard_pool is None or any(a is not b for a, b in zip(key, _shard_pool_key)):
+            if _shard_pool is not None:
+                # Shards already submitted to it still finish
+                _shard_pool.shutdown(wait=False)
+            logger.info(f"⚙️ Starting a pool of {workers} shard processes")
+            # Workers start from a fork server, which has this module imported
+            _shard_pool = ProcessPoolExecutor(max_workers=workers, mp_context=worker_context([__name__]),
+                                              initializer=_init_shard_worker, initargs=(db_path, analyzer, locator))
+            _shard_pool_key = key
+            shutdown_at_exit(_shard_pool)
+        return _shard_pool
+
+
+def _drop_shard_pool(pool):
+    """Forget a broken pool, so the next analysis starts a new one"""
+    global _shard_pool
+    with _shard_pool_lock:
+        if _shard_pool is pool:
+            _shard_pool = None
+
+
+def _scan_shard(table_name, id_range, stale_version, use_snapshot):
+    stages = Stages()
+    state_totals, counters = _worker_processor._scan_shard(table_name, id_range, stale_version, stages,
+                                                           use_snapshot)
+    return state_totals, counters, dict(stages.seconds)
+
+
 class DataProcessor:
-    def __init__(self, db_manager, analyzer, locator):
+    # Row ids per shard. Shards are also the unit of summation, so the
+    # result doesn't depend on how many processes scan them
+    SHARD_ROWS = 50000
+    # Tables with fewer shards than this are scanned in the request process
+    PARALLEL_MIN_SHARDS = 4
+    # Row ids per sampled block of an approximate analysis, and blocks read
+    # by its first round
+    SAMPLE_BLOCK_IDS = 64
+    SAMPLE_FIRST_BLOCKS = 32
+
+    def __init__(self, db_manager, analyzer, locator, model_version=None, backfiller=None, workers=1,
+                 progress=None):
         self.db_manager = db_manager
         self.analyzer = analyzer
         self.locator = locator
+        # Scores stored at upload time are used only if they match these models
+        self.model_version = model_version
+        self.backfiller = backfiller
+        self.workers = workers
+        # Called with rows processed so far, e.g. to update an analysis job
+        self.progress = progress
 
     def process_table(self, table_name):
         try:
             logger.info(f"📂 Processing table: {table_name}")
-            tweets = self.db_manager.get_tweets(table_name)
+            state_totals = defaultdict(lambda: [0.0, 0])
+            counters = self._new_counters()
+            stages = Stages()
 
-            if not tweets:
+            # A partitioned table's partitions are aggregated one by one and
+            # the rows they can't aggregate scanned together
+            scans = []
+            for partition, _, _ in self.db_manager.get_partitions(table_name):
+                if self.model_version and self.db_manager.has_score_columns(partition):
+                    scans += self._add_stored_scores(partition, state_totals, counters, stages)
+                else:
+                    scans.append((partition, None, True))
+            self._add_shards(scans, state_totals, counters, stages)
+            for partition, _, _ in scans:
+                self._schedule_backfill(partition)
+
+            if not counters['total']:
                 logger.warning("⚠️ Empty table")
                 return {'error': 'Table is empty'}
 
-            state_scores = defaultdict(list)
-            counters = {
-                'total': len(tweets),
-                'missing_coords': 0,
-                'no_sentiment': 0,
-                'unknown_state': 0
-            }
-
-            for tweet in tweets:
-                result = self._process_tweet(tweet, counters)
-                if result:
-                    state, score = result
-                    state_scores[state].append(score)
-
             logger.info(f"""
                 📊 Processing results:
                 Total tweets: {counters['total']}
                 Missing coordinates: {counters['missing_coords']}
                 No sentiment: {counters['no_sentiment']}
                 Unknown state: {counters['unknown_state']}
-                Valid tweets: {sum(len(v) for v in state_scores.values())}
+                Valid tweets: {sum(count for _, count in state_totals.values())}
             """)
 
             # Логирование средних значений
-            if state_scores:
-                averages = {state: sum(scores)/len(scores) for state, scores in state_scores.items()}
+            averages = {state: total / count for state, (total, count) in state_totals.items()}
+            if averages:
                 logger.info("📈 Calculated sentiment averages:")
                 for state, avg in sorted(averages.items(), key=lambda x: x[1], reverse=True):
                     logger.info(f"  ▸ {state}: {avg:.4f}")
 
-            return self._generate_output(state_scores) if state_scores else {}
+            with stages('colorize'):
+                output = self._generate_output(averages) if averages else {}
+            self._record(table_name, stages, [counters])
+            return output
 
         except Exception as e:
             logger.error(f"🔥 Processing error: {str(e)}")
             raise
 
-    def _process_tweet(self, tweet, counters):
-        try:
-            lat, lon = tweet.latitude, tweet.longitude
-            if None in (lat, lon):
-                counters['missing_coords'] += 1
-                return None
+    def stream_points(self, table_name, bbox, limit=None, sample=None):
+        """NDJSON lines of tweets inside a box, with their sentiment and state.
 
-            score = self.analyzer.analyze(tweet.text)
-            if score is None:
-                counters['no_sentiment'] += 1
-                return None
+        Yields one chunk of lines per database batch, so memory use is
+        bounded by the batch size. Rows not scored by the current models
+        are scored on the way and queued for the backfill.
+        """
+        stages = Stages()
+        points = 0
+        for partition, _, _ in self.db_manager.get_partitions(table_name):
+            if limit and points >= limit:
+                break
+            for rows, chunk in self._stream_partition_points(partition, bbox, limit and limit - points, sample,
+                                                             stages):
+                points += rows
+                yield chunk
+        stages.record('points', points, table=table_name)
 
-            state = self.locator.locate(lat, lon)
+    def _stream_partition_points(self, table_name, bbox, limit, sample, stages):
+        """(rows, NDJSON chunk) per database batch of one table"""
+        for rows in self._fetch(self.db_manager.get_points(table_name, bbox, self.model_version, limit, sample),
+                                stages):
+            stale = [row for row in rows if row.stale]
+            scores = {}
+            if stale:
+                with stages('tokenize'):
+                    sentiments = self.analyzer.analyze_many([row.text for row in stale])
+                with stages('locate'):
+                    states = self.locator.locate_many([row.latitude for row in stale], [row.longitude for row in stale])
+                scores = {row.id: score for row, score in zip(stale, zip(sentiments, states))}
+            with stages('serialize'):
+                lines = []
+                for row in rows:
+                    sentiment, state = scores.get(row.id, (row.sentiment, row.state))
+                    lines.append(json.dumps({'id': row.id, 'lat': row.latitude, 'lon': row.longitude,
+                                             'sentiment': sentiment, 'state': state}))
+            yield len(rows), '\n'.join(lines) + '\n'
+            if stale:
+                self._schedule_backfill(table_name)
+
+    def _add_stored_scores(self, table_name, state_totals, counters, stages):
+        """Aggregate scores stored at upload time with one GROUP BY query.
+
+        Rows scored by other model versions are scored by the caller and
+        queued for a background backfill, so the result is always for
+        current models. The backfill may rescore rows meanwhile, so then
+        the table is read again shard by shard, each shard's scored and
+        stale rows from one snapshot: the table is returned as a scan for
+        _add_shards instead of being added here.
+        """
+        with stages('aggregate'):
+            totals, stale = self.db_manager.get_state_totals(table_name, self.model_version)
+
+        if stale:
+            # Worth a columnar snapshot when most rows are read anyway, e.g. after a model change
+            build_snapshot = 2 * stale >= stale + sum(rows for *_, rows in totals)
+            return [(table_name, self.model_version, build_snapshot)]
+        self._add_totals(totals, state_totals, counters)
+        self._report(rows_processed=counters['total'])
+        return []
+
+    @staticmethod
+    def _add_totals(totals, state_totals, counters):
+        """Add (state, sentiment sum, scored rows, all rows) aggregates"""
+        for state, score_sum, scored, rows in totals:
+            counters['total'] += rows
+            counters['no_sentiment'] += rows - scored
+            if not scored:
+                continue
             if state == 'Unknown':
-                counters['unknown_state'] += 1
-                return None
+                counters['unknown_state'] += scored
+                continue
+            state_totals[state][0] += score_sum
+            state_totals[state][1] += scored
+
+    def process_window(self, table_name, start=None, end=None, bucket=None):
+        """Color map of tweets created in [start, end), or per-state averages per hour/day bucket"""
+        try:
+            logger.info(f"📂 Processing table: {table_name} from {start} to {end}, buckets: {bucket}")
+            buckets = defaultdict(lambda: (defaultdict(lambda: [0.0, 0]), self._new_counters()))
+            window = (start, end)
+            stages = Stages()
 
-            return state, score
+            # Scored and stale rows from one snapshot, whatever the backfill commits meanwhile.
+            # Partitions outside the window are skipped
+            with self.db_manager.snapshot() as conn:
+                for partition, part_start, part_end in self.db_manager.get_partitions(table_name, start, end, conn):
+                    self._add_window(partition, self._clip_window(window, part_start, part_end), bucket,
+                                     buckets, stages, conn)
+
+            if not any(counters['total'] for _, counters in buckets.values()):
+                logger.warning("⚠️ No tweets in window")
+                return {'error': 'No tweets in the selected time window'}
+
+            if not bucket:
+                state_totals, _ = buckets[None]
+                averages = {state: total / count for state, (total, count) in state_totals.items()}
+                with stages('colorize'):
+                    output = self._generate_output(averages) if averages else {}
+            else:
+                output = {
+                    'bucket': bucket,
+                    'series': [
+                        {'start': key,
+                         'averages': {state: total / count for state, (total, count) in state_totals.items()}}
+                        for key, (state_totals, _) in sorted(buckets.items())
+                    ]
+                }
+            self._record(table_name, stages, [counters for _, counters in buckets.values()])
+            return output
 
         except Exception as e:
-            logger.warning(f"⚠️ Error processing tweet: {str(e)}")
-            return None
+            logger.error(f"🔥 Processing error: {str(e)}")
+            raise
 
-    def _generate_output(self, state_scores):
-        averages = {state: sum(scores)/len(scores) for state, scores in state_scores.items()}
-        min_score = min(averages.values())
-        max_score = max(averages.values())
-        range_score = max_score - min_score if max_score != min_score else 1
+    def process_sample(self, table_name, start=None, end=None, max_error=0.02, time_budget=2.0,
+                       confidence=0.95, seed=None):
+        """Per-state mean sentiment estimated from a uniform random sample of rows.
 
-        logger.info("🌈 Final color mapping:")
-        for state, score in sorted(averages.items()):
-            logger.info(f"  ▸ {state}: {score:.4f} → {self._calculate_color(score, min_score, range_score)}")
+        Blocks of ids (see sampling.py) of the rows in [start, end) are read
+        in rounds, each twice the blocks of the last but no more than the
+        rate so far fits in the rest of time_budget (seconds), until every
+        state's confidence interval is within max_error of its mean, the
+        budget is spent or all blocks are read, which makes the means
+        exact. Stale rows are scored on the way and queued for the
+        backfill. A state is uncertain if its interval spans more than one
+        color band, or has no width yet.
+        """
+        try:
+            logger.info(f"🎲 Sampling table: {table_name} from {start} to {end}, max error {max_error}")
+            began = time.perf_counter()
+            window = (start, end)
+            counters = self._new_counters()
+            stages = Stages()
+
+            # The ids of the rows at the start; a round's blocks are read from one snapshot
+            with self.db_manager.snapshot() as conn:
+                windows = {partition: self._clip_window(window, part_start, part_end)
+                           for partition, part_start, part_end
+                           in self.db_manager.get_partitions(table_name, start, end, conn)}
+                id_ranges = [(partition, id_range) for partition in windows
+                             if (id_range := self.db_manager.get_id_range(partition, conn))]
+            sample = BlockSample(id_ranges, self.SAMPLE_BLOCK_IDS, seed)
+            estimates = StateEstimates()
+            results, rounds, stopped = {}, 0, 'exhausted'
+            stale_tables = set()
+
+            count = self.SAMPLE_FIRST_BLOCKS
+            while not sample.exhausted:
+                round_start = time.perf_counter()
+                blocks = sample.take(count)
+                round_rows = []
+                with self.db_manager.snapshot() as conn:
+                    for partition, group in groupby(blocks, key=itemgetter(0)):
+                        block_rows = self.db_manager.get_id_blocks(conn, partition, [ids for _, ids in group],
+                                                                   self.model_version, windows[partition])
+                        for _, rows in self._fetch(block_rows, stages):
+                            if any(row.stale for row in rows):
+                                stale_tables.add(partition)
+                            round_rows.append(rows)
+                counters['total'] += sum(len(rows) for rows in round_rows)
+                block_pairs = self._score_blocks(round_rows, counters, stages)
+                with stages('aggregate'):
+                    for pairs in block_pairs:
+                        estimates.add_block(pairs)
+                rounds += 1
+                results = estimates.estimates(confidence, sample.fraction)
+                widths = [width for _, width, _ in results.values()]
+                error = max((width for width in widths if width is not None), default=None)
+                self._report(rows_processed=counters['total'], rounds=rounds, max_error=error)
+                if sample.exhausted:
+                    break
+                if results and None not in widths and error <= max_error:
+                    stopped = 'error'
+                    break
+                elapsed = time.perf_counter() - began
+                if elapsed >= time_budget:
+                    stopped = 'budget'
+                    break
+                rate = len(blocks) / max(time.perf_counter() - round_start, 1e-6)
+                count = max(1, min(2 * len(blocks), int(rate * (time_budget - elapsed))))
+            for partition in stale_tables:
+                self._schedule_backfill(partition)
+
+            if not counters['total']:
+                logger.warning("⚠️ No tweets sampled")
+                return {'error': 'No tweets in the selected time window' if start or end else 'Table is empty'}
+            if not results:
+                return {}
+
+            logger.info(f"🎲 Sampled {counters['total']} tweets ({sample.fraction:.1%} of blocks) "
+                        f"in {rounds} rounds, stopped by {stopped}")
+            means = {state: mean for state, (mean, _, _) in results.items()}
+            with stages('colorize'):
+                colors = self._generate_output(means)
+                min_score, range_score = color_scale(means)
+                states = {}
+                for state, (mean, width, samples) in sorted(results.items()):
+                    low, high = (None, None) if width is None else (mean - width, mean + width)
+                    states[state] = {
+                        'mean': mean, 'low': low, 'high': high, 'samples': samples, 'color': colors[state],
+                        'uncertain': width is None or (color_band(low, min_score, range_score)
+                                                       != color_band(high, min_score, range_score))
+                    }
+            self._report_memo_lookups(table_name, counters['total'], counters, rounds=rounds)
+            stages.record('approximate', counters['total'], table=table_name)
+            return {
+                'approximate': True,
+                'colors': colors,
+                'states': states,
+                'confidence': confidence,
+                'rows_sampled': counters['total'],
+                'sample_fraction': sample.fraction,
+                'rounds': rounds,
+                'stopped': stopped,
+                'elapsed_ms': round((time.perf_counter() - began) * 1e3, 1),
+            }
+
+        except Exception as e:
+            logger.error(f"🔥 Processing error: {str(e)}")
+            raise
+
+    def _score_blocks(self, blocks, counters, stages):
+        """(state, score) pairs of each block of rows read with their stored scores.
+
+        Stale rows of all blocks are scored here in one batch.
+        """
+        block_pairs = [[] for _ in blocks]
+        stale = [(block, row) for block, rows in enumerate(blocks) for row in rows if row.stale]
+        if stale:
+            located = self._locate_columns(np.array([row.latitude for _, row in stale], dtype=float),
+                                           np.array([row.longitude for _, row in stale], dtype=float),
+                                           [row.text for _, row in stale], counters, stages)
+            for i, state, score in located:
+                block_pairs[stale[i][0]].append((state, score))
+        for pairs, rows in zip(block_pairs, blocks):
+            for row in rows:
+                if row.stale:
+                    continue
+                if row.sentiment is None:
+                    counters['no_sentiment'] += 1
+                elif row.state == 'Unknown':
+                    counters['unknown_state'] += 1
+                else:
+                    pairs.append((row.state, row.sentiment))
+        return block_pairs
+
+    def _add_window(self, table_name, window, bucket, buckets, stages, conn):
+        """Add a table's rows in window to per-bucket state totals and counters"""
+        stale_version, scan_rows = None, True
+        if self.model_version and self.db_manager.has_score_columns(table_name):
+            with stages('aggregate'):
+                groups, stale = self.db_manager.get_bucket_totals(table_name, self.model_version,
+                                                                  bucket, window, conn)
+                for key, *totals in groups:
+                    self._add_totals([totals], *buckets[key])
+            stale_version, scan_rows = self.model_version, bool(stale)
+
+        if scan_rows:
+            for tweets in self._fetch(self.db_manager.get_tweets(table_name, stale_version=stale_version,
+                                                                 window=window, conn=conn), stages):
+                by_bucket = defaultdict(list)
+                for tweet in tweets:
+                    by_bucket[tweet.created_at.strftime(BUCKET_FORMATS[bucket]) if bucket else None].append(tweet)
+                for key, group in by_bucket.items():
+                    self._add_tweet_stream([group], *buckets[key], stages)
+                self._report(rows_processed=sum(counters['total'] for _, counters in buckets.values()))
+            self._schedule_backfill(table_name)
+
+    @staticmethod
+    def _clip_window(window, part_start, part_end):
+        """The part of a (start, end) window that limits a partition's rows.
+
+        A bound the partition lies within is dropped, so a partition
+        wholly inside the window is summed from its hourly rollups.
+        """
+        start, end = window
+        return (start if start and (part_start is None or start > part_start) else None,
+                end if end and (part_end is None or end < part_end) else None)
+
+    def _report(self, force=False, **progress):
+        if self.progress:
+            self.progress(progress, force=force)
+
+    def _record(self, table_name, stages, all_counters):
+        """Export stage timings, throughput, tweet counters and memo lookups of one analysis.
+
+        The exported lookups aren't labelled by table, whose names are
+        chosen by uploaders: the table's memo hits and lookups are logged
+        and reported as the job's final progress (/jobs/<id>) instead.
+        """
+        memo_counters = dict.fromkeys(MEMO_COUNTERS, 0)
+        for counters in all_counters:
+            for outcome, count in counters.items():
+                if outcome in MEMO_COUNTERS:
+                    memo, _, result = outcome.split('_')
+                    MEMO_LOOKUPS.inc(count, memo=memo, outcome=result)
+                    memo_counters[outcome] += count
+                else:
+                    ANALYSIS_TWEETS.inc(count, outcome=outcome)
+        total = sum(counters['total'] for counters in all_counters)
+        self._report_memo_lookups(table_name, total, memo_counters)
+        stages.record('analysis', total, table=table_name)
 
+    def _report_memo_lookups(self, table_name, rows_processed, counters, **progress):
+        """Log a table's memo hit rates and report its hits and lookups per memo as final progress"""
+        memo = {}
+        for name in ('text', 'point'):
+            hits = counters[f'{name}_memo_hits']
+            memo[name] = {'hits': hits, 'lookups': hits + counters[f'{name}_memo_misses']}
+        logger.info(f"🧠 Memo hits of {table_name}: " + ', '.join(
+            f"{name} {m['hits']}/{m['lookups']}" + (f" ({m['hits'] / m['lookups']:.0%})" if m['lookups'] else '')
+            for name, m in memo.items()))
+        self._report(force=True, rows_processed=rows_processed, memo=memo, **progress)
+
+    @staticmethod
+    def _new_counters():
         return {
-            state: self._calculate_color(score, min_score, range_score)
-            for state, score in averages.items()
+            'total': 0,
+            'missing_coords': 0,
+            'no_sentiment': 0,
+            'unknown_state': 0,
+            **dict.fromkeys(MEMO_COUNTERS, 0)
         }
 
-    def _calculate_color(self, score, min_score, range_score):
-        """Convert sentiment score to color: blue(0) -> yellow(0.5) -> red(1)"""
-        if range_score == 0:
-            return '#ffff00'
-        
-        normalized = (score - min_score) / range_score
-        
-        # Первый сегмент: синий (0,0,255) -> голубой (0,255,255)
-        if normalized <= 0.25:
-            ratio = 4 * normalized
-            return f'#00{int(255*ratio):02x}ff'
-        
-        # Второй сегмент: голубой (0,255,255) -> жёлтый (255,255,0)
-        elif normalized <= 0.75:
-            ratio = 2 * (normalized - 0.25)
-            return f'#{int(255*ratio):02x}ff00'
-        
-        # Третий сегмент: жёлтый (255,255,0) -> красный (255,0,0)
-        else:
-            ratio = 2 * (normalized - 0.75)
-            return f'#ff{int(255*(1-ratio)):02x}00'
+    def _add_shards(self, scans, state_totals, counters, stages):
+        """Score raw rows range by range of ids, in the process's shard pool for large tables.
+
+        scans are (table name, stale version, build snapshot) tuples; the
+        shards of all their tables go to one pool, so the partitions of a
+        partitioned table are scanned in parallel. Partial sums and
+        counters of the shards are merged in shard order, so the result is
+        the same for any number of workers. Stage times of worker
+        processes are added up, so they may exceed the wall time. Rows are
+        read from a table's columnar snapshot if it is current, after
+        building it if build snapshot.
+        """
+        shards = []
+        for table_name, stale_version, build_snapshot in scans:
+            id_range = self.db_manager.get_id_range(table_name)
+            if not id_range:
+                continue
+            with stages('snapshot'):
+                use_snapshot = self.db_manager.table_snapshots.get(table_name, build=build_snapshot) is not None
+            first_id, last_id = id_range
+            shards += [(table_name, (start, min(start + self.SHARD_ROWS, last_id + 1)), stale_version, use_snapshot)
+                       for start in range(first_id, last_id + 1, self.SHARD_ROWS)]
+        if not shards:
+            return
+
+        if self.workers <= 1 or len(shards) < self.PARALLEL_MIN_SHARDS:
+            self._merge_shards(((*self._scan_shard(table_name, id_range, stale_version, stages, use_snapshot), {})
+                                for table_name, id_range, stale_version, use_snapshot in shards),
+                               len(shards), state_totals, counters, stages)
+            return
+
+        logger.info(f"⚙️ Scanning {len(shards)} shards of {len(scans)} table(s) in {self.workers} processes")
+        pool = shard_pool(self.db_manager.db_path, self.analyzer, self.locator, self.workers)
+        futures = [pool.submit(_scan_shard, *shard) for shard in shards]
+        try:
+            self._merge_shards((future.result() for future in futures), len(shards), state_totals, counters, stages)
+        except BrokenProcessPool:
+            _drop_shard_pool(pool)
+            raise
+        except BaseException:
+            # E.g. a cancelled job: drop its shards not started yet, the pool is shared
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _scan_shard(self, table_name, id_range, stale_version, stages, use_snapshot=False):
+        """Per-state [sum, count] and counters of one range of ids.
+
+        With stale_version, rows scored by that version are aggregated in
+        SQL and the others scored here, both read from one snapshot.
+        """
+        state_totals = defaultdict(lambda: [0.0, 0])
+        counters = self._new_counters()
+        with self.db_manager.snapshot() as conn:
+            if stale_version:
+                with stages('aggregate'):
+                    self._add_totals(self.db_manager.get_scored_totals(conn, table_name, stale_version, id_range),
+                                     state_totals, counters)
+            columns = self._read_columns(conn, table_name, id_range, stale_version, stages) if use_snapshot else None
+            if columns is not None:
+                counters['total'] += len(columns[0])
+                self._add_pairs(self._process_columns(*columns, counters, stages), state_totals, stages)
+            else:
+                tweets = self.db_manager.get_tweets(table_name, id_range, stale_version, conn=conn)
+                self._add_tweet_stream(self._fetch(tweets, stages), state_totals, counters, stages)
+        return dict(state_totals), counters
+
+    def _read_columns(self, conn, table_name, id_range, stale_version, stages):
+        """Latitudes, longitudes and texts of a shard's rows from the columnar snapshot.
+
+        None if the snapshot doesn't hold the rows conn sees.
+        """
+        table_snapshot = self.db_manager.table_snapshots.get(table_name, conn)
+        if table_snapshot is None:
+            return None
+        with stages('fetch'):
+            if stale_version:
+                try:
+                    positions = table_snapshot.lookup(
+                        self.db_manager.get_stale_ids(conn, table_name, stale_version, id_range))
+                except ValueError:
+                    return None
+            else:
+                positions = table_snapshot.positions(id_range)
+            return (table_snapshot.latitude[positions], table_snapshot.longitude[positions],
+                    table_snapshot.texts(positions))
+
+    def _merge_shards(self, partials, shard_count, state_totals, counters, stages):
+        for done, (shard_totals, shard_counters, shard_seconds) in enumerate(partials, 1):
+            stages.add(shard_seconds)
+            for state, (total, count) in shard_totals.items():
+                state_totals[state][0] += total
+                state_totals[state][1] += count
+            for key, value in shard_counters.items():
+                counters[key] += value
+            self._report(rows_processed=counters['total'], shards_done=done, shards=shard_count)
+
+    @staticmethod
+    def _fetch(batches, stages):
+        """Batches of a database stream, timing the reads"""
+        batches = iter(batches)
+        while True:
+            with stages('fetch'):
+                tweets = next(batches, None)
+            if tweets is None:
+                return
+            yield tweets
+
+    def _add_tweet_stream(self, batches, state_totals, counters, stages):
+        """Fold batches of tweets into the running per-state sums and counts"""
+        for tweets in batches:
+            counters['total'] += len(tweets)
+            self._add_tweets(tweets, state_totals, counters, stages)
+
+    def _add_tweets(self, tweets, state_totals, counters, stages):
+        self._add_pairs(self._process_tweets(tweets, counters, stages), state_totals, stages)
+
+    @staticmethod
+    def _add_pairs(pairs, state_totals, stages):
+        with stages('aggregate'):
+            for state, score in pairs:
+                state_totals[state][0] += score
+                state_totals[state][1] += 1
+
+    def _schedule_backfill(self, table_name):
+        if self.backfiller:
+            self.backfiller.schedule(table_name)
+
+    def _process_tweets(self, tweets, counters, stages):
+        """Score and locate a batch of tweets, returning (state, score) pairs"""
+        return self._process_columns(np.array([tweet.latitude for tweet in tweets], dtype=float),
+                                     np.array([tweet.longitude for tweet in tweets], dtype=float),
+                                     [tweet.text for tweet in tweets], counters, stages)
+
+    def _process_columns(self, latitudes, longitudes, texts, counters, stages):
+        """Score and locate tweets given as columns (NaN for missing coordinates)"""
+        return [(state, score) for _, state, score in self._locate_columns(latitudes, longitudes, texts,
+                                                                           counters, stages)]
+
+    def _locate_columns(self, latitudes, longitudes, texts, counters, stages):
+        """(position, state, score) of the tweets given as columns that have both"""
+        with_coords = np.flatnonzero(~(np.isnan(latitudes) | np.isnan(longitudes))).tolist()
+        counters['missing_coords'] += len(texts) - len(with_coords)
+
+        with stages('tokenize'):
+            scores = self.analyzer.analyze_many([texts[i] for i in with_coords], counters)
+        scored = [(i, score) for i, score in zip(with_coords, scores) if score is not None]
+        counters['no_sentiment'] += len(with_coords) - len(scored)
+
+        try:
+            with stages('locate'):
+                rows = np.array([i for i, _ in scored], dtype=np.int64)
+                states = self.locator.locate_many(latitudes[rows], longitudes[rows], counters)
+        except Exception as e:
+            logger.warning(f"⚠️ Error locating tweets: {str(e)}")
+            states = ['Unknown'] * len(scored)
+
+        located = [(i, state, score) for (i, score), state in zip(scored, states) if state != 'Unknown']
+        counters['unknown_state'] += len(scored) - len(located)
+        return located
+
+    def _generate_output(self, averages):
+        min_score, range_score = color_scale(averages)
+
+        logger.info("🌈 Final color mapping:")
+        for state, score in sorted(averages.items()):
+            logger.info(f"  ▸ {state}: {score:.4f} → {mood_color(score, min_score, range_score)}")
+
+        return state_colors(averages)
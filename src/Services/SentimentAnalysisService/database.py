@@ -1,36 +1,331 @@
 # database.py
-from sqlalchemy import create_engine, inspect, MetaData, Table, select
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from sqlalchemy import select, func, null, or_, update, bindparam, case, true
+from sqlalchemy.exc import OperationalError
+from partitions import create_partition_catalog, read_granularity, read_partitions
+from state_totals import (BUCKET_FORMATS, add_state_totals, clear_state_totals, create_state_totals,
+                          is_internal_table, read_state_rollups, read_state_totals)
+from point_index import create_point_index, has_point_index, in_box, point_index
+from storage import Storage
+from table_snapshot import TableSnapshots, create_table_generations
+from tweet_scores import ensure_score_columns, has_score_columns
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DatabaseManager:
-    def __init__(self, db_path):
-        self.engine = create_engine(f'sqlite:///{db_path}')
-        self.metadata = MetaData()
-        self.inspector = inspect(self.engine)
-        logger.info(f"💾 Database initialized: {db_path}")
+    # Rows fetched from the cursor at a time when streaming a table
+    STREAM_BATCH_SIZE = 10000
+
+    def __init__(self, db_path, stream_batch_size=STREAM_BATCH_SIZE, writable=True):
+        self.db_path = db_path
+        self.stream_batch_size = stream_batch_size
+        # Reads go through the read-only pool; running totals and backfilled
+        # scores through the single writer, which read-only managers
+        # (writable=False, in shard workers) don't have
+        self.storage = Storage(db_path, writable=writable)
+        self.engine = self.storage.reader
+        # Columnar copies of tables, for analyses that score raw rows
+        self.table_snapshots = TableSnapshots(self.storage, Path(db_path).parent / 'TableSnapshots')
+        logger.info(f"💾 Database opened: {db_path}")
+
+    def init_db(self):
+        """Create the running totals, snapshot generation and partition tables if missing.
+
+        Once at service startup, not per instance: shard workers open the
+        database too, and must never wait for an upload's write lock.
+        """
+        create_state_totals(self.storage)
+        create_table_generations(self.storage)
+        create_partition_catalog(self.storage)
+        logger.info(f"💾 Database initialized: {self.db_path}")
+
+    def _reflect(self, table_name):
+        # Cached until the schema changes, e.g. when score columns are added to old tables
+        return self.storage.tables.get(table_name)
 
     def table_exists(self, table_name):
-        exists = self.inspector.has_table(table_name)
+        exists = not is_internal_table(table_name) and (self.storage.tables.has_table(table_name)
+                                                        or self.is_partitioned(table_name))
         logger.info(f"📦 Table '{table_name}' exists: {exists}")
         return exists
 
-    def get_tweets(self, table_name):
+    def is_partitioned(self, table_name):
+        with self.engine.connect() as conn:
+            return read_granularity(conn, table_name) is not None
+
+    def get_partitions(self, table_name, start=None, end=None, conn=None):
+        """Tables holding a table's rows, as (table name, start, end) tuples.
+
+        For a partitioned table, its partitions overlapping the [start, end)
+        window of created_at, in time order, with the range each holds;
+        for a plain table, the table itself with no range (None, None).
+        Reads through conn (a snapshot) if given.
+        """
+        with self._reading(conn) as reader:
+            if read_granularity(reader, table_name) is None:
+                return [(table_name, None, None)]
+            partitions = [(partition, part_start, part_end)
+                          for _, partition, part_start, part_end in read_partitions(reader, table_name, start, end)]
+        logger.info(f"🗂️ Partitions of '{table_name}' from {start} to {end}: {len(partitions)}")
+        return partitions
+
+    @contextmanager
+    def snapshot(self):
+        """Reader connection in a read transaction: all its queries see the same rows"""
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql('BEGIN')
+            yield conn
+
+    def _reading(self, conn=None):
+        return nullcontext(conn) if conn is not None else self.snapshot()
+
+    def get_tweets(self, table_name, id_range=None, stale_version=None, window=None, conn=None):
+        """Stream latitude, longitude and text of rows in batches, in id order.
+
+        id_range limits the rows to first_id <= id < end_id; with
+        stale_version only rows not scored by that model version are read.
+        With a (start, end) created_at window, rows also carry created_at.
+        Rows are read through conn (a snapshot) if given.
+        """
+        table = self._reflect(table_name)
+        columns = [table.c.latitude, table.c.longitude, table.c.text]
+        if window:
+            columns.append(table.c.created_at)
+        query = select(*columns).order_by(table.c.id)
+        query = self._in_ids(query, table, id_range)
+        if stale_version:
+            query = query.where(self._stale(table, stale_version))
+        query = self._in_window(query, table, window)
+        logger.info(f"🔍 Streaming tweets from '{table_name}'")
+        yield from self._stream(query, conn)
+
+    def get_stale_ids(self, conn, table_name, model_version, id_range=None):
+        """Ids of rows in id_range not scored by model_version, in order"""
+        table = self._reflect(table_name)
+        query = select(table.c.id).where(self._stale(table, model_version)).order_by(table.c.id)
+        return conn.execute(self._in_ids(query, table, id_range)).scalars().all()
+
+    def ensure_point_index(self, table_name):
+        """Create the R*Tree point index of a table uploaded before it existed"""
+        with self.engine.connect() as conn:
+            if has_point_index(conn, table_name):
+                return
+        with self.storage.writer.connect() as conn:
+            # Created and filled in one write transaction, not before an upload's rows
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            if create_point_index(conn, table_name):
+                logger.info(f"📍 Point index of '{table_name}' created")
+            conn.commit()
+
+    def get_points(self, table_name, bbox, model_version, limit=None, sample=None):
+        """Stream rows inside a (west, south, east, north) box in batches, through the point index.
+
+        Rows carry id, latitude, longitude, sentiment, state and stale;
+        text is only read for stale rows (not scored by model_version),
+        whose sentiment and state are to be computed by the caller.
+        """
+        table = self._reflect(table_name)
+        index = point_index(table_name)
+        if has_score_columns(table):
+            stale = self._stale(table, model_version)
+            columns = [table.c.sentiment, table.c.state, stale.label('stale'),
+                       case((stale, table.c.text), else_=null()).label('text')]
+        else:
+            columns = [null().label('sentiment'), null().label('state'), true().label('stale'), table.c.text]
+        query = select(table.c.id, table.c.latitude, table.c.longitude, *columns).join_from(
+            index, table, index.c.id == table.c.id)
+        query = in_box(query, table, index, bbox, sample)
+        if limit:
+            query = query.limit(limit)
+        logger.info(f"🔍 Streaming points of '{table_name}' in {bbox}")
+        yield from self._stream(query)
+
+    def get_id_range(self, table_name, conn=None):
+        """Smallest and largest row id, or None for an empty table"""
+        table = self._reflect(table_name)
+        with nullcontext(conn) if conn is not None else self.engine.connect() as conn:
+            first_id, last_id = conn.execute(select(func.min(table.c.id), func.max(table.c.id))).one()
+        return None if first_id is None else (first_id, last_id)
+
+    def get_id_blocks(self, conn, table_name, id_ranges, model_version, window=None):
+        """Rows of each [first_id, end_id) block of ids, as (id range, rows) pairs.
+
+        One range query on the rowid per block, so sampled blocks are read
+        without scanning the table. Rows carry latitude, longitude,
+        sentiment, state and stale, with text only for stale rows, as in
+        get_points; all rows are stale without a model version.
+        """
+        table = self._reflect(table_name)
+        if model_version and has_score_columns(table):
+            stale = self._stale(table, model_version)
+            columns = [table.c.sentiment, table.c.state, stale.label('stale'),
+                       case((stale, table.c.text), else_=null()).label('text')]
+        else:
+            columns = [null().label('sentiment'), null().label('state'), true().label('stale'), table.c.text]
+        query = (select(table.c.latitude, table.c.longitude, *columns)
+                 .where(table.c.id >= bindparam('first_id'), table.c.id < bindparam('end_id')))
+        query = self._in_window(query, table, window)
+        for id_range in id_ranges:
+            yield id_range, conn.execute(query, {'first_id': id_range[0], 'end_id': id_range[1]}).fetchall()
+
+    def _stream(self, query, conn=None):
+        """Yield query rows in batches from one open cursor.
+
+        Only one batch is held in memory at a time, whatever the table size.
+        """
+        retrieved = 0
         try:
-            logger.info(f"🔍 Fetching tweets from '{table_name}'")
-            Session = sessionmaker(bind=self.engine)
-            session = Session()
-            
-            table = Table(table_name, self.metadata, autoload_with=self.engine)
-            result = session.execute(select(table)).fetchall()
-            
-            logger.info(f"📥 Retrieved {len(result)} tweets")
-            return result
+            with nullcontext(conn) if conn is not None else self.engine.connect() as conn:
+                result = conn.execution_options(yield_per=self.stream_batch_size).execute(query)
+                for batch in result.partitions():
+                    retrieved += len(batch)
+                    yield batch
         except Exception as e:
             logger.error(f"🔥 Database error: {str(e)}")
             raise
-        finally:
-            session.close()
\ No newline at end of file
+        logger.info(f"📥 Retrieved {retrieved} tweets")
+
+    def has_score_columns(self, table_name):
+        return has_score_columns(self._reflect(table_name))
+
+    def ensure_score_columns(self, table_name):
+        ensure_score_columns(self.storage.writer, table_name)
+
+    def get_state_totals(self, table_name, model_version):
+        """Per-state sums of rows scored by the given model version.
+
+        Returns (state, sentiment sum, scored rows, all rows) tuples and the
+        number of rows scored by other versions or not scored at all.
+        Running totals kept by uploads are used when they exist; otherwise
+        the table is aggregated and, if no row is stale, the result is
+        stored as its running totals.
+        """
+        with self.engine.connect() as conn:
+            stored = read_state_totals(conn, table_name, model_version)
+        if stored:
+            logger.info(f"🧮 Running totals of '{table_name}': {len(stored)} groups")
+            return stored, 0
+
+        table = self._reflect(table_name)
+        with self.storage.writer.connect() as conn:
+            # Explicit transaction on the writer: the totals must be stored
+            # from the same snapshot they were read from
+            conn.exec_driver_sql('BEGIN')
+            totals = [group[1:] for group in self._scored_groups(conn, table, model_version)]
+            stale = self._count_stale(conn, table, model_version)
+            if totals and not stale:
+                rollups = self._scored_groups(conn, table, model_version, 'hour')
+                self._store_state_totals(conn, table_name, model_version, totals, rollups)
+        logger.info(f"🧮 Aggregated '{table_name}': {len(totals)} groups, {stale} stale rows")
+        return totals, stale
+
+    def get_scored_totals(self, conn, table_name, model_version, id_range=None):
+        """(state, sentiment sum, scored rows, all rows) of rows in id_range scored by model_version"""
+        table = self._reflect(table_name)
+        return [group[1:] for group in self._scored_groups(conn, table, model_version, id_range=id_range)]
+
+    def get_bucket_totals(self, table_name, model_version, bucket=None, window=None, conn=None):
+        """Per-bucket, per-state sums of rows scored by the given model version.
+
+        Returns (bucket, state, sentiment sum, scored rows, all rows) tuples
+        for rows in the (start, end) created_at window, bucketed by 'hour',
+        'day' or not at all (bucket None), and the number of stale rows in
+        the window. Hourly rollups are summed when the table has running
+        totals and the window is made of whole hours; otherwise the rows in
+        the window are aggregated. Reads through conn (a snapshot) if given.
+        """
+        start, end = window or (None, None)
+        whole_hours = all(t is None or t == t.replace(minute=0, second=0, microsecond=0) for t in (start, end))
+        if whole_hours:
+            with self._reading(conn) as reader:
+                if read_state_totals(reader, table_name, model_version):
+                    groups = read_state_rollups(reader, table_name, model_version, bucket, start, end)
+                    logger.info(f"🧮 Rollups of '{table_name}': {len(groups)} groups")
+                    return groups, 0
+
+        table = self._reflect(table_name)
+        with self._reading(conn) as conn:
+            groups = self._scored_groups(conn, table, model_version, bucket, window)
+            stale = self._count_stale(conn, table, model_version, window)
+        logger.info(f"🧮 Aggregated '{table_name}' window: {len(groups)} groups, {stale} stale rows")
+        return groups, stale
+
+    def _scored_groups(self, conn, table, model_version, bucket=None, window=None, id_range=None):
+        """(bucket, state, sentiment sum, scored rows, all rows) of rows scored by model_version"""
+        key = func.strftime(BUCKET_FORMATS[bucket], table.c.created_at) if bucket else null()
+        query = (select(key, table.c.state, func.sum(table.c.sentiment), func.count(table.c.sentiment), func.count())
+                 .where(table.c.model_version == model_version)
+                 .group_by(*([key] if bucket else []), table.c.state))
+        query = self._in_ids(query, table, id_range)
+        return conn.execute(self._in_window(query, table, window)).fetchall()
+
+    def _count_stale(self, conn, table, model_version, window=None):
+        query = select(func.count()).select_from(table).where(self._stale(table, model_version))
+        return conn.execute(self._in_window(query, table, window)).scalar()
+
+    @staticmethod
+    def _store_state_totals(conn, table_name, model_version, totals, rollups):
+        try:
+            clear_state_totals(conn, table_name)
+            add_state_totals(
+                conn, table_name, model_version,
+                {state: [score_sum or 0.0, scored, rows] for state, score_sum, scored, rows in totals},
+                {(hour, state): [score_sum or 0.0, scored, rows] for hour, state, score_sum, scored, rows in rollups}
+            )
+            conn.commit()
+        except OperationalError as e:
+            # A writer got in first: its commit would make these totals stale anyway
+            conn.rollback()
+            logger.warning(f"⚠️ Running totals of '{table_name}' not stored: {str(e)}")
+
+    def get_stale_tweets(self, table_name, model_version, limit=None):
+        """Rows not scored by the given model version"""
+        table = self._reflect(table_name)
+        query = (select(table.c.id, table.c.latitude, table.c.longitude, table.c.text)
+                 .where(self._stale(table, model_version)))
+        if limit:
+            query = query.limit(limit)
+        with self.engine.connect() as conn:
+            return conn.execute(query).fetchall()
+
+    def update_scores(self, table_name, rows):
+        """Write sentiment/state/model_version of rows identified by id.
+
+        Drops the table's running totals, which no longer match its rows.
+        """
+        table = self._reflect(table_name)
+        statement = (update(table)
+                     .where(table.c.id == bindparam('row_id'))
+                     .values(sentiment=bindparam('sentiment'), state=bindparam('state'),
+                             model_version=bindparam('model_version')))
+        with self.storage.writer.begin() as conn:
+            conn.execute(statement, [
+                {'row_id': row['id'], 'sentiment': row['sentiment'], 'state': row['state'],
+                 'model_version': row['model_version']}
+                for row in rows
+            ])
+            clear_state_totals(conn, table_name)
+
+    @staticmethod
+    def _in_ids(query, table, id_range):
+        """Restrict a query to rows with first_id <= id < end_id"""
+        if id_range:
+            query = query.where(table.c.id >= id_range[0], table.c.id < id_range[1])
+        return query
+
+    @staticmethod
+    def _in_window(query, table, window):
+        """Restrict a query to rows with start <= created_at < end"""
+        start, end = window or (None, None)
+        if start:
+            query = query.where(table.c.created_at >= start)
+        if end:
+            query = query.where(table.c.created_at < end)
+        return query
+
+    @staticmethod
+    def _stale(table, model_version):
+        return or_(table.c.model_version.is_(None), table.c.model_version != model_version)
@@ -0,0 +1,31 @@
+# gunicorn.conf.py
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('FLASK_RUN_PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# ANALYSIS_WORKERS shard processes are shared out between the workers (config.py)
+os.environ['ANALYSIS_SERVER_WORKERS'] = str(workers)
+
+# Import app.py (and load the models) once in the master before forking
+preload_app = True
+
+# Workers share their metrics through files, so /metrics reports all of them
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'tweetmood-metrics'))
+
+
+def on_starting(server):
+    from metrics import registry
+    registry.reset_shared()
+
+
+def post_fork(server, worker):
+    from app import controller, job_queue
+    controller.dispose_connections()
+    job_queue.storage.dispose(close=False)
+    # Job worker threads run in workers, never in the master
+    job_queue.start()
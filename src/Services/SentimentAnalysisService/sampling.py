@@ -0,0 +1,128 @@
+# sampling.py
+"""
+Random samples of id blocks, and per-state mean sentiment estimated from them.
+
+A table's id range is cut into blocks of consecutive ids, read in a
+random order without replacement, each with one range query on the rowid
+(no ORDER BY RANDOM() scan of the table). Every row lies in exactly one
+block, so rows are sampled uniformly; rows of one block are sampled
+together, so the estimates treat blocks as clusters: a state's mean is
+the ratio of its sentiment sum to its scored tweets over the sampled
+blocks, and its variance is that of the ratio estimator over blocks, with
+the finite population correction (zero once every block is read).
+Intervals use Student's t with one degree of freedom less than the blocks
+a state was seen in, as a state found in few blocks is estimated from few
+clusters, however many tweets they hold.
+"""
+
+from collections import defaultdict
+from math import pi, sqrt, tan
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def t_quantile(p: float, df: int) -> float:
+    """Quantile of Student's t: exact for 1 and 2 degrees of freedom, Cornish-Fisher expansion above"""
+    if df == 1:
+        return tan(pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / sqrt(2 * p * (1 - p))
+    x = NormalDist().inv_cdf(p)
+    terms = ((x ** 3 + x) / 4,
+             (5 * x ** 5 + 16 * x ** 3 + 3 * x) / 96,
+             (3 * x ** 7 + 19 * x ** 5 + 17 * x ** 3 - 15 * x) / 384,
+             (79 * x ** 9 + 776 * x ** 7 + 1482 * x ** 5 - 1920 * x ** 3 - 945 * x) / 92160)
+    return x + sum(term / df ** power for power, term in enumerate(terms, 1))
+
+
+class BlockSample:
+    """Id blocks of one or more tables (e.g. partitions) in a random order.
+
+    Args:
+        id_ranges: (table name, (first id, last id)) of each table
+        block_ids: Ids per block
+        seed: Seed of the order; random if None
+    """
+
+    def __init__(self, id_ranges: List[Tuple[str, Tuple[int, int]]], block_ids: int, seed: Optional[int] = None):
+        self.tables = [table_name for table_name, _ in id_ranges]
+        self.first_ids = np.array([first_id for _, (first_id, _) in id_ranges], dtype=np.int64)
+        self.last_ids = np.array([last_id for _, (_, last_id) in id_ranges], dtype=np.int64)
+        self.block_ids = block_ids
+        counts = (self.last_ids - self.first_ids) // block_ids + 1
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.order = np.random.default_rng(seed).permutation(int(self.offsets[-1]))
+        self.taken = 0
+
+    @property
+    def blocks(self) -> int:
+        return len(self.order)
+
+    @property
+    def fraction(self) -> float:
+        return self.taken / self.blocks if self.blocks else 1.0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.taken >= self.blocks
+
+    def take(self, count: int) -> List[Tuple[str, Tuple[int, int]]]:
+        """The next count blocks as (table name, (first id, end id)), in table and id order"""
+        chosen = np.sort(self.order[self.taken:self.taken + count])
+        self.taken += len(chosen)
+        tables = np.searchsorted(self.offsets, chosen, side='right') - 1
+        starts = self.first_ids[tables] + (chosen - self.offsets[tables]) * self.block_ids
+        ends = np.minimum(starts + self.block_ids, self.last_ids[tables] + 1)
+        return [(self.tables[table], (int(start), int(end))) for table, start, end in zip(tables, starts, ends)]
+
+
+class StateEstimates:
+    """Running block sums of each state's sentiment (y) and scored tweets (n).
+
+    Per state: sum of y, sum of n, the sums of y*y, n*n and y*n that the
+    variance of the ratio estimator needs, and the number of blocks it was
+    seen in. Blocks without tweets of a state count as zeros for it.
+    """
+
+    def __init__(self):
+        self.blocks = 0
+        self._sums = defaultdict(lambda: [0.0, 0, 0.0, 0, 0.0, 0])
+
+    def add_block(self, pairs):
+        """Add one sampled block's (state, sentiment) pairs"""
+        block = defaultdict(lambda: [0.0, 0])
+        for state, score in pairs:
+            block[state][0] += score
+            block[state][1] += 1
+        for state, (y, n) in block.items():
+            sums = self._sums[state]
+            sums[0] += y
+            sums[1] += n
+            sums[2] += y * y
+            sums[3] += n * n
+            sums[4] += y * n
+            sums[5] += 1
+        self.blocks += 1
+
+    def estimates(self, confidence: float, fraction: float) -> Dict[str, Tuple[float, Optional[float], int]]:
+        """(mean, half width of the confidence interval, sampled tweets) per state.
+
+        confidence is the level of the intervals and fraction the share of
+        blocks sampled. The half width is None for a state seen in fewer
+        than two blocks, whose variance can't be estimated.
+        """
+        m = self.blocks
+        results = {}
+        for state, (y, n, yy, nn, yn, seen) in self._sums.items():
+            mean = y / n
+            half_width = None
+            if fraction >= 1:
+                half_width = 0.0
+            elif seen > 1:
+                residuals = max(yy - 2 * mean * yn + mean * mean * nn, 0.0)
+                variance = (1 - fraction) * m * residuals / ((m - 1) * n * n)
+                half_width = t_quantile((1 + confidence) / 2, seen - 1) * sqrt(variance)
+            results[state] = (mean, half_width, n)
+        return results
@@ -0,0 +1,52 @@
+# score_backfill.py
+import logging
+import threading
+
+from tweet_scores import score_rows
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ScoreBackfiller:
+    """Rescores rows written by older (or no) models in background threads.
+
+    At most one backfill runs per table in this process. Rows are updated
+    in batches, each scored with the models current at that moment.
+    """
+
+    def __init__(self, db_manager, models, batch_size=2000):
+        self.db_manager = db_manager
+        self.models = models
+        self.batch_size = batch_size
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, table_name):
+        with self._lock:
+            if table_name in self._running:
+                return
+            self._running.add(table_name)
+        threading.Thread(target=self._run, args=(table_name,), daemon=True).start()
+
+    def _run(self, table_name):
+        updated = 0
+        try:
+            self.db_manager.ensure_score_columns(table_name)
+            while True:
+                models = self.models.get()
+                stale = self.db_manager.get_stale_tweets(table_name, models.version, self.batch_size)
+                if not stale:
+                    break
+                rows = score_rows(models, [
+                    {'id': row.id, 'latitude': row.latitude, 'longitude': row.longitude, 'text': row.text}
+                    for row in stale
+                ])
+                self.db_manager.update_scores(table_name, rows)
+                updated += len(rows)
+            logger.info(f"🧵 Backfilled {updated} rows of '{table_name}'")
+        except Exception as e:
+            logger.error(f"🔥 Backfill of '{table_name}' stopped after {updated} rows: {str(e)}")
+        finally:
+            with self._lock:
+                self._running.discard(table_name)
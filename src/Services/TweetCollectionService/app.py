@@ -4,23 +4,43 @@ This module initializes the Flask application, configures the database,
 and registers API blueprints.
 """
 
+import sys
+from pathlib import Path
+
+# Shared modules are copied next to the service in containers; locally they
+# live in src/Services/Common
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Common'))
+
 from flask import Flask
 from flask_cors import CORS
-from routes import upload_blueprint
+from routes import upload_blueprint, upload_jobs
 from database import init_db
+from http_cache import compress_app
+from jobs import jobs_blueprint
+from metrics import instrument_app
+from profiling import profile_app
 import logging
 
 
 app = Flask(__name__)
 CORS(app)
 app.register_blueprint(upload_blueprint)
+app.register_blueprint(jobs_blueprint(upload_jobs))
+instrument_app(app)
+compress_app(app)
+profile_app(app)
 
 logging.basicConfig(level=logging.INFO)
 
 def initialize_app():
-    """Initialize the application context and database connection."""
+    """Initialize the application context and database connection.
+
+    Also starts the upload job workers, which resume jobs left queued or
+    interrupted by a restart.
+    """
     with app.app_context():
         init_db()
+    upload_jobs.start()
 
 
 initialize_app()
@@ -0,0 +1,30 @@
+# config.py
+"""
+Configuration module with file locations used by the service.
+
+Paths default to the shared Docker volumes and can be overridden through
+environment variables for local runs.
+"""
+
+import os
+from pathlib import Path
+
+
+class Config:
+    """File locations for the Tweet Collection Service.
+
+    Attributes:
+        db_path (Path): SQLite database with tweet tables
+        sentiments_path (Path): Sentiment lexicon CSV
+        states_path (Path): State geometries JSON
+        snapshot_path (Path): Compiled model snapshot
+        jobs_path (Path): SQLite database of upload and analysis jobs
+    """
+
+    def __init__(self):
+        self.db_path = Path(os.environ.get('TWEETS_DB_PATH', '/src/Services/DataBase/DataTweets.db'))
+        data_dir = Path(os.environ.get('DATA_DIR', '/Data'))
+        self.sentiments_path = data_dir / 'sentiments.csv'
+        self.states_path = data_dir / 'states.json'
+        self.snapshot_path = self.db_path.parent / 'ModelSnapshot.bin'
+        self.jobs_path = self.db_path.parent / 'Jobs.db'
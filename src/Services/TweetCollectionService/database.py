@@ -4,29 +4,50 @@ Database module for SQLAlchemy configuration and operations.
 Contains database engine setup, session management, and table creation logic.
 """
 
-from sqlalchemy import create_engine, Column, Integer, Float, DateTime, String, inspect
+from sqlalchemy import Column, Integer, Float, DateTime, String, Index
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
+from config import Config
+from partitions import create_partition_catalog, read_granularity, read_topics
+from point_index import create_point_index, has_point_index, point_index_name
+from result_cache import ResultCache
+from state_totals import clear_state_totals, create_state_totals, is_internal_table
+from storage import Storage
+from table_snapshot import bump_generation, create_table_generations
+from tweet_scores import created_at_index, ensure_score_columns, score_index
 import os
 
 
-db_path = '/src/Services/DataBase/DataTweets.db'
+config = Config()
+db_path = str(config.db_path)
 db_dir = os.path.dirname(db_path)
 
 
 os.makedirs(db_dir, exist_ok=True)
 
 Base = declarative_base()
-engine = create_engine(f'sqlite:///{db_path}', connect_args={'check_same_thread': False})
+# Uploads write through the single writer connection, one at a time;
+# table listings and checks use the read-only pool
+storage = Storage(db_path)
+engine = storage.writer
 Session = scoped_session(sessionmaker(bind=engine))
+result_cache = ResultCache(os.path.join(db_dir, 'ResultCache.db'))
 
 def init_db():
     """Initialize database schema.
 
-    Creates all defined tables if they don't exist.
-    Should be called once at application startup.
+    Creates all defined tables if they don't exist, with the running
+    totals, snapshot generations, partition catalog and result cache
+    tables. Should be called once at application startup: importing
+    this module doesn't touch the schema, so processes importing it
+    (e.g. upload parser workers) never wait for the write lock.
     """
-    Base.metadata.create_all(bind=engine)
+    storage.create_all(Base.metadata)
+    create_state_totals(storage)
+    create_table_generations(storage)
+    create_partition_catalog(storage)
+    result_cache.init_db()
     print(f"Database initialized successfully at {db_path}")
 
 def table_exists(table_name: str) -> bool:
@@ -38,43 +59,210 @@ def table_exists(table_name: str) -> bool:
     Returns:
         bool: True if table exists, False otherwise
     """
-    return inspect(engine).has_table(table_name)
+    return storage.tables.has_table(table_name)
+
+def content_key_index(table_name: str) -> Index:
+    """Unique index identifying a tweet by coordinates, timestamp, text hash and occurrence.
 
-def create_table(table_name: str):
-    """Create dynamic ORM model for specified table name.
-    
     Args:
-        table_name (str): Name for the new table
-        
+        table_name (str): Name of the tweet table
+
+    Returns:
+        Index: Index over latitude, longitude, created_at, text_hash and
+        occurrence
+    """
+    return Index(f'ux_{table_name}_content', 'latitude', 'longitude', 'created_at', 'text_hash', 'occurrence',
+                 unique=True)
+
+def ensure_content_key(table_name: str):
+    """Add the text_hash and occurrence columns and the content key index to an older table.
+
+    Rows stored before the hash keep a NULL one, which the index doesn't
+    constrain, until an append keys them.
+
+    Args:
+        table_name (str): Name of an existing tweet table
+    """
+    columns = storage.tables.get(table_name).c
+    with engine.begin() as conn:
+        for column, definition in (('text_hash', 'VARCHAR(16)'), ('occurrence', 'INTEGER NOT NULL DEFAULT 0')):
+            if column in columns:
+                continue
+            try:
+                conn.exec_driver_sql(f'ALTER TABLE "{table_name}" ADD COLUMN {column} {definition}')
+            except OperationalError as e:
+                if 'duplicate column' not in str(e):
+                    raise
+            if column == 'occurrence':
+                # The key of tables from before the column doesn't include it
+                drop_content_key(conn, table_name)
+        conn.exec_driver_sql(
+            f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{table_name}_content" '
+            f'ON "{table_name}" (latitude, longitude, created_at, text_hash, occurrence)'
+        )
+
+def drop_content_key(conn, table_name: str):
+    """Drop a table's content key index, so rows can be written without it.
+
+    Args:
+        conn (Connection): Writer connection of an open transaction
+        table_name (str): Name of the tweet table
+    """
+    conn.exec_driver_sql(f'DROP INDEX IF EXISTS "ux_{table_name}_content"')
+
+def build_content_key(conn, table_name: str):
+    """Number repeated tweets and (re)create a table's content key index.
+
+    Rows with the same coordinates, timestamp and text hash are numbered
+    by id: the first keeps occurrence 0, its copies get 1, 2, ... Appends
+    insert occurrence 0, so they skip every tweet already stored.
+
+    Args:
+        conn (Connection): Writer connection of an open transaction
+        table_name (str): Name of the tweet table
+    """
+    drop_content_key(conn, table_name)
+    conn.exec_driver_sql(
+        f'UPDATE "{table_name}" SET occurrence = copies.occurrence '
+        f'FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY latitude, longitude, created_at, text_hash '
+        f'ORDER BY id) - 1 AS occurrence FROM "{table_name}") AS copies '
+        f'WHERE "{table_name}".id = copies.id AND "{table_name}".occurrence != copies.occurrence'
+    )
+    conn.exec_driver_sql(
+        f'CREATE UNIQUE INDEX "ux_{table_name}_content" '
+        f'ON "{table_name}" (latitude, longitude, created_at, text_hash, occurrence)'
+    )
+
+def tweet_model(table_name: str):
+    """Dynamic ORM model of a tweet table, without creating the table.
+
+    Args:
+        table_name (str): Name of the tweet table
+
     Returns:
         DeclarativeMeta: SQLAlchemy model class with:
         - id (primary key)
         - latitude (float)
         - longitude (float)
-        - created_at (datetime)
+        - created_at (datetime, indexed)
         - text (varchar 500)
+        - sentiment, state, model_version: scores computed at upload time
+          (indexed together)
+        - text_hash, occurrence: the unique content key used to skip
+          tweets already stored; occurrence numbers repeated tweets
     """
+    # A fresh Table each time: extending the old one would add its indexes twice
+    if table_name in Base.metadata.tables:
+        Base.metadata.remove(Base.metadata.tables[table_name])
+
     class Tweet(Base):
         __tablename__ = table_name
-        __table_args__ = {'extend_existing': True}
+        __table_args__ = (score_index(table_name), content_key_index(table_name),
+                          created_at_index(table_name), {'extend_existing': True})
         
         id = Column(Integer, primary_key=True)
         latitude = Column(Float, nullable=False)
         longitude = Column(Float, nullable=False)
         created_at = Column(DateTime, nullable=False)
         text = Column(String(500), nullable=False)
+        sentiment = Column(Float, nullable=True)
+        state = Column(String(8), nullable=True)
+        model_version = Column(String(16), nullable=True)
+        text_hash = Column(String(16), nullable=True)
+        occurrence = Column(Integer, nullable=False, default=0, server_default='0')
 
+    return Tweet
+
+def create_table(table_name: str):
+    """Create dynamic ORM model for specified table name.
+    
+    Args:
+        table_name (str): Name for the new table
+        
+    Returns:
+        DeclarativeMeta: SQLAlchemy model class (see tweet_model); score
+        columns and the content key are added to tables created before
+        them. The table's R*Tree point index is created with it (and
+        filled, for tables from before the index).
+    """
+    Tweet = tweet_model(table_name)
     if not table_exists(table_name):
-        Base.metadata.create_all(bind=engine, tables=[Tweet.__table__])
+        storage.create_all(Base.metadata, tables=[Tweet.__table__])
+    else:
+        ensure_score_columns(engine, table_name)
+        ensure_content_key(table_name)
+    with storage.reader.connect() as conn:
+        indexed = has_point_index(conn, table_name)
+    if not indexed:
+        # Created and filled in one write transaction: rows of an upload
+        # committed in between would be indexed twice
+        with engine.connect() as conn:
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            create_point_index(conn, table_name)
+            conn.commit()
     
     return Tweet
 
+def create_partition(conn, table_name: str):
+    """Create a partition table and its point index in the caller's transaction.
+
+    Args:
+        conn (Connection): Writer connection of an open upload transaction
+        table_name (str): Name of the partition table
+
+    Returns:
+        DeclarativeMeta: SQLAlchemy model class of the partition
+    """
+    Tweet = tweet_model(table_name)
+    Tweet.__table__.create(conn)
+    create_point_index(conn, table_name)
+    return Tweet
+
+def drop_tweet_table(conn, table_name: str):
+    """Drop a tweet table with its point index and running totals.
+
+    The table's snapshot generation is bumped rather than dropped, so a
+    snapshot of the old table is never taken for a new one of that name.
+
+    Args:
+        conn (Connection): Writer connection of an open transaction
+        table_name (str): Name of the table
+    """
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{point_index_name(table_name)}"')
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{table_name}"')
+    clear_state_totals(conn, table_name)
+    bump_generation(conn, table_name)
+
+def get_partitioning(table_name: str):
+    """Granularity of a partitioned table.
+
+    Args:
+        table_name (str): Table name
+
+    Returns:
+        Optional[str]: 'day' or 'month', or None for a plain or missing table
+    """
+    with storage.reader.connect() as conn:
+        return read_granularity(conn, table_name)
+
+def get_tables_version() -> int:
+    """Token of the set of tables, changed whenever one is created or dropped.
+
+    Returns:
+        int: SQLite schema version of the database
+    """
+    return storage.tables.schema_version()
+
 def get_all_tables():
     """Retrieve list of all user-created table names in the database.
 
+    Partitioned tables are listed by their own name, not their
+    partitions' (which are internal tables).
+
     Returns:
-        List[str]: Names of all application tables excluding system tables
+        List[str]: Names of all application tables excluding system and
+        internal tables
     """
-    inspector = inspect(engine)
-    all_tables = inspector.get_table_names()
-    return [table for table in all_tables if not table.startswith('sqlite_')]
\ No newline at end of file
+    with storage.reader.connect() as conn:
+        topics = read_topics(conn)
+    return sorted([table for table in storage.tables.table_names() if not is_internal_table(table)] + topics)
\ No newline at end of file
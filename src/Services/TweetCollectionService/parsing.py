@@ -0,0 +1,106 @@
+# parsing.py
+"""
+Parsing and scoring of tweet lines, for upload parser processes.
+
+Kept apart from services.py so that parser processes, and the fork server
+preloading this module, import nothing that opens the database: an upload
+holds the database's write lock while its lines are parsed.
+"""
+
+import hashlib
+import re
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from exceptions import InvalidDataFormatError
+from tweet_scores import score_rows
+
+LINE_PATTERN = re.compile(r"""
+    ^\[(-?\d+\.\d+),\s*(-?\d+\.\d+)\]\s+_
+    \s+(\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}:\d{2})\s+(.*)$
+""", re.VERBOSE)
+
+# Models handed to parser processes by the pool initializer
+_worker_models = None
+
+
+def text_hash(text: str) -> str:
+    """Short digest of a tweet's text, part of its content key."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def init_parser_worker(models):
+    """Pool initializer: keep the models of the current upload."""
+    global _worker_models
+    _worker_models = models
+
+
+def parse_chunk(chunk: Tuple[int, List[str]], models=None) -> Tuple[List[Dict], List[str]]:
+    """Parse and score a run of consecutive lines.
+
+    Runs in parser worker processes, or in the request process for small
+    files.
+
+    Args:
+        chunk: Number of the first line and the lines themselves
+        models (Models): Models to score with; the worker's if omitted
+
+    Returns:
+        Tuple of parsed rows and line-numbered error messages
+    """
+    first_line_num, lines = chunk
+    rows, errors = [], []
+    for line_num, line in enumerate(lines, first_line_num):
+        try:
+            row = parse_line(line)
+        except InvalidDataFormatError as e:
+            errors.append(f"Line {line_num}: {str(e)}")
+            continue
+        row['text_hash'] = text_hash(row['text'])
+        rows.append(row)
+    return score_rows(models or _worker_models, rows), errors
+
+
+def parse_line(line: str) -> Dict:
+    """Parse single line of tweet data.
+
+    Args:
+        line (str): Raw input line from file
+
+    Returns:
+        Dict: Parsed tweet data with keys:
+        - latitude (float)
+        - longitude (float)
+        - created_at (datetime)
+        - text (str)
+
+    Raises:
+        InvalidDataFormatError: For any parsing or validation failure
+    """
+    line = line.strip()
+    match = LINE_PATTERN.match(line)
+
+    if not match:
+        raise InvalidDataFormatError("Invalid line format")
+
+    try:
+        lat = float(match.group(1))
+        lon = float(match.group(2))
+        dt = datetime.strptime(match.group(3), '%Y-%m-%d %H:%M:%S')
+        text = match.group(4).strip()
+
+        if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+            raise ValueError("Invalid coordinates")
+
+        if not text or len(text) > 500:
+            raise ValueError("Invalid text content")
+
+        return {
+            'latitude': lat,
+            'longitude': lon,
+            'created_at': dt,
+            'text': text
+        }
+
+    except ValueError as e:
+        raise InvalidDataFormatError(str(e))
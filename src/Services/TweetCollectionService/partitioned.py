@@ -0,0 +1,254 @@
+# partitioned.py
+"""
+Uploads to date-partitioned tables.
+
+A partitioned table (see partitions.py) is created by an upload with the
+form field partition=day or partition=month; later uploads to it keep its
+granularity. Each row goes to the partition of its created_at, created on
+first use in the upload's transaction. Content keys, point indexes,
+running totals and snapshot generations are kept per partition, as for a
+plain table.
+
+Modes:
+- replace: drops every partition of the table (and a plain table of that
+  name, which the partitions replace) before writing;
+- append: adds tweets not stored yet;
+- replace_partitions: drops only the partitions the upload has rows for,
+  so a day or month is reloaded without touching the others.
+
+drop_partitions() removes whole partitions, e.g. for retention, with one
+DROP TABLE each instead of deleting their rows.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from database import (build_content_key, create_partition, drop_content_key, drop_tweet_table, engine,
+                      get_partitioning, result_cache, storage, table_exists, tweet_model)
+from exceptions import InvalidFileError
+from partitions import (PARTITION_FORMATS, add_partition, add_topic, partition_name, period_of, read_partitions,
+                        remove_partitions)
+from services import FileProcessingService
+from state_totals import add_state_totals, clear_state_totals
+from table_snapshot import bump_generation
+
+
+def _has_table(conn, table_name: str) -> bool:
+    """Whether a table exists, as seen by conn's transaction"""
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                        {'name': table_name}).first() is not None
+
+
+class _Partition:
+    """A partition written by an upload, with the totals of the rows written to it"""
+    __slots__ = ('table_name', 'table', 'keep_totals', 'totals', 'rollups')
+
+    def __init__(self, table_name, table, keep_totals):
+        self.table_name = table_name
+        self.table = table
+        self.keep_totals = keep_totals
+        self.totals = {}
+        self.rollups = {}
+
+
+class PartitionedUploadService(FileProcessingService):
+    """Writes each uploaded row to the day or month partition of its created_at.
+
+    Attributes:
+        granularity (str): 'day' or 'month'
+        partitions (Dict[str, _Partition]): Partitions written so far, by period
+    """
+
+    MODES = FileProcessingService.MODES + ('replace_partitions',)
+
+    def __init__(self, filename: str, mode: str = 'replace', partition: Optional[str] = None, **options):
+        """Initialize processing service for a file uploaded to a partitioned table.
+
+        Args:
+            filename (str): Original name of the uploaded file
+            mode (str): Upload mode, one of MODES
+            partition (str): 'day' or 'month' to partition a new or replaced
+                table by; the table's own granularity if omitted
+            **options: batch_size, chunk_size and workers, as for
+                FileProcessingService
+
+        Raises:
+            InvalidFileError: For an unknown mode or granularity, a name
+            without any letters or digits, or a table that isn't
+            partitioned (that way) and isn't replaced
+        """
+        self.partition = partition
+        self.partitions: Dict[str, _Partition] = {}
+        self.model_version = None
+        super().__init__(filename, mode, **options)
+
+    def _open_table(self):
+        """Check the granularity; partitions are created as rows arrive.
+
+        Returns:
+            None: There is no table of the upload's name
+        """
+        if self.partition is not None and self.partition not in PARTITION_FORMATS:
+            raise InvalidFileError(f"Unknown partition granularity '{self.partition}'")
+        current = get_partitioning(self.table_name)
+        self.granularity = self.partition or current
+        if self.granularity is None:
+            raise InvalidFileError(f"Table '{self.table_name}' is not partitioned")
+        if self.mode != 'replace':
+            if current is None and table_exists(self.table_name):
+                raise InvalidFileError(f"Table '{self.table_name}' is not partitioned; replace it to partition it")
+            if current and current != self.granularity:
+                raise InvalidFileError(f"Table '{self.table_name}' is partitioned by {current}")
+        return None
+
+    def process_file(self, file, progress=None) -> Dict:
+        """Process uploaded file and store its rows in their partitions.
+
+        See FileProcessingService.process_file; all partitions are written
+        in one transaction.
+
+        Returns:
+            Dict: Processing results as for plain tables, with:
+            - partitions: Periods the upload wrote to
+        """
+        result = super().process_file(file, progress)
+        result['partitions'] = sorted(self.partitions)
+        return result
+
+    def _prepare_table(self, model_version: str) -> bool:
+        """Register the table as partitioned and drop what replace mode replaces.
+
+        The catalog is written first, so the upload transaction holds the
+        write lock from its first statement, as for plain tables.
+
+        Returns:
+            bool: Always True; whether totals are kept is decided per
+            partition (see _partition)
+        """
+        conn = self.session.connection()
+        add_topic(conn, self.table_name, self.granularity)
+        if self.mode == 'replace':
+            for _, table_name, _, _ in read_partitions(conn, self.table_name):
+                drop_tweet_table(conn, table_name)
+            remove_partitions(conn, self.table_name)
+            if _has_table(conn, self.table_name):
+                drop_tweet_table(conn, self.table_name)
+        self.model_version = model_version
+        return True
+
+    def _partition(self, period: str) -> _Partition:
+        """The partition of a period, created (or, replacing partitions, recreated) on first use"""
+        partition = self.partitions.get(period)
+        if partition is not None:
+            return partition
+
+        conn = self.session.connection()
+        table_name = partition_name(self.table_name, period)
+        exists = _has_table(conn, table_name)
+        if exists and self.mode == 'replace_partitions':
+            drop_tweet_table(conn, table_name)
+            exists = False
+        add_partition(conn, self.table_name, self.granularity, period)
+        if exists:
+            table = tweet_model(table_name).__table__
+            # Totals of other model versions can't be extended with these rows
+            clear_state_totals(conn, table_name, keep_version=self.model_version)
+            keep_totals = self._totals_cover(table, table_name, self.model_version)
+        else:
+            table = create_partition(conn, table_name).__table__
+            keep_totals = True
+            if self.mode != 'append':
+                # Keyed before commit, as replaced plain tables are
+                drop_content_key(conn, table_name)
+        partition = self.partitions[period] = _Partition(table_name, table, keep_totals)
+        return partition
+
+    def _insert_batch(self, rows, totals: Dict, rollups: Dict) -> int:
+        """Write parsed rows to their partitions, appends skipping stored tweets.
+
+        Written rows are added to their partition's totals; totals and
+        rollups of the whole table are not kept.
+
+        Returns:
+            int: Number of rows written
+        """
+        by_period = {}
+        for row in rows:
+            by_period.setdefault(period_of(self.granularity, row['created_at']), []).append(row)
+        inserted = 0
+        for period, period_rows in by_period.items():
+            partition = self._partition(period)
+            written = self._write_rows(partition.table, partition.table_name, period_rows)
+            self._accumulate(written, partition.totals, partition.rollups)
+            inserted += len(written)
+        return inserted
+
+    def _update_table_state(self, model_version: str, keep_totals: bool, totals: Dict, rollups: Dict):
+        """Add each written partition's rows to its stored totals and mark it changed"""
+        for partition in self.partitions.values():
+            if partition.keep_totals:
+                add_state_totals(self.session, partition.table_name, model_version,
+                                 partition.totals, partition.rollups)
+            if self.mode != 'append':
+                build_content_key(self.session.connection(), partition.table_name)
+            bump_generation(self.session, partition.table_name)
+
+
+def upload_service(filename: str, mode: str = 'replace', partition: Optional[str] = None,
+                   **options) -> FileProcessingService:
+    """Processing service of an upload: partitioned if asked to or if its table is.
+
+    Args:
+        filename (str): Original name of the uploaded file
+        mode (str): Upload mode
+        partition (str): Optional granularity, 'day' or 'month'
+        **options: batch_size, chunk_size and workers
+
+    Returns:
+        FileProcessingService: The service, a PartitionedUploadService for
+        partitioned tables
+    """
+    if partition or get_partitioning(FileProcessingService._sanitize_filename(filename)):
+        return PartitionedUploadService(filename, mode, partition, **options)
+    return FileProcessingService(filename, mode, **options)
+
+
+def list_partitions(table_name: str) -> List[Dict]:
+    """Partitions of a partitioned table, in time order.
+
+    Returns:
+        List[Dict]: period, table and the [start, end) of created_at of
+        each partition
+    """
+    with storage.reader.connect() as conn:
+        return [{'period': period, 'table': partition_table, 'start': start.isoformat(), 'end': end.isoformat()}
+                for period, partition_table, start, end in read_partitions(conn, table_name)]
+
+
+def drop_partitions(table_name: str, periods: Optional[List[str]] = None,
+                    before: Optional[datetime] = None) -> List[str]:
+    """Drop whole partitions of a partitioned table.
+
+    Args:
+        table_name (str): Partitioned table
+        periods (List[str]): Periods to drop
+        before (datetime): Also drop partitions holding only tweets created
+            before it
+
+    Returns:
+        List[str]: Periods dropped
+    """
+    with engine.connect() as conn:
+        # Read and drop in one write transaction, safe from concurrent uploads
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        dropped = [(period, partition_table) for period, partition_table, _, end in read_partitions(conn, table_name)
+                   if period in (periods or ()) or (before is not None and end <= before)]
+        for _, partition_table in dropped:
+            drop_tweet_table(conn, partition_table)
+        remove_partitions(conn, table_name, [period for period, _ in dropped])
+        conn.commit()
+    if dropped:
+        result_cache.bump_version(table_name)
+    return [period for period, _ in dropped]
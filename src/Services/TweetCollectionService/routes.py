@@ -3,24 +3,92 @@
 API routes module for handling file uploads.
 
 Contains the blueprint definition and route handlers for the upload endpoint.
+/upload runs its upload job in the request; /jobs/upload queues it to run
+in the background.
+Streamed tweets and the live map of a table are served by /stream routes,
+partitions of partitioned tables by /tables/<table>/partitions.
 """
 
-from flask import Blueprint, request, jsonify, current_app
-from services import FileProcessingService
-from database import get_all_tables
-from exceptions import InvalidFileError, DataProcessingError
+import os
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, current_app
+from partitioned import drop_partitions, list_partitions, upload_service
+from streaming import StreamIngestService, live_map
+from database import config, get_all_tables, get_partitioning, get_tables_version, table_exists
+from http_cache import make_etag, not_modified
+from exceptions import InvalidFileError, InvalidDataFormatError, DataProcessingError
+from jobs import JobQueue, accepted
+from profiling import requested_profile
+from state_totals import is_internal_table
 
 
+# Uploads hold the database's single writer until they commit, so more
+# upload jobs at once in one process would only queue for it
+UPLOAD_JOB_WORKERS = int(os.environ.get('UPLOAD_JOB_WORKERS', 1))
+
 upload_blueprint = Blueprint('upload', __name__)
 
+
+def run_upload(job) -> dict:
+    """Process the file of an upload job, reporting its progress."""
+    total_bytes = job.input_size()
+    processor = upload_service(job.params['filename'], job.params['mode'], job.params.get('partition'))
+    with job.open_input() as f:
+        return processor.process_file(f, progress=lambda progress: job.update(dict(progress, total_bytes=total_bytes)))
+
+
+def describe_error(error: Exception):
+    """Message and status code of a failed upload, as /upload has always answered."""
+    if isinstance(error, (InvalidFileError, DataProcessingError)):
+        return str(error), 400
+    return 'Internal server error', 500
+
+
+upload_jobs = JobQueue(config.jobs_path, {'upload': run_upload}, UPLOAD_JOB_WORKERS, describe_error)
+
+
+def upload_request():
+    """Parameters and file of the request's upload job.
+
+    Returns:
+        Tuple of the job parameters and the file, or None for both and an
+        error response for a request without a file
+    """
+    if 'file' not in request.files:
+        return None, None, (jsonify({'error': 'No file part'}), 400)
+
+    file = request.files['file']
+    if not file or file.filename == '':
+        return None, None, (jsonify({'error': 'No selected file'}), 400)
+
+    params = {'filename': file.filename, 'mode': request.form.get('mode', 'replace')}
+    if request.form.get('partition'):
+        params['partition'] = request.form['partition']
+    profile_id = requested_profile()
+    if profile_id:
+        params['profile'] = profile_id
+    return params, file, None
+
 @upload_blueprint.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload requests.
     
-    Processes POST requests with text files containing tweet data.
+    Processes POST requests with text files containing tweet data. The file
+    is processed by an upload job run in this request; nothing is stored
+    in the jobs database.
     
     Args:
         file (FileStorage): Uploaded text file via multipart/form-data
+        mode (str): Optional form field: 'replace' (default) rewrites the
+            table, 'append' adds only tweets not stored yet;
+            'replace_partitions' rewrites only the partitions of a
+            partitioned table that the file has tweets for
+        partition (str): Optional form field: 'day' or 'month' stores a new
+            or replaced table as one partition per day or month of
+            created_at (see partitioned.py); uploads to a partitioned table
+            keep its granularity
+        X-Profile (str): Optional header asking for a cProfile dump of the
+            upload, if PROFILING is on (see profiling.py)
         
     Returns:
         JSON response with operation status:
@@ -30,40 +98,173 @@ def upload_file():
         
     Example:
         curl -X POST -F "file=@data.txt" http://localhost:5001/upload
+        curl -X POST -F "file=@data.txt" -F "mode=append" http://localhost:5001/upload
+        curl -X POST -F "file=@data.txt" -F "partition=day" http://localhost:5001/upload
     """
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    if not file or file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+    try:
+        params, file, error = upload_request()
+        if error:
+            return error
+        result, status = upload_jobs.run('upload', params, upload=file)
+        return jsonify(result), status
+
+    except Exception as e:
+        current_app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@upload_blueprint.route('/jobs/upload', methods=['POST'])
+def upload_job():
+    """Queue a file upload and return at once.
 
+    Takes the same form fields as /upload.
+
+    Returns:
+        JSON response:
+        - Accepted: 202 with the job id; the Location header points at the
+          job, whose progress reports rows_parsed, rows_inserted, bytes_read
+          and total_bytes. /jobs/<id>/result answers as /upload would have.
+        - Client error: 400 Bad Request for a request without a file
+
+    Example:
+        curl -X POST -F "file=@data.txt" http://localhost:5001/jobs/upload
+        curl http://localhost:5001/jobs/<job_id>
+        curl http://localhost:5001/jobs/<job_id>/result
+        curl -X POST http://localhost:5001/jobs/<job_id>/cancel
+    """
     try:
-        processor = FileProcessingService(file.filename)
-        result = processor.process_file(file)
-        return jsonify(result), 200
+        params, file, error = upload_request()
+        return error or accepted(upload_jobs.submit('upload', params, upload=file))
+    except Exception as e:
+        current_app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
 
-    except (InvalidFileError, DataProcessingError) as e:
-        current_app.logger.error(f"Error: {str(e)}")
+@upload_blueprint.route('/stream/<table_name>', methods=['POST'])
+def stream_tweets(table_name):
+    """Append tweets streamed line by line in the request body to a table.
+
+    Lines are in the upload format and are committed in batches as they
+    arrive, updating the table's live map (see streaming.py). The
+    response is sent when the stream ends.
+
+    Returns:
+        JSON response:
+        - Success: 200 OK with ingest statistics
+        - Client error: 400 Bad Request for an invalid name, encoding or a
+          stream without valid records (batches committed before stay)
+        - Server error: 500 Internal Server Error
+
+    Example:
+        curl -X POST -H 'Transfer-Encoding: chunked' --data-binary @data.txt \
+            http://localhost:5001/stream/live
+    """
+    try:
+        return jsonify(StreamIngestService(table_name).process_stream(request.stream)), 200
+    except (InvalidFileError, InvalidDataFormatError, DataProcessingError) as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
-        current_app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        current_app.logger.error(f"Stream error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@upload_blueprint.route('/stream/<table_name>/events', methods=['GET'])
+def stream_events(table_name):
+    """Live mood map of a table as Server-Sent Events.
+
+    A 'snapshot' event carries every state's color, average and tweet
+    count; 'delta' events carry the states whose color changed (null for
+    a state gone from the map), batched and merged for slow clients.
+
+    Returns:
+        text/event-stream response, or 404 Not Found for an unknown table
+
+    Example:
+        curl -N http://localhost:5001/stream/live/events
+    """
+    if is_internal_table(table_name) or not table_exists(table_name):
+        return jsonify({'error': f'Table "{table_name}" not found in database'}), 404
+    return Response(live_map(table_name).events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @upload_blueprint.route('/tables', methods=['GET'])
 def get_tables():
     """Get list of all tweet tables in database.
 
+    The response carries an ETag of the database schema; a request whose
+    If-None-Match holds it is answered 304 without listing the tables.
+
     Returns:
         JSON response with list of table names or error message
 
     Example:
         curl http://localhost:5001/tables
+        curl -H 'If-None-Match: "<etag>"' http://localhost:5001/tables
     """
     try:
-        tables = get_all_tables()
-        return jsonify({'tables': tables}), 200
+        etag = make_etag('tables', get_tables_version())
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        response = jsonify({'tables': get_all_tables()})
+        response.set_etag(etag)
+        return response, 200
     except Exception as e:
         current_app.logger.error(f"Error retrieving tables: {str(e)}", exc_info=True)
-        return jsonify({'error': 'Failed to retrieve tables'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to retrieve tables'}), 500
+
+
+@upload_blueprint.route('/tables/<table_name>/partitions', methods=['GET'])
+def get_partitions(table_name):
+    """Get the partitions of a partitioned table.
+
+    Returns:
+        JSON response with the table's granularity and its partitions'
+        period, table and [start, end) of created_at, or 404 Not Found for
+        a table that isn't partitioned
+
+    Example:
+        curl http://localhost:5001/tables/family/partitions
+    """
+    granularity = get_partitioning(table_name)
+    if granularity is None:
+        return jsonify({'error': f'Table "{table_name}" is not partitioned'}), 404
+    return jsonify({'table': table_name, 'granularity': granularity,
+                    'partitions': list_partitions(table_name)}), 200
+
+
+@upload_blueprint.route('/tables/<table_name>/partitions', methods=['DELETE'])
+def delete_partitions(table_name):
+    """Drop whole partitions of a partitioned table.
+
+    Args:
+        period (str): Query parameter, repeatable: period of a partition to
+            drop, as listed by GET
+        before (str): Query parameter: ISO date or datetime; partitions
+            holding only tweets created before it are dropped
+
+    Returns:
+        JSON response with the periods dropped, 400 Bad Request without
+        periods or with an invalid date, or 404 Not Found for a table that
+        isn't partitioned
+
+    Example:
+        curl -X DELETE "http://localhost:5001/tables/family/partitions?period=2014-02-16"
+        curl -X DELETE "http://localhost:5001/tables/family/partitions?before=2014-03-01"
+    """
+    if get_partitioning(table_name) is None:
+        return jsonify({'error': f'Table "{table_name}" is not partitioned'}), 404
+    periods = request.args.getlist('period')
+    try:
+        before = datetime.fromisoformat(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': "'before' must be an ISO date or datetime"}), 400
+    if not periods and before is None:
+        return jsonify({'error': "Give 'period' or 'before'"}), 400
+    try:
+        dropped = drop_partitions(table_name, periods, before)
+        return jsonify({'status': 'success', 'table': table_name, 'dropped': dropped}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error dropping partitions: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to drop partitions'}), 500
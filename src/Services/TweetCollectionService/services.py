@@ -2,36 +2,92 @@
 """
 Core business logic module for processing tweet files.
 
-Contains the FileProcessingService class with data parsing and validation logic.
+Contains the FileProcessingService class with upload processing logic; lines
+are parsed and validated by the parsing module.
 """
 
+import codecs
 import re
 import os
-from datetime import datetime
-from typing import Dict
-from database import Session, create_table, table_exists
-from exceptions import InvalidDataFormatError
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import bindparam, delete, insert, select, update
+from database import (Session, build_content_key, config, create_table, drop_content_key, get_partitioning,
+                      result_cache)
+from exceptions import InvalidDataFormatError, InvalidFileError
+from metrics import Stages
+from model_registry import ModelRegistry
+from parsing import init_parser_worker, parse_chunk, text_hash
+from process_pools import worker_context
+from point_index import clear_point_index, index_points
+from state_totals import accumulate, add_state_totals, clear_state_totals, hour_key, read_state_totals
+from table_snapshot import bump_generation
+
+# Characters str.splitlines() treats as line boundaries
+LINE_BREAKS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+# Default number of parser processes for large uploads
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+
+# Sentiment lexicon and state geometries used to score rows at upload time,
+# shared with the analysis service through the model snapshot
+model_registry = ModelRegistry(config)
+
 
 class FileProcessingService:
     """Main service class for processing tweet data files.
     
     Attributes:
         table_name (str): Sanitized name for the database table
+        mode (str): 'replace' rewrites the table, 'append' adds new rows
         Tweet (DeclarativeMeta): SQLAlchemy model class for current table
         session (Session): Database session instance
+        batch_size (int): Rows per bulk INSERT
+        chunk_size (int): Bytes read from the upload stream at a time
+        workers (int): Parser processes; 1 parses in the request process
+        stages (Stages): Time spent decoding, parsing and inserting
+        bytes_read (int): Bytes of the upload read so far
     """
+
+    MODES = ('replace', 'append')
+    DEFAULT_BATCH_SIZE = 5000
+    DEFAULT_CHUNK_SIZE = 1 << 20
+    # Lines handed to a parser process at once
+    PARSE_CHUNK_LINES = 10000
+    # Files with fewer chunks than this are parsed serially
+    PARALLEL_MIN_CHUNKS = 4
     
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, mode: str = 'replace', batch_size: int = DEFAULT_BATCH_SIZE,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = INGEST_WORKERS):
         """Initialize processing service for a specific file.
         
         Args:
             filename (str): Original name of the uploaded file
+            mode (str): Upload mode, one of MODES
+            batch_size (int): Rows per bulk INSERT
+            chunk_size (int): Bytes read from the upload stream at a time
+            workers (int): Parser processes for large files
+
+        Raises:
+            InvalidFileError: For an unknown mode or a name without any
+            letters or digits
         """
+        if mode not in self.MODES:
+            raise InvalidFileError(f"Unknown upload mode '{mode}'")
+        self.mode = mode
         self.table_name = self._sanitize_filename(filename)
-        self.Tweet = create_table(self.table_name)
+        self.Tweet = self._open_table()
         self.session = Session()
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.stages = Stages()
+        self.bytes_read = 0
 
-    def _sanitize_filename(self, filename: str) -> str:
+    @staticmethod
+    def _sanitize_filename(filename: str) -> str:
         """Sanitize filename to create valid SQL table name.
         
         Args:
@@ -42,21 +98,64 @@ class FileProcessingService:
             - Lowercase letters
             - Underscores instead of special characters
             - No file extensions
+            - No leading underscores (reserved for internal tables)
+
+        Raises:
+            InvalidFileError: If nothing is left of the name
         """
         name = os.path.splitext(filename)[0]
-        return re.sub(r'\W', '_', name).lower()
+        table_name = re.sub(r'\W', '_', name).lower().lstrip('_')
+        if not table_name:
+            raise InvalidFileError("Invalid file name")
+        return table_name
 
-    def process_file(self, file) -> Dict:
+    def _open_table(self):
+        """Create the table if needed.
+
+        Returns:
+            DeclarativeMeta: SQLAlchemy model class of the table
+
+        Raises:
+            InvalidFileError: If the name is a partitioned table's, which is
+            written by PartitionedUploadService
+        """
+        if get_partitioning(self.table_name):
+            raise InvalidFileError(f"Table '{self.table_name}' is partitioned")
+        return create_table(self.table_name)
+
+    def process_file(self, file, progress: Optional[Callable[[Dict], None]] = None) -> Dict:
         """Process uploaded file and store data in database.
+
+        The upload is read and decoded in chunks and rows are written in
+        bulk batches, so memory use does not grow with file size. Large
+        files are parsed by a process pool; results are written in input
+        order, so the outcome is the same as with serial parsing. Each row
+        is stored with its sentiment score, state and model version. All
+        batches belong to one transaction: the table is changed only if
+        the whole file is processed.
+
+        A tweet is identified by its coordinates, timestamp and text hash.
+        In replace mode the table's rows are deleted first and every line
+        is stored, repeated ones included; in append mode they are kept
+        and tweets already stored or repeated within the file are skipped.
+        The table's per-state running totals and its point index are
+        updated with the written rows, so analysis doesn't need to rescan
+        it.
         
         Args:
             file (FileStorage): Uploaded file object
+            progress (Callable): Optional callback, called after each parsed
+                chunk with rows_parsed, rows_inserted and bytes_read so far;
+                an exception it raises aborts the upload
             
         Returns:
             Dict: Processing results with:
             - status: Operation outcome
             - table: Created/updated table name
+            - mode: Upload mode
             - valid_records: Number of successfully processed records
+            - inserted: Number of rows written
+            - duplicates: Valid records skipped as already stored
             - errors: List of parsing errors
             
         Raises:
@@ -64,35 +163,48 @@ class FileProcessingService:
             UnicodeDecodeError: If file has invalid encoding
         """
         valid_records = 0
+        inserted = 0
         errors = []
+        batch = []
+        totals = {}
+        rollups = {}
         
         try:
-            content = file.read().decode('utf-8')
-            lines = content.splitlines()
-            
-            if table_exists(self.table_name):
-                self.session.query(self.Tweet).delete()
+            # One model version for the whole upload
+            models = model_registry.get()
+            keep_totals = self._prepare_table(models.version)
 
-            for line_num, line in enumerate(lines, 1):
-                try:
-                    tweet_data = self._parse_line(line)
-                    self.session.add(self.Tweet(**tweet_data))
-                    valid_records += 1
-                except InvalidDataFormatError as e:
-                    errors.append(f"Line {line_num}: {str(e)}")
+            for rows, chunk_errors in self._parse_chunks(self._chunk_lines(self._read_lines(file)), models):
+                errors.extend(chunk_errors)
+                valid_records += len(rows)
+                batch.extend(rows)
+                if len(batch) >= self.batch_size:
+                    inserted += self._insert_batch(batch, totals, rollups)
+                    batch = []
+                if progress:
+                    progress({'rows_parsed': valid_records, 'rows_inserted': inserted,
+                              'bytes_read': self.bytes_read})
 
             if valid_records == 0:
                 raise InvalidDataFormatError("No valid records found")
 
+            inserted += self._insert_batch(batch, totals, rollups)
+            self._update_table_state(models.version, keep_totals, totals, rollups)
             self.session.commit()
+            result_cache.bump_version(self.table_name)
+            self.stages.record('upload', valid_records, table=self.table_name, mode=self.mode)
             return {
                 'status': 'success',
                 'table': self.table_name,
+                'mode': self.mode,
                 'valid_records': valid_records,
+                'inserted': inserted,
+                'duplicates': valid_records - inserted,
                 'errors': errors
             }
 
         except UnicodeDecodeError:
+            self.session.rollback()
             raise InvalidDataFormatError("Invalid file encoding")
         except Exception:
             self.session.rollback()
@@ -100,50 +212,222 @@ class FileProcessingService:
         finally:
             Session.remove()
 
-    def _parse_line(self, line: str) -> Dict:
-        """Parse single line of tweet data.
-        
+    def _prepare_table(self, model_version: str) -> bool:
+        """Empty or key the table and decide whether its running totals survive.
+
+        Every statement here writes, so the upload transaction holds the
+        database write lock from its first statement and what is decided
+        here stays true until commit.
+
         Args:
-            line (str): Raw input line from file
-            
+            model_version (str): Version of the models scoring this upload
+
         Returns:
-            Dict: Parsed tweet data with keys:
-            - latitude (float)
-            - longitude (float)
-            - created_at (datetime)
-            - text (str)
-            
+            bool: True if the stored totals cover all rows of the table and
+            only need this upload's rows added
+        """
+        table = self.Tweet.__table__
+        if self.mode == 'replace':
+            self.session.execute(delete(table))
+            clear_state_totals(self.session, self.table_name)
+            clear_point_index(self.session.connection(), self.table_name)
+            # Rows are inserted without the content key and keyed before commit
+            drop_content_key(self.session.connection(), self.table_name)
+            return True
+
+        # Totals of other model versions can't be extended with these rows
+        clear_state_totals(self.session, self.table_name, keep_version=model_version)
+        if self._key_legacy_rows():
+            clear_state_totals(self.session, self.table_name)
+            return False
+        return self._totals_cover(table, self.table_name, model_version)
+
+    def _totals_cover(self, table, table_name: str, model_version: str) -> bool:
+        """Whether a table's stored totals (or their absence, if it is empty) cover all its rows"""
+        if read_state_totals(self.session, table_name, model_version):
+            return True
+        # Without totals, only an empty table is fully covered by this upload
+        return self.session.execute(select(table.c.id).limit(1)).first() is None
+
+    def _update_table_state(self, model_version: str, keep_totals: bool, totals: Dict, rollups: Dict):
+        """Add written rows to the stored totals and mark the table changed, before commit.
+
+        Args:
+            model_version (str): Version of the models that scored the rows
+            keep_totals (bool): Whether the stored totals are kept (see
+                _prepare_table)
+            totals (Dict): Per-state totals of the written rows
+            rollups (Dict): Per-hour, per-state totals of the written rows
+        """
+        if keep_totals:
+            add_state_totals(self.session, self.table_name, model_version, totals, rollups)
+        if self.mode != 'append':
+            build_content_key(self.session.connection(), self.table_name)
+        # Columnar snapshots of the table's old rows go out of date
+        bump_generation(self.session, self.table_name)
+
+    def _key_legacy_rows(self) -> int:
+        """Hash rows stored before content keys existed.
+
+        Rows repeating another row's content are numbered as its copies,
+        as a replace upload stores them.
+
+        Returns:
+            int: Number of rows keyed
+        """
+        table = self.Tweet.__table__
+        key_row = (update(table)
+                   .where(table.c.id == bindparam('row_id'))
+                   .values(text_hash=bindparam('row_hash')))
+        keyed, last_id = 0, 0
+        conn = self.session.connection()
+        while rows := self.session.execute(
+            select(table.c.id, table.c.text)
+            .where(table.c.text_hash.is_(None) & (table.c.id > last_id))
+            .order_by(table.c.id)
+            .limit(self.batch_size)
+        ).fetchall():
+            if not keyed:
+                # Hashes may repeat stored ones until the rows are numbered
+                drop_content_key(conn, self.table_name)
+            self.session.execute(key_row, [{'row_id': row.id, 'row_hash': text_hash(row.text)} for row in rows])
+            keyed += len(rows)
+            last_id = rows[-1].id
+        if keyed:
+            build_content_key(conn, self.table_name)
+        return keyed
+
+    def _read_lines(self, file) -> Iterator[str]:
+        """Lazily split an uploaded file into decoded lines.
+
+        Produces the same lines as ``file.read().decode('utf-8').splitlines()``
+        while holding only one chunk in memory.
+
+        Args:
+            file (FileStorage): Uploaded file object
+
+        Yields:
+            str: Lines without their line break
+
         Raises:
-            InvalidDataFormatError: For any parsing or validation failure
+            UnicodeDecodeError: If file has invalid encoding
         """
-        line = line.strip()
-        pattern = r"""
-            ^\[(-?\d+\.\d+),\s*(-?\d+\.\d+)\]\s+_
-            \s+(\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}:\d{2})\s+(.*)$
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pending = ''
+        while True:
+            chunk = file.read(self.chunk_size)
+            self.bytes_read += len(chunk)
+            with self.stages('decode'):
+                text = pending + decoder.decode(chunk, final=not chunk)
+                lines = text.splitlines()
+            if not chunk:
+                yield from lines
+                return
+
+            if text.endswith('\r'):
+                # May be the first half of a \r\n pair split across chunks
+                pending = lines.pop() + '\r'
+            elif text and text[-1] not in LINE_BREAKS:
+                pending = lines.pop()
+            else:
+                pending = ''
+            yield from lines
+
+    def _chunk_lines(self, lines: Iterable[str]) -> Iterator[Tuple[int, List[str]]]:
+        """Group lines into numbered runs of PARSE_CHUNK_LINES.
+
+        Yields:
+            Tuple of the first line's number and the run of lines
         """
-        match = re.match(pattern, line, re.VERBOSE)
-        
-        if not match:
-            raise InvalidDataFormatError("Invalid line format")
+        lines = iter(lines)
+        first_line_num = 1
+        while chunk := list(islice(lines, self.PARSE_CHUNK_LINES)):
+            yield first_line_num, chunk
+            first_line_num += len(chunk)
 
-        try:
-            lat = float(match.group(1))
-            lon = float(match.group(2))
-            dt = datetime.strptime(match.group(3), '%Y-%m-%d %H:%M:%S')
-            text = match.group(4).strip()
+    def _parse_chunks(self, chunks: Iterator[Tuple[int, List[str]]], models) -> Iterator[Tuple[List[Dict], List[str]]]:
+        """Parse and score line chunks, in a process pool when the file is large enough.
 
-            if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
-                raise ValueError("Invalid coordinates")
-            
-            if not text or len(text) > 500:
-                raise ValueError("Invalid text content")
+        At most two chunks per worker are in flight, and results are yielded
+        in input order.
 
-            return {
-                'latitude': lat,
-                'longitude': lon,
-                'created_at': dt,
-                'text': text
-            }
+        Args:
+            chunks: Numbered runs of lines
+            models (Models): Models to score rows with
+
+        Yields:
+            Tuple of parsed rows and error messages for each chunk
+        """
+        head = list(islice(chunks, self.PARALLEL_MIN_CHUNKS))
+        if self.workers <= 1 or len(head) < self.PARALLEL_MIN_CHUNKS:
+            for chunk in chain(head, chunks):
+                with self.stages('parse'):
+                    parsed = parse_chunk(chunk, models)
+                yield parsed
+            return
+
+        # Not forked: stream and job threads of this process may hold locks
+        # of the models' memos meanwhile
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context(['parsing']),
+                                 initializer=init_parser_worker, initargs=(models,)) as pool:
+            pending = deque()
+            for chunk in chain(head, chunks):
+                pending.append(pool.submit(parse_chunk, chunk))
+                if len(pending) >= 2 * self.workers:
+                    yield self._parsed(pending.popleft())
+            while pending:
+                yield self._parsed(pending.popleft())
+
+    def _parsed(self, future):
+        """Result of a parser process; time waited for it counts as parsing"""
+        with self.stages('parse'):
+            return future.result()
+
+    def _insert_batch(self, rows, totals: Dict, rollups: Dict) -> int:
+        """Write parsed rows with a single executemany INSERT, skipping stored tweets.
+
+        Written rows are added to the table's point index.
+
+        Args:
+            rows (List[Dict]): Parsed tweet data
+            totals (Dict): Per-state running totals the written rows are added to
+            rollups (Dict): Per-hour, per-state running totals, likewise
+
+        Returns:
+            int: Number of rows written
+        """
+        written = self._write_rows(self.Tweet.__table__, self.table_name, rows)
+        self._accumulate(written, totals, rollups)
+        return len(written)
+
+    def _write_rows(self, table, table_name: str, rows: List[Dict]) -> List:
+        """Insert rows into a table and index the written ones.
+
+        Appends skip rows whose content key is stored already (INSERT OR
+        IGNORE); other modes write every row into a table without its key
+        (see build_content_key).
+
+        Returns:
+            List: id, coordinates, state, sentiment and created_at of the
+            rows written
+        """
+        if not rows:
+            return []
+        statement = insert(table)
+        if self.mode == 'append':
+            statement = statement.prefix_with('OR IGNORE')
+        with self.stages('insert'):
+            written = self.session.execute(
+                statement.returning(table.c.id, table.c.latitude, table.c.longitude,
+                                    table.c.state, table.c.sentiment, table.c.created_at),
+                rows
+            ).fetchall()
+            index_points(self.session.connection(), table_name,
+                         ((row.id, row.latitude, row.longitude) for row in written))
+        return written
 
-        except ValueError as e:
-            raise InvalidDataFormatError(str(e))
\ No newline at end of file
+    @staticmethod
+    def _accumulate(written: List, totals: Dict, rollups: Dict):
+        """Add written rows to per-state and per-hour, per-state totals"""
+        accumulate(totals, ((row.state, row.sentiment) for row in written))
+        accumulate(rollups, (((hour_key(row.created_at), row.state), row.sentiment) for row in written))
@@ -0,0 +1,383 @@
+# streaming.py
+"""
+Live ingest of streamed tweets and the live mood map of a table.
+
+A client streams tweets line by line (a chunked request body in the upload
+format) to POST /stream/<table>. Lines are parsed with the upload rules,
+scored and located, and appended to the table in batches of
+STREAM_BATCH_ROWS lines, or of what arrived within STREAM_FLUSH_SECONDS
+of a batch's first line. A reader thread hands lines on as they arrive,
+so a batch is committed on time also while the client sends nothing.
+Each batch is its own short transaction: uploads and analyses interleave
+with a long stream, every committed batch is visible to /analyze, and
+batches committed before an error stay.
+
+Every table that is streamed to or watched has a LiveMap: per-state
+running sums in memory, seeded from the table's stored totals and kept in
+step with its content version (a batch is added to the sums; any other
+change to the table, such as an upload, reseeds them). Subscribers of
+GET /stream/<table>/events get the map as Server-Sent Events: a snapshot,
+then deltas of the states whose color changed.
+
+Backpressure:
+- ingest reads at most one batch of lines ahead of the batch being
+  committed, so a client sending faster is slowed by TCP flow control
+  instead of being buffered in memory;
+- a subscriber has at most one pending delta, which later deltas are
+  merged into, and gets at most one event per SSE_INTERVAL seconds: a
+  slow subscriber receives fewer, larger deltas and holds at most one
+  entry per state.
+
+Live maps are kept in process memory; the collection service runs as a
+single process.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List
+
+from sqlalchemy import func, select
+
+from database import Session, result_cache, storage
+from exceptions import InvalidDataFormatError
+from mood_colors import state_colors
+from parsing import parse_chunk
+from services import FileProcessingService, model_registry
+from state_totals import read_state_totals
+
+STREAM_BATCH_ROWS = int(os.environ.get('STREAM_BATCH_ROWS', 2000))
+STREAM_FLUSH_SECONDS = float(os.environ.get('STREAM_FLUSH_SECONDS', 0.5))
+# Bytes read from the request body at a time at most. Reads return what
+# has arrived (see _ShortReads) instead of waiting for that many
+STREAM_READ_SIZE = int(os.environ.get('STREAM_READ_SIZE', 1024))
+# Parse errors returned in full; later ones are only counted
+STREAM_MAX_ERRORS = 100
+SSE_INTERVAL = float(os.environ.get('SSE_INTERVAL', 0.25))
+# Seconds between checks of a watched table for changes by other writers,
+# and between keepalive comments to idle subscribers
+SSE_REFRESH_SECONDS = 5.0
+
+
+# Put by the reader thread after the last line
+_END_OF_STREAM = object()
+
+
+def load_state_sums(table_name: str, model_version: str) -> Dict[str, List]:
+    """[sentiment sum, scored rows] per located state of a table's rows scored by model_version.
+
+    Read from the stored running totals if the table has them, otherwise
+    aggregated from its rows.
+    """
+    with storage.reader.connect() as conn:
+        totals = read_state_totals(conn, table_name, model_version)
+        if not totals:
+            table = storage.tables.get(table_name)
+            totals = conn.execute(
+                select(table.c.state, func.sum(table.c.sentiment), func.count(table.c.sentiment), func.count())
+                .where(table.c.model_version == model_version)
+                .group_by(table.c.state)
+            ).fetchall()
+    return {state: [sentiment_sum, scored] for state, sentiment_sum, scored, _ in totals
+            if scored and state != 'Unknown'}
+
+
+def _event(name: str, event_id: int, data: Dict) -> str:
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+class _Subscription:
+    __slots__ = ('pending',)
+
+    def __init__(self):
+        # State -> its entry (None for a state no longer on the map), merged until sent
+        self.pending = {}
+
+
+class LiveMap:
+    """Per-state mood of one table, updated by streamed batches and pushed to subscribers.
+
+    Attributes:
+        table_name (str): Table the map is of
+        content_version (int): Result cache version of the table the sums are of
+        model_version (str): Version of the models that scored them
+        sequence (int): Number of changes published, the id of SSE events
+    """
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.content_version = None
+        self.model_version = None
+        self.sequence = 0
+        self._sums = {}
+        self._entries = {}
+        self._subscriptions = set()
+        self._changed = threading.Condition()
+
+    def sync(self, model_version: str):
+        """Reseed the sums if the table or the models changed other than by add()"""
+        # Version first: sums read after it are at least as new
+        version = result_cache.get_version(self.table_name)
+        if (version, model_version) == (self.content_version, self.model_version):
+            return
+        sums = load_state_sums(self.table_name, model_version)
+        with self._changed:
+            if model_version == self.model_version and (self.content_version or 0) > version:
+                # A batch was added meanwhile; its sums are newer
+                return
+            self._sums, self.content_version, self.model_version = sums, version, model_version
+            self._publish()
+
+    def add(self, totals: Dict[str, List], previous_version: int, version: int, model_version: str):
+        """Add a committed batch's [sentiment sum, scored, rows] per state.
+
+        previous_version and version are the table's content versions
+        before and after the batch; if the sums weren't of the former, or
+        something else changed the table too, they are reseeded instead.
+        """
+        with self._changed:
+            in_step = (self.content_version, self.model_version) == (previous_version, model_version)
+            if in_step and version == previous_version + 1:
+                for state, (sentiment_sum, scored, _) in totals.items():
+                    if scored and state != 'Unknown':
+                        entry = self._sums.setdefault(state, [0.0, 0])
+                        entry[0] += sentiment_sum
+                        entry[1] += scored
+                self.content_version = version
+                self._publish()
+                return
+        self.sync(model_version)
+
+    def _message(self, states: Dict) -> Dict:
+        return {'table': self.table_name, 'version': self.content_version,
+                'tweets': sum(scored for _, scored in self._sums.values()), 'states': states}
+
+    def _publish(self):
+        """Recolor the map and queue the changed states for subscribers; holds the lock"""
+        averages = {state: sentiment_sum / scored for state, (sentiment_sum, scored) in self._sums.items()}
+        entries = {
+            state: {'color': color, 'average': round(averages[state], 4), 'tweets': self._sums[state][1]}
+            for state, color in state_colors(averages).items()
+        }
+        delta = {state: entry for state, entry in entries.items()
+                 if entry['color'] != (self._entries.get(state) or {}).get('color')}
+        delta.update(dict.fromkeys(self._entries.keys() - entries.keys()))
+        self._entries = entries
+        if delta:
+            self.sequence += 1
+            for subscription in self._subscriptions:
+                subscription.pending.update(delta)
+            self._changed.notify_all()
+
+    def events(self) -> Iterator[str]:
+        """Server-Sent Events of the map: a snapshot, then deltas, until the client leaves"""
+        subscription = _Subscription()
+        self.sync(model_registry.get().version)
+        with self._changed:
+            self._subscriptions.add(subscription)
+            snapshot, sequence = self._message(dict(self._entries)), self.sequence
+        try:
+            yield _event('snapshot', sequence, snapshot)
+            while True:
+                with self._changed:
+                    self._changed.wait_for(lambda: subscription.pending, timeout=SSE_REFRESH_SECONDS)
+                    delta, subscription.pending = subscription.pending, {}
+                    message, sequence = self._message(delta), self.sequence
+                if delta:
+                    yield _event('delta', sequence, message)
+                    # Deltas published meanwhile are merged into one event
+                    time.sleep(SSE_INTERVAL)
+                else:
+                    # Uploads change the table without telling the map
+                    self.sync(model_registry.get().version)
+                    if not subscription.pending:
+                        yield ': keepalive\n\n'
+        finally:
+            with self._changed:
+                self._subscriptions.discard(subscription)
+
+
+_live_maps: Dict[str, LiveMap] = {}
+_live_maps_lock = threading.Lock()
+
+
+def live_map(table_name: str) -> LiveMap:
+    """The process's live map of a table"""
+    with _live_maps_lock:
+        if table_name not in _live_maps:
+            _live_maps[table_name] = LiveMap(table_name)
+        return _live_maps[table_name]
+
+
+class _ShortReads:
+    """A stream whose reads return what has arrived, for _read_lines.
+
+    read1 where the stream has it; otherwise line reads, which return at
+    the end of a line (byte by byte on the development server's chunked
+    request bodies, its only non-blocking read).
+    """
+
+    def __init__(self, stream):
+        self.read = getattr(stream, 'read1', None) or stream.readline
+
+
+class StreamIngestService(FileProcessingService):
+    """Appends tweets streamed in a request body to a table, batch by batch.
+
+    Attributes:
+        batch_rows (int): Lines per batch at most
+        flush_seconds (float): Seconds a batch collects lines at most
+        live_map (LiveMap): Map of the table the batches are added to
+    """
+
+    def __init__(self, table_name: str, batch_rows: int = STREAM_BATCH_ROWS,
+                 flush_seconds: float = STREAM_FLUSH_SECONDS, read_size: int = STREAM_READ_SIZE):
+        """Open (and create if needed) the table a stream appends to.
+
+        Args:
+            table_name (str): Table name, sanitized as upload file names are
+            batch_rows (int): Lines per batch at most
+            flush_seconds (float): Seconds a batch collects lines at most
+            read_size (int): Bytes read from the stream at a time at most
+
+        Raises:
+            InvalidFileError: For a name without any letters or digits, or
+            of a partitioned table
+        """
+        super().__init__(table_name, 'append', chunk_size=read_size, workers=1)
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.live_map = live_map(self.table_name)
+        self.valid_records = 0
+        self.inserted = 0
+        self.batches = 0
+        self.errors = []
+        self.error_count = 0
+        self._prepared = False
+
+    def process_stream(self, stream) -> Dict:
+        """Ingest a stream of tweet lines until it ends.
+
+        Args:
+            stream: Binary stream of the request body
+
+        Returns:
+            Dict: Ingest results with:
+            - status, table, valid_records, inserted, duplicates: as for uploads
+            - batches: Number of batches committed
+            - errors: The first STREAM_MAX_ERRORS parsing errors
+            - error_count: Number of parsing errors
+
+        Raises:
+            InvalidDataFormatError: If the stream has invalid encoding or no
+            valid records
+        """
+        lines, first_line_num, deadline = [], 1, None
+        arrivals = queue.Queue(maxsize=self.batch_rows)
+        stop = threading.Event()
+        threading.Thread(target=self._read_ahead, args=(stream, arrivals, stop), daemon=True).start()
+        try:
+            while True:
+                try:
+                    # Without pending lines there is nothing to flush on time
+                    line = arrivals.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    line = None
+                if line is _END_OF_STREAM:
+                    break
+                if isinstance(line, Exception):
+                    raise line
+                if line is not None:
+                    if not lines:
+                        deadline = time.monotonic() + self.flush_seconds
+                    lines.append(line)
+                if lines and (len(lines) >= self.batch_rows or time.monotonic() >= deadline):
+                    self._flush(first_line_num, lines)
+                    first_line_num += len(lines)
+                    lines, deadline = [], None
+            self._flush(first_line_num, lines)
+        except UnicodeDecodeError:
+            raise InvalidDataFormatError("Invalid stream encoding")
+        finally:
+            stop.set()
+            Session.remove()
+
+        if self.valid_records == 0:
+            raise InvalidDataFormatError("No valid records found")
+        self.stages.record('stream', self.valid_records, table=self.table_name, batches=self.batches)
+        return {
+            'status': 'success',
+            'table': self.table_name,
+            'valid_records': self.valid_records,
+            'inserted': self.inserted,
+            'duplicates': self.valid_records - self.inserted,
+            'batches': self.batches,
+            'errors': self.errors,
+            'error_count': self.error_count,
+        }
+
+    def _read_ahead(self, stream, arrivals: queue.Queue, stop: threading.Event):
+        """Reader thread: put the stream's lines in arrivals, then _END_OF_STREAM or the error raised.
+
+        Gives up once stop is set, i.e. when ingest ended early.
+        """
+        try:
+            for line in self._read_lines(_ShortReads(stream)):
+                if not self._put(arrivals, line, stop):
+                    return
+            item = _END_OF_STREAM
+        except Exception as e:
+            item = e
+        self._put(arrivals, item, stop)
+
+    @staticmethod
+    def _put(arrivals: queue.Queue, item, stop: threading.Event) -> bool:
+        """Wait for room in arrivals, unless stop is set"""
+        while not stop.is_set():
+            try:
+                arrivals.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _flush(self, first_line_num: int, lines: List[str]):
+        """Parse, score and commit a batch of lines, then add it to the live map"""
+        if not lines:
+            return
+        models = model_registry.get()
+        with self.stages('parse'):
+            rows, errors = parse_chunk((first_line_num, lines), models)
+        self.error_count += len(errors)
+        self.errors.extend(errors[:STREAM_MAX_ERRORS - len(self.errors)])
+        self.valid_records += len(rows)
+        if not rows:
+            return
+
+        totals, rollups = {}, {}
+        try:
+            keep_totals = self._keep_totals(models.version)
+            inserted = self._insert_batch(rows, totals, rollups)
+            self._update_table_state(models.version, keep_totals, totals, rollups)
+            previous_version = result_cache.get_version(self.table_name)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        self.inserted += inserted
+        self.batches += 1
+        version = result_cache.bump_version(self.table_name)
+        self.live_map.add(totals, previous_version, version, models.version)
+
+    def _keep_totals(self, model_version: str) -> bool:
+        """Whether the batch is added to the table's stored totals.
+
+        The first batch prepares the table as an appending upload does;
+        later ones extend the totals if they (still) exist.
+        """
+        if not self._prepared:
+            self._prepared = True
+            return self._prepare_table(model_version)
+        return bool(read_state_totals(self.session, self.table_name, model_version))
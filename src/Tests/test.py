@@ -0,0 +1,1061 @@
+# test.py
+"""
+Tests of the SQLite storage, job queue, table snapshots, phrase matching,
+state lookups, scoring memos, point index and HTTP caching shared by both
+services, of streaming ingest, time windows and partitioned tables, and of
+sampled estimates.
+
+The concurrency test runs uploads (collection service) and analyses
+(analysis service) in parallel processes, and uploads in parallel threads
+of one process, on a temporary database, and checks that nothing fails on
+the database lock and that the stored rows and running totals come out
+the same as a serial run would leave them.
+
+Usage:
+    python -m unittest src/Tests/test.py
+"""
+
+import csv
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import unittest
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+SERVICES_DIR = BASE_DIR / 'src' / 'Services'
+DATA_DIR = BASE_DIR / 'Data'
+
+sys.path.append(str(SERVICES_DIR / 'Common'))
+
+import jobs  # noqa: E402
+import profiling  # noqa: E402
+import result_cache  # noqa: E402
+from http_cache import compress_app, make_etag, not_modified  # noqa: E402
+from phrase_matcher import PhraseMatcher, tokenize  # noqa: E402
+from point_index import create_point_index, in_box, index_points, point_index  # noqa: E402
+from scoring_memo import ScoringMemo  # noqa: E402
+from storage import Storage  # noqa: E402
+from table_snapshot import TableSnapshots, bump_generation, create_table_generations  # noqa: E402
+
+# Service processes are forked from the test process before it imports
+# either service: their modules have the same names
+context = multiprocessing.get_context('fork')
+
+
+def tweet_lines():
+    with open(DATA_DIR / 'weekend_tweets2014.txt', 'rb') as f:
+        return f.read().splitlines(keepends=True)
+
+
+def run_collection(db_path, jobs, errors):
+    """Upload (filename, mode, line slices) jobs, each job in its own thread"""
+    os.environ['TWEETS_DB_PATH'] = str(db_path)
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService')]
+    from database import init_db
+    from services import FileProcessingService
+    init_db()
+
+    lines = tweet_lines()
+
+    def upload(filename, mode, slices):
+        try:
+            for start, end in slices:
+                FileProcessingService(filename, mode, workers=1).process_file(io.BytesIO(b''.join(lines[start:end])))
+        except Exception:
+            errors.put(traceback.format_exc())
+
+    threads = [threading.Thread(target=upload, args=job) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_parallel_upload(db_path, results, errors):
+    """Upload the test file serially and with parser processes, while the upload holds the write lock"""
+    os.environ['TWEETS_DB_PATH'] = str(db_path)
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from database import init_db
+    from services import FileProcessingService
+    init_db()
+
+    try:
+        data = b''.join(tweet_lines())
+        FileProcessingService.PARSE_CHUNK_LINES = 1000
+        outcomes = {}
+        for filename, workers in (('serial.txt', 1), ('parallel.txt', 2)):
+            outcomes[workers] = [FileProcessingService(filename, mode, workers=workers).process_file(io.BytesIO(data))
+                                 for mode in ('replace', 'append')]
+        results.put(outcomes)
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def run_stream(db_path, results, errors):
+    """Stream the test file in two requests while watching the table's live map"""
+    os.environ['TWEETS_DB_PATH'] = str(db_path)
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from database import init_db
+    from streaming import StreamIngestService, live_map
+    init_db()
+
+    try:
+        lines = tweet_lines()
+        first = StreamIngestService('live', batch_rows=500).process_stream(io.BytesIO(b''.join(lines[:1000])))
+        events = live_map('live').events()
+        snapshot = json.loads(next(events).split('data: ', 1)[1])
+        second = StreamIngestService('live', batch_rows=500).process_stream(io.BytesIO(b''.join(lines)))
+        delta = json.loads(next(events).split('data: ', 1)[1])
+        events.close()
+        colors = {state: entry['color'] for state, entry in snapshot['states'].items()}
+        colors.update((state, entry['color']) for state, entry in delta['states'].items())
+        results.put((first, second, colors))
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def run_slow_stream(db_path, results, errors):
+    """Stream a few lines, then pause: the batch must be committed before the stream goes on"""
+    os.environ['TWEETS_DB_PATH'] = str(db_path)
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from database import init_db
+    from streaming import StreamIngestService
+    init_db()
+
+    try:
+        lines = tweet_lines()
+        read_fd, write_fd = os.pipe()
+        service = StreamIngestService('slow', flush_seconds=0.2)
+        outcome = []
+        with os.fdopen(read_fd, 'rb') as body:
+            ingest = threading.Thread(target=lambda: outcome.append(service.process_stream(body)))
+            ingest.start()
+            with os.fdopen(write_fd, 'wb') as stream:
+                stream.write(b''.join(lines[:20]))
+                stream.flush()
+                paused = time.monotonic()
+                while service.batches == 0 and time.monotonic() - paused < 10:
+                    time.sleep(0.05)
+                committed = service.batches
+                stream.write(b''.join(lines[20:40]))
+            ingest.join()
+        results.put((committed, outcome[0]))
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def spread_lines(days):
+    """The test file's tweets, spread over consecutive days from 2014-02-10"""
+    return [line.replace(b'2014-02-16', b'2014-02-%02d' % (10 + i % days)) for i, line in enumerate(tweet_lines())]
+
+
+def run_partitioned(db_path, results, errors):
+    """Upload the same tweets to a plain table and to one partitioned by day, then drop a day of both"""
+    os.environ['TWEETS_DB_PATH'] = str(db_path)
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from database import get_all_tables, init_db
+    from partitioned import drop_partitions, upload_service
+    init_db()
+
+    def upload(filename, mode, lines, partition=None):
+        return upload_service(filename, mode, partition, workers=1).process_file(io.BytesIO(b''.join(lines)))
+
+    try:
+        lines = spread_lines(4)
+        for filename, partition in (('plain.txt', None), ('daily.txt', 'day')):
+            upload(filename, 'replace', lines[:5000], partition)
+            upload(filename, 'append', lines[4000:])
+        dropped = drop_partitions('daily', ['2014-02-10'])
+        upload('plain.txt', 'replace', [line for line in lines if b'2014-02-10' not in line])
+        results.put((dropped, get_all_tables()))
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def run_uploads(db_path, uploads, errors):
+    """Replace tables with the given lines, one (filename, lines) upload after another"""
+    os.environ['TWEETS_DB_PATH'] = str(db_path)
+    os.environ['DATA_DIR'] = str(DATA_DIR)
+    sys.path[:0] = [str(SERVICES_DIR / 'TweetCollectionService')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from database import init_db
+    from services import FileProcessingService
+    init_db()
+
+    try:
+        for filename, lines in uploads:
+            FileProcessingService(filename, 'replace', workers=1).process_file(io.BytesIO(b''.join(lines)))
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def analyze_partitioned(db_path, results):
+    """Analyses of the plain and the partitioned table, and the partitions a day's window reads"""
+    db_manager, processor = analysis_processor(db_path)
+    raw = analysis_processor(db_path, scored=False)[1]
+    # Shards of all partitions go to one pool
+    raw.workers, raw.SHARD_ROWS = 2, 500
+    window = {'start': datetime(2014, 2, 11, 6, 30), 'end': datetime(2014, 2, 13)}
+    results.put(([(processor.process_table(table), raw.process_table(table),
+                   processor.process_window(table, bucket='hour'), processor.process_window(table, **window))
+                  for table in ('plain', 'daily')],
+                 db_manager.get_partitions('daily', datetime(2014, 2, 12), datetime(2014, 2, 13))))
+
+
+def analyze_windows(db_path, windows, results):
+    """Color maps and hourly/daily series of windows of 'tweets', and color maps of the tables of their rows"""
+    processor = analysis_processor(db_path)[1]
+    raw = analysis_processor(db_path, scored=False)[1]
+    results.put([(processor.process_window('tweets', start, end), processor.process_table(table),
+                  {bucket: processor.process_window('tweets', start, end, bucket) for bucket in ('hour', 'day')},
+                  raw.process_window('tweets', start, end, 'hour'))
+                 for table, (start, end) in windows.items()])
+
+
+def analyze_in_shards(db_path, results, errors):
+    """Raw analysis of a table in the request process and in a newly started shard pool, with memo lookups"""
+    try:
+        processor = analysis_processor(db_path, scored=False)[1]
+        reports = []
+        processor.progress = lambda progress, force=False: reports.append(progress)
+        serial = processor.process_table('tweets')
+        serial_memo = reports[-1]['memo']
+        processor.workers, processor.SHARD_ROWS = 2, 500
+        results.put((serial, processor.process_table('tweets'), serial_memo, reports[-1]['memo']))
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def analysis_processor(db_path, scored=True):
+    sys.path[:0] = [str(SERVICES_DIR / 'SentimentAnalysisService')]
+    import logging
+    logging.disable(logging.CRITICAL)
+    from data_processor import DataProcessor
+    from database import DatabaseManager
+    from model_snapshot import load_models
+
+    models = load_models(SimpleNamespace(snapshot_path=Path(db_path).parent / 'ModelSnapshot.bin',
+                                         sentiments_path=DATA_DIR / 'sentiments.csv',
+                                         states_path=DATA_DIR / 'states.json'))
+    db_manager = DatabaseManager(db_path)
+    db_manager.init_db()
+    return db_manager, DataProcessor(db_manager, models.analyzer, models.locator,
+                                     models.version if scored else None)
+
+
+def run_analysis(db_path, tables, done, errors):
+    """Analyze tables over and over until uploads are done"""
+    try:
+        db_manager, processor = analysis_processor(db_path)
+        while not done.is_set():
+            for table in tables:
+                if db_manager.table_exists(table):
+                    processor.process_table(table)
+                    processor.process_window(table, bucket='hour')
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def analyze_final(db_path, table, results):
+    """Color map from stored scores and running totals, and from scoring every row"""
+    scored = analysis_processor(db_path)[1].process_table(table)
+    rescored = analysis_processor(db_path, scored=False)[1].process_table(table)
+    results.put((scored, rescored))
+
+
+class ConcurrentStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp.name) / 'DataTweets.db'
+        self.errors = context.Queue()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def start(self, target, *args):
+        process = context.Process(target=target, args=(self.db_path, *args, self.errors))
+        process.start()
+        return process
+
+    def test_uploads_and_analyses_in_parallel(self):
+        lines = tweet_lines()
+        # Overlapping slices: every append after the first also repeats rows
+        step = len(lines) // 8
+        appends = [(i * step, (i + 1) * step + step // 2) for i in range(8)]
+
+        done = context.Event()
+        analyses = [self.start(run_analysis, ['shared', 'own_a', 'own_b'], done) for _ in range(2)]
+        uploads = [
+            # Two threads of one process share its writer connection
+            self.start(run_collection, [('shared.txt', 'append', appends[0::2]),
+                                        ('own_a.txt', 'replace', [(0, 2000), (1000, 4000)] * 2)]),
+            self.start(run_collection, [('shared.txt', 'append', appends[1::2]),
+                                        ('own_b.txt', 'replace', [(2000, 6000)] * 3)]),
+        ]
+        for process in uploads:
+            process.join()
+        done.set()
+        for process in analyses:
+            process.join()
+
+        errors = []
+        while not self.errors.empty():
+            errors.append(self.errors.get())
+        self.assertEqual(errors, [])
+        for process in uploads + analyses:
+            self.assertEqual(process.exitcode, 0)
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        distinct = conn.execute(
+            'SELECT COUNT(*) FROM (SELECT DISTINCT latitude, longitude, created_at, text FROM shared)'
+        ).fetchone()[0]
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM shared').fetchone()[0], distinct)
+        # Replace uploads keep repeated lines, numbered as copies
+        distinct = conn.execute(
+            'SELECT COUNT(*) FROM (SELECT DISTINCT latitude, longitude, created_at, text FROM own_b)'
+        ).fetchone()[0]
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM own_b WHERE occurrence = 0').fetchone()[0], distinct)
+        self.assertGreater(conn.execute('SELECT COUNT(*) FROM own_b').fetchone()[0], distinct)
+        for table in ('shared', 'own_a', 'own_b'):
+            # Running totals, where kept, cover exactly the table's rows
+            totals = conn.execute('SELECT SUM(rows) FROM _state_totals WHERE table_name = ?', (table,)).fetchone()[0]
+            if totals is not None:
+                self.assertEqual(totals, conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0])
+        conn.close()
+
+        results = context.Queue()
+        process = context.Process(target=analyze_final, args=(self.db_path, 'shared', results))
+        process.start()
+        scored, rescored = results.get(timeout=120)
+        process.join()
+        self.assertEqual(scored, rescored)
+
+
+class ParallelUploadTest(unittest.TestCase):
+    def test_parser_processes_store_what_serial_parsing_does(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / 'DataTweets.db'
+            results, errors = context.Queue(), context.Queue()
+            process = context.Process(target=run_parallel_upload, args=(db_path, results, errors))
+            process.start()
+            process.join()
+            self.assertTrue(errors.empty(), None if errors.empty() else errors.get())
+            outcomes = results.get(timeout=10)
+            for serial, parallel in zip(outcomes[1], outcomes[2]):
+                self.assertEqual({**serial, 'table': 'parallel'}, parallel)
+            # Enough chunks for the pool, and the append skipped every line
+            self.assertGreater(outcomes[2][0]['valid_records'], 1000 * 4)
+            self.assertEqual(outcomes[2][1]['inserted'], 0)
+
+            conn = sqlite3.connect(db_path)
+            rows = [conn.execute(f'SELECT latitude, longitude, created_at, text, sentiment, state, text_hash, '
+                                 f'occurrence FROM {table} ORDER BY id').fetchall() for table in ('serial', 'parallel')]
+            totals = [conn.execute('SELECT state, rows, sentiment_sum FROM _state_totals WHERE table_name = ? '
+                                   'ORDER BY state', (table,)).fetchall() for table in ('serial', 'parallel')]
+            conn.close()
+            self.assertEqual(rows[0], rows[1])
+            self.assertEqual(totals[0], totals[1])
+
+
+class StreamIngestTest(unittest.TestCase):
+    def test_live_map_matches_analysis(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / 'DataTweets.db'
+            results, errors = context.Queue(), context.Queue()
+            process = context.Process(target=run_stream, args=(db_path, results, errors))
+            process.start()
+            process.join()
+            self.assertTrue(errors.empty(), None if errors.empty() else errors.get())
+            first, second, colors = results.get(timeout=10)
+            self.assertEqual(first['batches'], 2)
+            # The second stream repeats the first's tweets
+            self.assertGreaterEqual(second['duplicates'], first['valid_records'])
+
+            process = context.Process(target=analyze_final, args=(db_path, 'live', results))
+            process.start()
+            scored, rescored = results.get(timeout=120)
+            process.join()
+            self.assertEqual(colors, scored)
+            self.assertEqual(scored, rescored)
+
+
+    def test_pausing_stream_is_committed_on_time(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            results, errors = context.Queue(), context.Queue()
+            process = context.Process(target=run_slow_stream, args=(Path(tmp) / 'DataTweets.db', results, errors))
+            process.start()
+            process.join()
+            self.assertTrue(errors.empty(), None if errors.empty() else errors.get())
+            committed, result = results.get(timeout=10)
+            self.assertEqual(committed, 1)
+            self.assertEqual((result['batches'], result['valid_records']), (2, 40))
+
+
+class PartitionedTableTest(unittest.TestCase):
+    def test_partitions_analyze_like_a_plain_table(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / 'DataTweets.db'
+            results, errors = context.Queue(), context.Queue()
+            process = context.Process(target=run_partitioned, args=(db_path, results, errors))
+            process.start()
+            process.join()
+            self.assertTrue(errors.empty(), None if errors.empty() else errors.get())
+            dropped, tables = results.get(timeout=10)
+            self.assertEqual(dropped, ['2014-02-10'])
+            self.assertIn('daily', tables)
+            self.assertFalse(any(table.startswith('_p_') for table in tables))
+
+            conn = sqlite3.connect(db_path)
+            partitions = conn.execute("SELECT period, table_name FROM _partitions WHERE topic = 'daily'").fetchall()
+            self.assertEqual([period for period, _ in sorted(partitions)], ['2014-02-11', '2014-02-12', '2014-02-13'])
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM plain').fetchone()[0],
+                             sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                                 for _, table in partitions))
+            conn.close()
+
+            process = context.Process(target=analyze_partitioned, args=(db_path, results))
+            process.start()
+            (plain, daily), window_partitions = results.get(timeout=120)
+            process.join()
+            # Sums of differently batched uploads may differ in the last bits
+            rounded = [[(bucket['start'], {state: round(average, 9) for state, average in bucket['averages'].items()})
+                        for bucket in series['series']] for series in (plain[2], daily[2])]
+            self.assertEqual(rounded[0], rounded[1])
+            self.assertEqual(plain[0], daily[0])
+            self.assertEqual(plain[1], daily[1])
+            self.assertEqual(plain[3], daily[3])
+            self.assertEqual(plain[0], plain[1])
+            self.assertEqual([partition for partition, _, _ in window_partitions], ['_p_daily_20140212'])
+
+
+class WindowTest(unittest.TestCase):
+    # Mid-hour bounds are aggregated from rows, whole hours from hourly rollups
+    WINDOWS = {
+        'mid_hours': (datetime(2014, 2, 10, 6, 30), datetime(2014, 2, 11, 13, 15)),
+        'whole_hours': (datetime(2014, 2, 10, 7), datetime(2014, 2, 11)),
+        'open_end': (datetime(2014, 2, 10, 12, 45), None),
+    }
+
+    def test_windows_total_their_rows(self):
+        from mood_colors import state_colors
+        from state_totals import BUCKET_FORMATS
+
+        def created_at(line):
+            return datetime.strptime(line.split(b'\t')[2].decode(), '%Y-%m-%d %H:%M:%S')
+
+        def in_window(time, start, end):
+            return start <= time and (end is None or time < end)
+
+        lines = spread_lines(2)
+        uploads = [('tweets.txt', lines)] + [
+            (f'{table}.txt', [line for line in lines if in_window(created_at(line), start, end)])
+            for table, (start, end) in self.WINDOWS.items()
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / 'DataTweets.db'
+            errors, results = context.Queue(), context.Queue()
+            process = context.Process(target=run_uploads, args=(db_path, uploads, errors))
+            process.start()
+            process.join()
+            self.assertTrue(errors.empty(), None if errors.empty() else errors.get())
+
+            conn = sqlite3.connect(db_path)
+            rows = [(datetime.fromisoformat(time), state, sentiment) for time, state, sentiment in conn.execute(
+                "SELECT created_at, state, sentiment FROM tweets WHERE sentiment IS NOT NULL AND state != 'Unknown'")]
+            conn.close()
+
+            process = context.Process(target=analyze_windows, args=(db_path, self.WINDOWS, results))
+            process.start()
+            analyses = results.get(timeout=120)
+            process.join()
+
+        for (table, (start, end)), (window, filtered, series, raw) in zip(self.WINDOWS.items(), analyses):
+            with self.subTest(window=table):
+                sums = {bucket: {} for bucket in (None, 'hour', 'day')}
+                for time, state, sentiment in rows:
+                    if in_window(time, start, end):
+                        for bucket, totals in sums.items():
+                            key = time.strftime(BUCKET_FORMATS[bucket]) if bucket else None
+                            totals.setdefault(key, {}).setdefault(state, []).append(sentiment)
+                averages = {bucket: {key: {state: round(sum(scores) / len(scores), 9) for state, scores in states.items()}
+                                     for key, states in totals.items()} for bucket, totals in sums.items()}
+
+                self.assertEqual(window, filtered)
+                self.assertEqual(window, state_colors(averages[None][None]))
+                for bucket in ('hour', 'day'):
+                    self.assertEqual({entry['start']: {state: round(average, 9)
+                                                       for state, average in entry['averages'].items()}
+                                      for entry in series[bucket]['series']}, averages[bucket])
+                self.assertEqual([entry['start'] for entry in raw['series']],
+                                 [entry['start'] for entry in series['hour']['series']])
+                for entry, expected in zip(raw['series'], series['hour']['series']):
+                    self.assertEqual(entry['averages'].keys(), expected['averages'].keys())
+                    for state, average in entry['averages'].items():
+                        self.assertAlmostEqual(average, expected['averages'][state])
+                # The first bucket holds the rows from start on, not its whole hour or day
+                self.assertEqual(series['hour']['series'][0]['start'], start.strftime(BUCKET_FORMATS['hour']))
+                self.assertEqual(series['day']['series'][0]['start'], start.strftime(BUCKET_FORMATS['day']))
+
+
+class ShardPoolTest(unittest.TestCase):
+    def test_shard_workers_start_during_an_upload(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / 'DataTweets.db'
+            errors = context.Queue()
+            process = context.Process(target=run_collection, args=(db_path, [('tweets.txt', 'replace', [(0, None)])],
+                                                                   errors))
+            process.start()
+            process.join()
+            self.assertTrue(errors.empty(), None if errors.empty() else errors.get())
+
+            # Another process's upload, holding the write lock throughout
+            upload = sqlite3.connect(db_path, isolation_level=None)
+            upload.execute('BEGIN IMMEDIATE')
+            upload.execute('DELETE FROM tweets')
+            try:
+                results = context.Queue()
+                process = context.Process(target=analyze_in_shards, args=(db_path, results, errors))
+                process.start()
+                process.join()
+                self.assertTrue(errors.empty(), None if errors.empty() else errors.get())
+                serial, sharded, serial_memo, sharded_memo = results.get(timeout=10)
+            finally:
+                upload.rollback()
+                upload.close()
+            self.assertNotIn('error', serial)
+            self.assertEqual(serial, sharded)
+            # Lookups of the table are reported wherever its shards were scanned
+            self.assertGreater(serial_memo['text']['lookups'], 0)
+            self.assertEqual({memo: counts['lookups'] for memo, counts in serial_memo.items()},
+                             {memo: counts['lookups'] for memo, counts in sharded_memo.items()})
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = Storage(Path(self.tmp.name) / 'test.db')
+        with self.storage.writer.begin() as conn:
+            conn.exec_driver_sql('CREATE TABLE tweets (id INTEGER PRIMARY KEY, text VARCHAR)')
+
+    def tearDown(self):
+        self.storage.dispose()
+        self.tmp.cleanup()
+
+    def test_readers_are_read_only(self):
+        with self.storage.reader.connect() as conn:
+            with self.assertRaises(Exception):
+                conn.exec_driver_sql("INSERT INTO tweets (text) VALUES ('x')")
+
+    def test_registry_follows_schema_changes(self):
+        tables = self.storage.tables
+        self.assertIs(tables.get('tweets'), tables.get('tweets'))
+        # Another process changing the schema
+        conn = sqlite3.connect(self.storage.db_path)
+        conn.execute('ALTER TABLE tweets ADD COLUMN state VARCHAR(8)')
+        conn.close()
+        self.assertIn('state', tables.get('tweets').c)
+        self.assertTrue(tables.has_table('tweets'))
+        self.assertFalse(tables.has_table('missing'))
+
+    def test_existing_schema_needs_no_write_lock(self):
+        from sqlalchemy import Column, Integer, MetaData, Table
+        metadata = MetaData()
+        Table('tweets', metadata, Column('id', Integer, primary_key=True))
+        # Another process in the middle of an upload
+        conn = sqlite3.connect(self.storage.db_path, isolation_level=None)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            started = time.monotonic()
+            self.storage.create_all(metadata)
+            Storage(self.storage.db_path).dispose()
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def test_writes_of_threads_are_queued(self):
+        def write(n):
+            for i in range(50):
+                with self.storage.writer.begin() as conn:
+                    conn.exec_driver_sql(f"INSERT INTO tweets (text) VALUES ('{n}-{i}')")
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with self.storage.reader.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql('SELECT COUNT(*) FROM tweets').scalar(), 200)
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_hits_read_without_the_write_lock(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = result_cache.ResultCache(Path(tmp) / 'ResultCache.db', max_entries=2)
+            cache.init_db()
+            cache.put('a', 1, {'CA': '#ff0000'}, 'm1')
+            # Another process writing to the cache, e.g. bumping a table's version
+            writer = sqlite3.connect(cache.storage.db_path, isolation_level=None)
+            writer.execute('BEGIN IMMEDIATE')
+            try:
+                started = time.monotonic()
+                self.assertEqual(cache.get('a', 1, 'm1'), {'CA': '#ff0000'})
+                self.assertIsNone(cache.get('a', 1, 'm2'))
+                self.assertLess(time.monotonic() - started, 1)
+            finally:
+                writer.rollback()
+                writer.close()
+
+            # Entries used long ago are refreshed, so the least recently used one is evicted
+            with cache.engine.begin() as conn:
+                conn.execute(result_cache.results.update().values(
+                    last_used=time.time() - 2 * result_cache.TOUCH_INTERVAL))
+            cache.put('b', 1, {}, 'm1')
+            self.assertIsNotNone(cache.get('a', 1, 'm1'))
+            cache.put('c', 1, {}, 'm1')
+            self.assertIsNotNone(cache.get('a', 1, 'm1'))
+            self.assertIsNone(cache.get('b', 1, 'm1'))
+            cache.storage.dispose()
+
+
+class TableSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = Storage(Path(self.tmp.name) / 'test.db')
+        create_table_generations(self.storage)
+        self.snapshots = TableSnapshots(self.storage, Path(self.tmp.name) / 'TableSnapshots')
+        self.insert([(1.5, 2.5, 'héllo'), (None, 3.0, ''), (4.0, 5.0, 'world')])
+
+    def tearDown(self):
+        self.storage.dispose()
+        self.tmp.cleanup()
+
+    def insert(self, rows):
+        with self.storage.writer.begin() as conn:
+            conn.exec_driver_sql('CREATE TABLE IF NOT EXISTS tweets (id INTEGER PRIMARY KEY, latitude FLOAT, '
+                                 'longitude FLOAT, text VARCHAR)')
+            conn.exec_driver_sql('INSERT INTO tweets (latitude, longitude, text) VALUES (?, ?, ?)', rows)
+            bump_generation(conn, 'tweets')
+
+    def test_columns_match_rows(self):
+        self.assertIsNone(self.snapshots.get('tweets'))
+        snapshot = self.snapshots.get('tweets', build=True)
+        self.assertEqual(snapshot.ids.tolist(), [1, 2, 3])
+        self.assertEqual(snapshot.longitude.tolist(), [2.5, 3.0, 5.0])
+        self.assertTrue(np.isnan(snapshot.latitude[1]))
+        self.assertEqual(snapshot.texts(snapshot.positions((2, 4))), ['', 'world'])
+        self.assertEqual(snapshot.texts(snapshot.lookup([1, 3])), ['héllo', 'world'])
+        with self.assertRaises(ValueError):
+            snapshot.lookup([4])
+        # Other processes open the same file
+        self.assertEqual(TableSnapshots(self.storage, self.snapshots.directory).get('tweets').stamp, snapshot.stamp)
+
+    def test_changed_tables_are_rebuilt(self):
+        self.snapshots.get('tweets', build=True)
+        self.insert([(6.0, 7.0, 'again')])
+        self.assertIsNone(self.snapshots.get('tweets'))
+        self.assertEqual(self.snapshots.get('tweets', build=True).ids.tolist(), [1, 2, 3, 4])
+
+    def test_tables_never_share_snapshots(self):
+        # Same stamp, and the same name once non-ASCII letters are replaced
+        for table_name, text in (('café', 'first'), ('caf_', 'second')):
+            with self.storage.writer.begin() as conn:
+                conn.exec_driver_sql(f'CREATE TABLE "{table_name}" (id INTEGER PRIMARY KEY, latitude FLOAT, '
+                                     'longitude FLOAT, text VARCHAR)')
+                conn.exec_driver_sql(f'INSERT INTO "{table_name}" (latitude, longitude, text) VALUES (1, 2, ?)',
+                                     (text,))
+                bump_generation(conn, table_name)
+        self.assertNotEqual(self.snapshots.path('café'), self.snapshots.path('caf_'))
+        self.assertEqual(self.snapshots.get('café', build=True).texts(slice(0, 1)), ['first'])
+        self.assertEqual(self.snapshots.get('caf_', build=True).texts(slice(0, 1)), ['second'])
+        # A file holding another table's rows is not used
+        os.replace(self.snapshots.path('café'), self.snapshots.path('caf_'))
+        self.assertIsNone(TableSnapshots(self.storage, self.snapshots.directory).get('caf_'))
+
+
+class PhraseMatcherTest(unittest.TestCase):
+    LEXICON = {'not': -1.0, 'good': 1.0, 'day': 0.5, 'not good': -2.0, 'very good': 2.0,
+               'good day': 1.5, 'not very good': -3.0, 'a b c d': 4.0, 'b c': 2.0, 'c': 1.0}
+
+    @staticmethod
+    def token_scores(lexicon, text):
+        """The scorer the matcher replaced: single words only"""
+        return [lexicon[word] for word in re.findall(r'\b\w+\b', text.lower()) if word in lexicon]
+
+    def test_phrases(self):
+        matcher = PhraseMatcher(self.LEXICON)
+        cases = {
+            'Not  GOOD!': [-2.0],
+            # Leftmost wins over a longer match starting later, longest over shorter ones
+            'very good day': [2.0, 0.5],
+            'not very good day': [-3.0, 0.5],
+            'good day, not good': [1.5, -2.0],
+            # Failure links: "a b c e" falls back to "b c", which covers "c"
+            'a b c e': [2.0],
+            'a b c d': [4.0],
+            'a b a b c d c': [4.0, 1.0],
+            # Phrases don't span other words
+            'not so good': [-1.0, 1.0],
+        }
+        for text, scores in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(matcher.scores(text), scores)
+
+    def test_word_boundaries(self):
+        matcher = PhraseMatcher(self.LEXICON)
+        # Words within words don't match; punctuation separates them
+        self.assertEqual(matcher.scores('goodness notgood gooday abc'), [])
+        self.assertEqual(matcher.scores('good-day'), [1.5])
+        self.assertEqual(matcher.scores("it's not...good"), [-2.0])
+        self.assertEqual(matcher.find(tokenize('so, very good')), [(1, 2, 2.0)])
+
+    def test_words_score_as_the_token_scorer(self):
+        with open(DATA_DIR / 'sentiments.csv', encoding='utf-8-sig') as f:
+            lexicon = {row[0].strip(): float(row[1]) for row in csv.reader(f) if len(row) >= 2}
+        words = {word: score for word, score in lexicon.items() if tokenize(word) == [word]}
+        matchers = [PhraseMatcher(words), PhraseMatcher.from_arrays(*PhraseMatcher(words).to_arrays())]
+        with open(DATA_DIR / 'snow_tweets2014.txt', encoding='utf-8') as f:
+            texts = [line.rstrip('\n').split('\t', 3)[3] for line in f]
+        matched = 0
+        for text in texts:
+            expected = self.token_scores(words, text)
+            matched += bool(expected)
+            for matcher in matchers:
+                self.assertEqual(matcher.scores(text), expected, text)
+        self.assertGreater(matched, len(texts) / 2)
+        # With phrases too, every lexicon word is scored, alone or within a phrase
+        full = PhraseMatcher(lexicon)
+        self.assertGreater(full.max_phrase_length, 1)
+        for text in texts:
+            covered = {i for start, length, _ in full.find(tokenize(text)) for i in range(start, start + length)}
+            unmatched = [word for i, word in enumerate(tokenize(text)) if word in words and i not in covered]
+            self.assertEqual(unmatched, [], text)
+
+
+class StateLocatorTest(unittest.TestCase):
+    def test_batches_locate_as_the_linear_scan(self):
+        import shapely
+        from state_locator import StateLocator
+        locator = StateLocator(str(DATA_DIR / 'states.json'))
+        rng = np.random.default_rng(0)
+        # Anywhere in and around the grid
+        lons = [rng.uniform(locator.x0 - 1, locator.x1 + 1, 20000)]
+        lats = [rng.uniform(locator.y0 - 1, locator.y1 + 1, 20000)]
+        # On state boundaries: vertices, edge midpoints and points just off the vertices
+        rings = shapely.get_coordinates(shapely.boundary(shapely.get_parts(locator.geometries)))
+        chosen = rng.choice(len(rings) - 1, 1000, replace=False)
+        vertices = rings[chosen]
+        midpoints = (vertices + rings[chosen + 1]) / 2
+        jittered = vertices + rng.choice([-1e-7, 1e-7], vertices.shape)
+        for points in (vertices, midpoints, jittered):
+            lons.append(points[:, 0])
+            lats.append(points[:, 1])
+        # On grid cell edges and on the grid's own bounds
+        lons.append(locator.x0 + rng.integers(0, locator.grid.shape[1], 1000) * locator.grid_step)
+        lats.append(locator.y0 + rng.integers(0, locator.grid.shape[0], 1000) * locator.grid_step)
+        lons.append(np.array([locator.x0, locator.x1, locator.x0, locator.x1]))
+        lats.append(np.array([locator.y0, locator.y1, locator.y1, locator.y0]))
+        # Missing coordinates
+        lons.append(np.array([np.nan, -100.0, np.nan]))
+        lats.append(np.array([40.0, np.nan, np.nan]))
+        lats, lons = np.concatenate(lats).tolist(), np.concatenate(lons).tolist()
+
+        expected = [locator._locate_linear(lat, lon) for lat, lon in zip(lats, lons)]
+        self.assertGreater(len(set(expected)), 40)
+        lookups = {}
+        # Twice for memo misses, then hits
+        for _ in range(2):
+            self.assertEqual(locator.locate_many(lats, lons, lookups), expected)
+        self.assertGreater(lookups['point_memo_hits'], 0)
+        locator.memo = ScoringMemo('point', 0)
+        self.assertEqual(locator.locate_many(lats, lons), expected)
+        self.assertEqual([locator.locate(lat, lon) for lat, lon in zip(lats, lons)], expected)
+        self.assertEqual(expected[-3:], ['Unknown'] * 3)
+
+
+class ScoringMemoTest(unittest.TestCase):
+    def test_repeats_are_computed_once(self):
+        memo = ScoringMemo('text', 3)
+        computed, lookups = [], {}
+
+        def compute(keys):
+            def run(positions):
+                computed.extend(keys[i] for i in positions)
+                return [len(keys[i]) for i in positions]
+            return memo.get_many(keys, run, lookups)
+
+        self.assertEqual(compute(['a', 'bb', 'a']), [1, 2, 1])
+        self.assertEqual(compute(['bb', 'ccc', 'dddd']), [2, 3, 4])
+        # 'a' was least recently used
+        self.assertEqual(compute(['a', 'bb']), [1, 2])
+        self.assertEqual(computed, ['a', 'bb', 'ccc', 'dddd', 'a'])
+        self.assertEqual(lookups, {'text_memo_hits': 3, 'text_memo_misses': 5})
+        self.assertEqual(len(memo), 3)
+        # Copies for worker processes start empty
+        self.assertEqual(len(pickle.loads(pickle.dumps(memo))), 0)
+
+    def test_forked_children_get_fresh_memos(self):
+        memo = ScoringMemo('text', 10)
+        memo.get_many(['a'], lambda positions: [1] * len(positions))
+        results = context.Queue()
+
+        def child():
+            results.put((len(memo), memo.get_many(['a', 'b'], lambda positions: [2] * len(positions))))
+
+        # As if another thread were updating the memo at the fork
+        with memo._lock:
+            process = context.Process(target=child)
+            process.start()
+        self.assertEqual(results.get(timeout=10), (0, [2, 2]))
+        process.join()
+        self.assertEqual(len(memo), 1)
+
+    def test_models_agree_without_memos(self):
+        from model_snapshot import load_models
+        with tempfile.TemporaryDirectory() as tmp:
+            models = load_models(SimpleNamespace(snapshot_path=Path(tmp) / 'ModelSnapshot.bin',
+                                                 sentiments_path=DATA_DIR / 'sentiments.csv',
+                                                 states_path=DATA_DIR / 'states.json'))
+        texts, lats, lons = [], [], []
+        with open(DATA_DIR / 'snow_tweets2014.txt', encoding='utf-8') as f:
+            for line in f:
+                coordinates, _, _, text = line.rstrip('\n').split('\t', 3)
+                lat, lon = json.loads(coordinates)
+                texts.append(text)
+                lats.append(lat)
+                lons.append(lon)
+        results = [(models.analyzer.analyze_many(texts), models.locator.locate_many(lats, lons)) for _ in range(2)]
+        models.analyzer.memo = ScoringMemo('text', 0)
+        models.locator.memo = ScoringMemo('point', 0)
+        results.append((models.analyzer.analyze_many(texts), models.locator.locate_many(lats, lons)))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+
+
+class PointIndexTest(unittest.TestCase):
+    def test_rows_in_box(self):
+        from sqlalchemy import column, select, table
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = Storage(Path(tmp) / 'test.db')
+            tweets = table('tweets', column('id'), column('latitude'), column('longitude'))
+            index = point_index('tweets')
+            with storage.writer.begin() as conn:
+                conn.exec_driver_sql('CREATE TABLE tweets (id INTEGER PRIMARY KEY, latitude FLOAT, longitude FLOAT)')
+                conn.exec_driver_sql('INSERT INTO tweets VALUES (?, ?, ?)',
+                                     [(1, 34.05, -118.25), (2, 40.71, -74.0), (3, 51.9, 179.5)])
+                # Rows from before the index are indexed with it, later ones as written
+                self.assertTrue(create_point_index(conn, 'tweets'))
+                self.assertFalse(create_point_index(conn, 'tweets'))
+                conn.exec_driver_sql('INSERT INTO tweets VALUES (4, 34.0500001, -118.25)')
+                index_points(conn, 'tweets', [(4, 34.0500001, -118.25)])
+
+            def ids(bbox, sample=None):
+                query = select(tweets.c.id).join_from(index, tweets, index.c.id == tweets.c.id)
+                with storage.reader.connect() as conn:
+                    return sorted(conn.execute(in_box(query, tweets, index, bbox, sample)).scalars())
+
+            self.assertEqual(ids((-125, 30, -70, 45)), [1, 2, 4])
+            # Exact on the table's coordinates, not the index's 32-bit floats
+            self.assertEqual(ids((-118.3, 34.0, -118.2, 34.05)), [1])
+            self.assertEqual(ids((170, 50, -170, 55)), [3])
+            sampled = ids((-180, -90, 180, 90), 0.5)
+            self.assertEqual(sampled, ids((-180, -90, 180, 90), 0.5))
+            self.assertTrue(0 < len(sampled) < 4)
+            storage.dispose()
+
+
+class SamplingTest(unittest.TestCase):
+    def setUp(self):
+        # The analysis service's module, without putting the service first on the path
+        sys.path.insert(0, str(SERVICES_DIR / 'SentimentAnalysisService'))
+        try:
+            import sampling
+        finally:
+            sys.path.pop(0)
+        self.sampling = sampling
+        rng = np.random.default_rng(0)
+        # Ids of two tables (partitions), with gaps; states are clustered by id
+        ids = {'a': np.arange(1, 3001), 'b': np.arange(10001, 11001, 2)}
+        self.rows = {table: {int(i): (f"S{int(i) // 700 % 4}" if rng.random() < 0.7 else 'S4', float(rng.normal()))
+                             for i in table_ids} for table, table_ids in ids.items()}
+        self.id_ranges = [(table, (int(table_ids[0]), int(table_ids[-1]))) for table, table_ids in ids.items()]
+        pairs = [pair for rows in self.rows.values() for pair in rows.values()]
+        self.means = {state: np.mean([score for s, score in pairs if s == state]) for state, _ in pairs}
+
+    def estimate(self, fraction, seed):
+        sample = self.sampling.BlockSample(self.id_ranges, 25, seed)
+        estimates = self.sampling.StateEstimates()
+        blocks = sample.take(int(sample.blocks * fraction))
+        for table, (first_id, end_id) in blocks:
+            estimates.add_block(self.rows[table][i] for i in range(first_id, end_id) if i in self.rows[table])
+        return blocks, estimates.estimates(0.95, sample.fraction)
+
+    def test_blocks_cover_every_id_once(self):
+        blocks, results = self.estimate(1.0, seed=1)
+        ids = [(table, i) for table, (first_id, end_id) in blocks for i in range(first_id, end_id)]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(all((table, i) in set(ids) for table, rows in self.rows.items() for i in rows))
+        # Every block read: exact means, zero width
+        for state, (mean, half_width, _) in results.items():
+            self.assertAlmostEqual(mean, self.means[state])
+            self.assertEqual(half_width, 0.0)
+
+    def test_intervals_cover_the_means(self):
+        covered = []
+        for seed in range(200):
+            _, results = self.estimate(0.2, seed)
+            covered += [abs(mean - self.means[state]) <= half_width
+                        for state, (mean, half_width, _) in results.items() if half_width is not None]
+        self.assertGreater(np.mean(covered), 0.9)
+
+
+class HttpCacheTest(unittest.TestCase):
+    def test_conditional_and_compressed_responses(self):
+        import gzip
+        from flask import Flask, jsonify
+        app = Flask(__name__)
+        compress_app(app)
+        version = {'tables': 1}
+
+        @app.route('/tables')
+        def tables():
+            etag = make_etag('tables', version['tables'])
+            cached = not_modified(etag)
+            if cached:
+                return cached
+            response = jsonify({'tables': ['a'] * 10})
+            response.set_etag(etag)
+            return response
+
+        client = app.test_client()
+        plain = client.get('/tables')
+        etag = plain.headers['ETag']
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(client.get('/tables', headers={'If-None-Match': etag}).status_code, 304)
+        # Small, but encoded since it has an ETag; the encoding has its own
+        encoded = client.get('/tables', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(encoded.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(encoded.data)), plain.json)
+        self.assertNotEqual(encoded.headers['ETag'], etag)
+        self.assertEqual(client.get('/tables', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code,
+                         200)
+        version['tables'] = 2
+        self.assertEqual(client.get('/tables', headers={'If-None-Match': etag}).status_code, 200)
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.release = threading.Event()
+        self.queue = jobs.JobQueue(Path(self.tmp.name) / 'Jobs.db', {
+            'sum': lambda job: {'sum': sum(job.params['numbers'])},
+            'fail': self.fail_job,
+            'block': self.block_job,
+        }, workers=1)
+        self.queue.init_db()
+        from flask import Flask
+        app = Flask(__name__)
+        app.register_blueprint(jobs.jobs_blueprint(self.queue))
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.release.set()
+        self.tmp.cleanup()
+
+    @staticmethod
+    def fail_job(job):
+        raise ValueError('bad input')
+
+    def block_job(self, job):
+        while not self.release.wait(0.01):
+            job.update({'rows': 1}, force=True)
+        return {}
+
+    def poll(self, job_id, timeout=10):
+        """Poll the job's result route, as clients do, until the job has finished"""
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self.client.get(f'/jobs/{job_id}/result')
+            if response.status_code != 202 or time.monotonic() > deadline:
+                return response.json, response.status_code
+            time.sleep(0.01)
+
+    def test_result_status_and_errors(self):
+        job_id = self.queue.submit('sum', {'numbers': [1, 2, 3]})
+        self.assertEqual(self.poll(job_id), ({'sum': 6}, 200))
+        self.assertEqual(self.queue.get(job_id)['status'], jobs.SUCCEEDED)
+        self.assertEqual(self.poll(self.queue.submit('fail', {})), ({'error': 'bad input'}, 500))
+        self.assertIsNone(self.queue.get('missing'))
+        with self.assertRaises(ValueError):
+            self.queue.submit('unknown', {})
+
+    def test_inline_runs_store_nothing(self):
+        self.assertEqual(self.queue.run('sum', {'numbers': [1, 2, 3]}), ({'sum': 6}, 200))
+        self.assertEqual(self.queue.run('fail', {}), ({'error': 'bad input'}, 500))
+        with self.assertRaises(ValueError):
+            self.queue.run('unknown', {})
+        with self.queue.storage.reader.connect() as conn:
+            self.assertEqual(conn.execute(jobs.jobs.select()).fetchall(), [])
+
+    def test_profiled_jobs_dump_stats(self):
+        import pstats
+        from unittest import mock
+        with mock.patch.object(profiling, 'PROFILE_DIR', Path(self.tmp.name) / 'profiles'):
+            job_id = self.queue.submit('sum', {'numbers': [1, 2], 'profile': 'p1'})
+            self.assertEqual(self.poll(job_id), ({'sum': 3}, 200))
+            stats = pstats.Stats(str(profiling.profile_path('p1')))
+        self.assertTrue(any(function == '<lambda>' for _, _, function in stats.stats))
+
+    def test_cancel_running_and_queued_jobs(self):
+        running = self.queue.submit('block', {})
+        queued = self.queue.submit('sum', {'numbers': []})
+        while self.queue.get(running)['progress'] is None:
+            time.sleep(0.01)
+        # The single worker is busy, so the second job is still queued
+        self.assertEqual(self.queue.cancel(queued)['status'], jobs.CANCELLED)
+        self.assertTrue(self.queue.cancel(running)['cancel_requested'])
+        self.assertEqual(self.poll(running), ({'error': 'Job cancelled'}, 409))
+        self.assertEqual(self.queue.result(queued)[1], 409)
+
+    def test_abandoned_jobs_are_resumed(self):
+        # A job left running by a process that died: no heartbeat since
+        stale = time.time() - 2 * jobs.STALE_AFTER
+        with self.queue.storage.writer.begin() as conn:
+            conn.execute(jobs.jobs.insert().values(
+                id='abandoned', kind='sum', status=jobs.RUNNING, params=json.dumps({'numbers': [4]}),
+                cancel_requested=0, attempts=1, created_at=stale, started_at=stale, heartbeat_at=stale))
+        self.queue.start()
+        self.assertEqual(self.poll('abandoned'), ({'sum': 4}, 200))
+
+
+if __name__ == '__main__':
+    unittest.main()